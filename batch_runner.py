@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import traceback
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Set
+from dotenv import load_dotenv
+from embedding_cache import get_embedding_cache_stats
+from mcp_connected import plan, initial_plan_state
+from mcp_session import MCPSessionManager
+from pipeline import StageTimer, route, answer_respond, select_plan_context
+from profile_registry import default_registry
+from profile_update_queue import get_update_worker
+from tracing import percentile, trace, export_from_env
+
+
+def read_requests(input_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Streams requests from a JSONL file.
+
+    Each line needs a "query" (falling back to "body"); "id" or "request_id"
+    identifies it for resume (the line number otherwise) and an optional
+    "user_id" selects the profile.
+    """
+    with open(input_path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Warning: Skipping malformed line {line_number} in {input_path}")
+                continue
+            yield {
+                "id": str(record.get("id") or record.get("request_id") or line_number),
+                "query": record.get("query") or record.get("body") or "",
+                "user_id": record.get("user_id"),
+            }
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    Returns ids that already have a successful result in the output file.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from an interrupted run
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+
+async def run_request(request: Dict[str, Any], session: MCPSessionManager) -> Dict[str, Any]:
+    """
+    Runs one query through router -> respond/plan and returns its result record.
+
+    Plans run a single turn; follow-up questions are returned, not answered.
+    """
+    timer = StageTimer()
+    sims_file_path = default_registry.path_for(request.get("user_id"))
+    result: Dict[str, Any] = {"id": request["id"], "query": request["query"]}
+
+    try:
+        with trace("request", request_id=request["id"]):
+            result.update(await _run_pipeline(request, sims_file_path, session, timer))
+        timer.mark_answer_ready()
+        failure = _payload_error(result)
+        if failure is None:
+            result["status"] = "ok"
+        else:
+            # plan() and response() report model/tool failures in their payload
+            # instead of raising; these must not count as done on --resume
+            result["status"] = "error"
+            result["error"], result["error_type"] = failure
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["error_type"] = type(e).__name__
+        traceback.print_exc()
+
+    report = timer.report()
+    result["stages"] = report["stages"]
+    result["critical_path_seconds"] = report["critical_path_seconds"]
+    return result
+
+
+def _payload_error(result: Dict[str, Any]):
+    """
+    Returns (message, error_type) if the answer or plan is an error payload, else None.
+    """
+    answer = result.get("answer")
+    if isinstance(answer, str) and answer.startswith("ERROR:"):
+        return answer, "RespondError"
+    if "plan" in result:
+        plan_json = result["plan"]
+        if not isinstance(plan_json, dict):
+            return "Planner returned no JSON response", "PlanError"
+        if plan_json.get("action") == "error":
+            return plan_json.get("task_summary") or "Planner failed", "PlanError"
+    return None
+
+
+async def _run_pipeline(request: Dict[str, Any], sims_file_path: str, session: MCPSessionManager,
+                        timer: StageTimer) -> Dict[str, Any]:
+    result: Dict[str, Any] = {}
+    decision = await route(request["query"], timer)
+    result["action"] = decision.get("action")
+    result["sim_update"] = decision.get("sim_update")
+    if decision.get("sim_update") == 'y':
+        get_update_worker().submit(sims_file_path, request["query"])
+
+    if decision.get("action") == 'respond':
+        result["answer"] = await answer_respond(request["query"], sims_file_path, timer)
+    else:
+        relevant_categories, sim_data = await select_plan_context(request["query"], sims_file_path, timer)
+        result["relevant_categories"] = relevant_categories
+        await session.new_conversation()
+        result["plan"] = await timer.run_async(
+            "plan", plan(request["query"], sim_data, initial_plan_state(), session=session))
+    return result
+
+
+class BatchStats:
+    """
+    Aggregates per-stage latencies and error counts over a batch.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.completed = 0
+        self.skipped = 0
+        self.errors: Counter = Counter()
+        self.stage_latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, result: Dict[str, Any]):
+        self.completed += 1
+        if result.get("status") != "ok":
+            self.errors[result.get("error_type", "Unknown")] += 1
+        for stage, seconds in result.get("stages", {}).items():
+            self.stage_latencies[stage].append(seconds)
+        self.stage_latencies["critical_path"].append(result.get("critical_path_seconds", 0.0))
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "elapsed_seconds": elapsed,
+            "throughput_per_second": self.completed / elapsed if elapsed > 0 else 0.0,
+            "errors": dict(self.errors),
+            "error_count": sum(self.errors.values()),
+            "stages": {
+                stage: {
+                    "count": len(values),
+                    "p50": percentile(values, 50),
+                    "p95": percentile(values, 95),
+                    "p99": percentile(values, 99),
+                }
+                for stage, values in self.stage_latencies.items()
+            },
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [
+            f"Completed {summary['completed']} requests ({summary['skipped']} already done) in "
+            f"{summary['elapsed_seconds']:.1f}s: {summary['throughput_per_second']:.2f} req/s, "
+            f"{summary['error_count']} errors {summary['errors'] or ''}",
+            f"  {'stage':<20} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8}",
+        ]
+        for stage, s in sorted(summary["stages"].items()):
+            lines.append(f"  {stage:<20} {s['count']:>5} {s['p50']:>7.2f}s {s['p95']:>7.2f}s {s['p99']:>7.2f}s")
+        return "\n".join(lines)
+
+
+async def run_batch(input_path: str, output_path: str, concurrency: int = 4,
+                    resume: bool = True) -> BatchStats:
+    """
+    Runs every request of a JSONL file with at most `concurrency` in flight.
+
+    Results are appended to output_path as each request finishes, so an
+    interrupted run can be resumed; requests with an "ok" result are skipped.
+    Each worker owns its own MCP session, since a planning agent keeps
+    conversation state and cannot be shared by concurrent requests.
+    """
+    stats = BatchStats()
+    done = completed_ids(output_path) if resume else set()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    write_lock = asyncio.Lock()
+
+    with open(output_path, 'a' if resume else 'w') as output:
+
+        async def _worker():
+            session = MCPSessionManager()
+            try:
+                while True:
+                    request = await queue.get()
+                    if request is None:
+                        return
+                    result = await run_request(request, session)
+                    async with write_lock:
+                        output.write(json.dumps(result) + "\n")
+                        output.flush()
+                    stats.record(result)
+            finally:
+                await session.close()
+
+        workers = [asyncio.create_task(_worker()) for _ in range(concurrency)]
+        try:
+            for request in read_requests(input_path):
+                if request["id"] in done:
+                    stats.skipped += 1
+                    continue
+                await queue.put(request)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run queries from a JSONL file through the pipeline")
+    parser.add_argument("input_path", help="JSONL file with one {\"query\": ...} per line")
+    parser.add_argument("output_path", help="JSONL file results are appended to")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("BATCH_CONCURRENCY", "4")))
+    parser.add_argument("--no-resume", action="store_true", help="Overwrite the output instead of resuming")
+    args = parser.parse_args()
+
+    load_dotenv()
+    stats = await run_batch(args.input_path, args.output_path, args.concurrency, resume=not args.no_resume)
+    print(stats.format_summary())
+
+    update_worker = get_update_worker()
+    await asyncio.to_thread(update_worker.stop, float(os.getenv("PROFILE_UPDATE_DRAIN_SECONDS", "30")))
+    print(f"Profile updates: {update_worker.stats} queued={update_worker.queue.counts()}")
+    print(f"Embedding cache: {get_embedding_cache_stats()}")
+    export_from_env()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
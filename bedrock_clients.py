@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from tracing import instrument_bedrock_client
+
+
+# Tuned for many concurrent converse calls over long-lived keep-alive connections
+DEFAULT_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "50")),
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=120,
+    retries={"max_attempts": 3, "mode": "adaptive"},
+)
+
+_clients: Dict[Optional[str], object] = {}
+# Every client is built from this session, so they share its credential provider
+_session: Optional[boto3.Session] = None
+_client_override = None
+_lock = threading.Lock()
+_metrics = {
+    "lookups": 0,
+    "constructions": 0,
+    "construction_seconds": 0.0,
+    "requests_sent": 0,
+}
+
+
+def _count_request(**kwargs):
+    _metrics["requests_sent"] += 1
+
+
+def _get_session() -> boto3.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.Session()
+        return _session
+
+
+def get_bedrock_client(region_name: Optional[str] = None):
+    """
+    Returns the process-wide bedrock-runtime client for a region, creating it on first use.
+
+    boto3 clients are thread-safe, so every call site shares one client (and
+    its connection pool) instead of resolving credentials, discovering the
+    endpoint and opening new TLS connections per request.
+
+    Args:
+        region_name: AWS region, or None for the default region resolution
+
+    Returns:
+        A bedrock-runtime client
+    """
+    _metrics["lookups"] += 1
+    if _client_override is not None:
+        return _client_override
+    client = _clients.get(region_name)
+    if client is not None:
+        return client
+
+    session = _get_session()
+    with _lock:
+        client = _clients.get(region_name)
+        if client is None:
+            start = time.perf_counter()
+            client = session.client("bedrock-runtime", region_name=region_name, config=DEFAULT_CLIENT_CONFIG)
+            client.meta.events.register("before-send.bedrock-runtime", _count_request)
+            instrument_bedrock_client(client)
+            _metrics["construction_seconds"] += time.perf_counter() - start
+            _metrics["constructions"] += 1
+            _clients[region_name] = client
+
+    return client
+
+
+def set_client_override(client=None):
+    """
+    Makes get_bedrock_client() return the given client for every region
+    (None restores the real clients). Used by the offline benchmark.
+    """
+    global _client_override
+    _client_override = client
+
+
+def _connections_opened(client) -> Optional[int]:
+    """
+    Counts TCP connections opened by a client's urllib3 pools (None if not inspectable).
+    """
+    # Private botocore/urllib3 internals; any missing link means "unknown"
+    endpoint = getattr(client, "_endpoint", None)
+    http_session = getattr(endpoint, "http_session", None)
+    manager = getattr(http_session, "_manager", None)
+    pools = getattr(manager, "pools", None)
+    if pools is None:
+        return None
+    try:
+        return sum(getattr(pools[key], "num_connections", 0) for key in pools.keys())
+    except (AttributeError, KeyError, TypeError):
+        return None
+
+
+def warm_up(region_names: Optional[List[Optional[str]]] = None, model_id: Optional[str] = None) -> Dict[str, float]:
+    """
+    Builds clients and resolves credentials before the first user query arrives.
+
+    If model_id is given, a one-token converse call is also sent per region so
+    that a pooled TLS connection is already open when real traffic starts.
+
+    Args:
+        region_names: Regions to warm (defaults to the default region only)
+        model_id: Optional model to ping for opening connections
+
+    Returns:
+        Seconds spent warming each region
+    """
+    timings = {}
+
+    for region_name in region_names or [None]:
+        start = time.perf_counter()
+        client = get_bedrock_client(region_name)
+
+        # Resolves the credential chain (env, profile, SSO, instance metadata)
+        # on the session the clients were built from; they share the same
+        # credentials object, so its first refresh happens here
+        credentials = _get_session().get_credentials()
+        if credentials is not None:
+            credentials.get_frozen_credentials()
+
+        if model_id:
+            try:
+                client.converse(
+                    modelId=model_id,
+                    messages=[{"role": "user", "content": [{"text": "ping"}]}],
+                    inferenceConfig={"maxTokens": 1},
+                )
+            except (ClientError, Exception) as e:
+                print(f"Warning: Bedrock warm-up call failed for region '{region_name}': {e}")
+
+        timings[region_name or "default"] = time.perf_counter() - start
+
+    return timings
+
+
+def get_client_metrics() -> Dict[str, float]:
+    """
+    Returns client construction and connection reuse metrics.
+    """
+    connections = [_connections_opened(client) for client in _clients.values()]
+    connections_opened = sum(c for c in connections if c is not None) if connections else 0
+    requests_sent = _metrics["requests_sent"]
+
+    return {
+        "clients": len(_clients),
+        "lookups": _metrics["lookups"],
+        "client_reuses": _metrics["lookups"] - _metrics["constructions"],
+        "constructions": _metrics["constructions"],
+        "construction_seconds": _metrics["construction_seconds"],
+        "requests_sent": requests_sent,
+        "connections_opened": connections_opened,
+        "connection_reuse_rate": max(0.0, 1 - connections_opened / requests_sent) if requests_sent else 0.0,
+    }
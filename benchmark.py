@@ -0,0 +1,553 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+from bedrock_clients import set_client_override
+from embedding_cache import DEFAULT_CACHE_DIR, release_cached_embeddings
+from mcp_connected import plan, initial_plan_state
+from mcp_session import MCPSessionManager
+from mcp_tool_cache import tool_result_cache
+from pipeline import StageTimer, route, answer_respond, select_plan_context
+from profile_registry import default_registry
+from rag_sim import get_top3_relevant_sims
+from sim_update import apply_sim_action
+from tracing import percentile
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE_PATH = os.path.join(REPO_DIR, "benchmark_baseline.json")
+
+BENCHMARK_QUERIES = [
+    "Plan a 5-day trip to Lisbon in May for me and my wife",
+    "What's the best time of year to visit Kyoto?",
+    "I just adopted a dog, find a pet-friendly cabin near Asheville for next weekend",
+    "Do I need a visa to travel to Japan?",
+    "Create an itinerary for a family beach vacation in San Diego with two kids",
+    "What should I pack for a winter trip to Iceland?",
+    "I prefer boutique hotels now. Plan a weekend in Charleston",
+    "Is tipping customary in France?",
+    "Plan a budget backpacking route through Vietnam for three weeks",
+    "Recommend a good neighborhood to stay in Barcelona",
+    "I'm vegetarian, plan a food tour weekend in Austin",
+    "How early should I arrive for an international flight?",
+]
+
+LOCATIONS = ["Lisbon", "Kyoto", "Asheville", "San Diego", "Charleston", "Barcelona", "Austin", "Hanoi"]
+
+
+class LatencyModel:
+    """
+    Samples simulated call latencies in seconds.
+
+    "lognormal" takes a median and sigma (right-skewed like real model calls),
+    "uniform" takes low/high and "fixed" a constant.
+    """
+
+    def __init__(self, distribution: str = "lognormal", median: float = 0.5, sigma: float = 0.3,
+                 low: float = 0.0, high: float = 0.0, scale: float = 1.0, rng: Optional[random.Random] = None):
+        self.distribution = distribution
+        self.median = median
+        self.sigma = sigma
+        self.low = low
+        self.high = high
+        self.scale = scale
+        self.rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], scale: float, rng: random.Random) -> "LatencyModel":
+        return cls(scale=scale, rng=rng, **config)
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.distribution == "fixed":
+                value = self.median
+            elif self.distribution == "uniform":
+                value = self.rng.uniform(self.low, self.high)
+            else:
+                value = self.rng.lognormvariate(np.log(max(self.median, 1e-6)), self.sigma)
+        return value * self.scale
+
+
+# Medians roughly follow what the traces show for the real models
+DEFAULT_LATENCIES = {
+    "router": {"distribution": "lognormal", "median": 0.35, "sigma": 0.25},
+    "sim_update": {"distribution": "lognormal", "median": 1.2, "sigma": 0.3},
+    "sim_plan": {"distribution": "lognormal", "median": 0.45, "sigma": 0.25},
+    "respond": {"distribution": "lognormal", "median": 0.8, "sigma": 0.3},
+    "respond_ttft": {"distribution": "lognormal", "median": 0.25, "sigma": 0.2},
+    "embedding": {"distribution": "lognormal", "median": 0.06, "sigma": 0.2},
+    "planner_step": {"distribution": "lognormal", "median": 1.5, "sigma": 0.35},
+    "mcp_tool": {"distribution": "lognormal", "median": 0.9, "sigma": 0.4},
+}
+
+
+def fake_embedding(text: str, dimensions: int) -> List[float]:
+    """
+    Deterministic hashed bag-of-words vector, so retrieval over fake
+    embeddings still ranks facts that share words with the query first.
+    """
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in text.lower().split():
+        digest = hashlib.md5(word.strip(".,!?").encode("utf-8")).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class FakeBedrockClient:
+    """
+    Stand-in for the bedrock-runtime client with canned payloads and injected latency.
+
+    The payload is chosen from the prompt the pipeline sends: router,
+    sim_update and category-selection prompts get their JSON shapes, anything
+    else gets a short answer. invoke_model serves Titan embeddings.
+    """
+
+    def __init__(self, latencies: Dict[str, LatencyModel]):
+        self.latencies = latencies
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _sleep(self, kind: str):
+        with self._lock:
+            self.calls[kind] += 1
+        time.sleep(self.latencies[kind].sample())
+
+    @staticmethod
+    def _prompt_text(messages: List[Dict]) -> str:
+        return "".join(block.get("text", "") for message in messages for block in message.get("content", []))
+
+    @staticmethod
+    def _classify(text: str) -> str:
+        if "travel query classification" in text:
+            return "router"
+        if "managing personalized user information" in text:
+            return "sim_update"
+        if "characteristic extraction AI" in text:
+            return "sim_plan"
+        return "respond"
+
+    @staticmethod
+    def _payload(kind: str, text: str) -> str:
+        query = text.rsplit("User message:", 1)[-1].lower()
+        if kind == "router":
+            planning = any(word in query for word in ("plan", "itinerary", "route", "find"))
+            personal = any(word in query for word in (" i ", "i'm", " my ", "i just", "i prefer"))
+            return json.dumps({"action": "plan" if planning else "respond", "sim_update": "y" if personal else "n"})
+        if kind == "sim_update":
+            return json.dumps({"action": "add", "additions": [
+                {"fact_id": "", "fact": "The user mentioned a new travel preference.", "category": "Travel"}]})
+        if kind == "sim_plan":
+            return json.dumps({"relevant_categories": ["Travel", "Preferences", "Financial", "Family", "Health"]})
+        return "Based on your preferences, here is a concise recommendation for your trip."
+
+    @staticmethod
+    def _usage(text: str, output: str) -> Dict[str, int]:
+        input_tokens = max(1, len(text) // 4)
+        output_tokens = max(1, len(output) // 4)
+        return {"inputTokens": input_tokens, "outputTokens": output_tokens,
+                "totalTokens": input_tokens + output_tokens}
+
+    def converse(self, modelId: str, messages: List[Dict], **kwargs) -> Dict[str, Any]:
+        text = self._prompt_text(messages)
+        kind = self._classify(text)
+        self._sleep(kind)
+        output = self._payload(kind, text)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": output}]}},
+            "stopReason": "end_turn",
+            "usage": self._usage(text, output),
+            "ResponseMetadata": {"RetryAttempts": 0},
+        }
+
+    def converse_stream(self, modelId: str, messages: List[Dict], **kwargs) -> Dict[str, Any]:
+        text = self._prompt_text(messages)
+        output = self._payload("respond", text)
+        with self._lock:
+            self.calls["respond_stream"] += 1
+        ttft = self.latencies["respond_ttft"].sample()
+        total = max(ttft, self.latencies["respond"].sample())
+        words = output.split(" ")
+
+        def _events():
+            yield {"messageStart": {"role": "assistant"}}
+            time.sleep(ttft)
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep((total - ttft) / len(words))
+                yield {"contentBlockDelta": {"delta": {"text": word + " "}, "contentBlockIndex": 0}}
+            yield {"messageStop": {"stopReason": "end_turn"}}
+            yield {"metadata": {"usage": self._usage(text, output), "metrics": {"latencyMs": int(total * 1000)}}}
+
+        return {"stream": _events(), "ResponseMetadata": {"RetryAttempts": 0}}
+
+    def invoke_model(self, body, modelId: str, **kwargs) -> Dict[str, Any]:
+        request = json.loads(body)
+        self._sleep("embedding")
+        vector = fake_embedding(request.get("inputText", ""), request.get("dimensions", 1024))
+        payload = {"embedding": vector, "inputTextTokenCount": len(request.get("inputText", "")) // 4}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+
+class FakeToolResult:
+    def __init__(self, text: str):
+        self.content = [type("TextContent", (), {"type": "text", "text": text})()]
+        self.isError = False
+
+
+class FakeAirbnbConnector:
+    """
+    Answers airbnb_search / airbnb_listing_details with Airbnb-shaped listings after a simulated delay.
+    """
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.calls = 0
+
+    async def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None, *args, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+        location = (arguments or {}).get("location", "Lisbon")
+        seed = int(hashlib.md5(location.encode("utf-8")).hexdigest()[:8], 16)
+        listings = [{
+            "id": str(seed + i),
+            "url": f"https://www.airbnb.com/rooms/{seed + i}",
+            "demandStayListing": {"description": {"name": f"{location} stay #{i + 1}"},
+                                  "location": {"coordinate": {"latitude": 38.7, "longitude": -9.1}}},
+            "avgRatingA11yLabel": f"{4.5 + (i % 5) / 10:.1f} out of 5 average rating",
+            "structuredDisplayPrice": {"primaryLine": {"accessibilityLabel": f"${120 + 15 * i} per night"}},
+        } for i in range(10)]
+        return FakeToolResult(json.dumps({"searchUrl": f"https://www.airbnb.com/s/{location}/homes",
+                                          "searchResults": listings}))
+
+
+class FakeMCPSession:
+    def __init__(self, connector: FakeAirbnbConnector):
+        self.connector = connector
+        self.is_connected = True
+
+
+class FakeMCPClient:
+    """
+    Mimics MCPClient: one 'airbnb' session whose connector serves canned listings.
+    """
+
+    def __init__(self, latency: LatencyModel):
+        self.latency = latency
+        self.sessions: Dict[str, FakeMCPSession] = {}
+
+    async def create_all_sessions(self):
+        self.sessions = {"airbnb": FakeMCPSession(FakeAirbnbConnector(self.latency))}
+
+    async def close_all_sessions(self):
+        self.sessions = {}
+
+
+class FakePlannerLLM:
+    def __init__(self, step_latency: LatencyModel, steps: int):
+        self.step_latency = step_latency
+        self.steps = steps
+
+
+class FakePlannerAgent:
+    """
+    Mimics MCPAgent.run: alternates simulated LLM steps with Airbnb tool
+    calls, then returns a finished plan as JSON text.
+    """
+
+    def __init__(self, llm: FakePlannerLLM, client: FakeMCPClient, max_steps: int = 30,
+                 memory_enabled: bool = True, system_prompt: str = ""):
+        self.llm = llm
+        self.client = client
+        self.system_prompt = system_prompt
+        self.history: List[str] = []
+
+    def set_system_message(self, message: str):
+        self.system_prompt = message
+
+    def clear_conversation_history(self):
+        self.history = []
+
+    async def run(self, query: str) -> str:
+        self.history.append(query)
+        lowered = query.lower()
+        location = next((place for place in LOCATIONS if place.lower() in lowered), "Lisbon")
+        connector = self.client.sessions["airbnb"].connector
+        for step in range(self.llm.steps):
+            await asyncio.sleep(self.llm.step_latency.sample())
+            if step < self.llm.steps - 1:
+                await connector.call_tool("airbnb_search", {"location": location, "adults": 2})
+        return json.dumps({
+            "task_summary": f"Trip plan for {location}",
+            "followup_required": False,
+            "action": "plan",
+            "followups": [],
+            "answers": f"Here is a {location} plan with three well-rated stays.",
+        })
+
+
+def generate_profile(num_facts: int, template_path: str, output_path: str) -> str:
+    """
+    Writes a synthetic profile with num_facts facts spread over the template's categories.
+    """
+    with open(template_path, 'r') as f:
+        template = json.load(f)
+
+    categories = [name for name, data in template.items() if isinstance(data, dict) and data.get("Facts")]
+    profile = {name: {**template[name], "Facts": []} for name in template}
+    rng = random.Random(num_facts)
+    for i in range(num_facts):
+        category = categories[i % len(categories)]
+        source = rng.choice(template[category]["Facts"])
+        prefix = source["id"].rsplit("_", 1)[0]
+        number = len(profile[category]["Facts"]) + 1
+        profile[category]["Facts"].append({
+            "id": f"{prefix}_{number:03d}",
+            "fact": source["fact"] if number <= len(template[category]["Facts"]) else f"{source['fact']} (note {number})",
+            "timestamps": list(source.get("timestamps", [])),
+        })
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(profile, f, indent=2)
+    return output_path
+
+
+class BenchmarkContext:
+    """
+    Everything a scenario needs for one profile size: the profile path, the
+    process-wide profile registry the pipeline itself loads through, and a
+    factory for per-worker MCP sessions on the fake MCP stack.
+    """
+
+    def __init__(self, sims_file_path: str, latencies: Dict[str, LatencyModel], planner_steps: int,
+                 rag_backend: str):
+        self.sims_file_path = sims_file_path
+        self.registry = default_registry
+        self.latencies = latencies
+        self.planner_steps = planner_steps
+        self.rag_backend = rag_backend
+
+    def session(self) -> MCPSessionManager:
+        return MCPSessionManager(
+            client_factory=lambda config_file: FakeMCPClient(self.latencies["mcp_tool"]),
+            llm_factory=lambda region: FakePlannerLLM(self.latencies["planner_step"], self.planner_steps),
+            agent_factory=FakePlannerAgent,
+        )
+
+
+async def scenario_rag(ctx: BenchmarkContext, query: str, session) -> None:
+    store = ctx.registry.load(ctx.sims_file_path)
+    await asyncio.to_thread(get_top3_relevant_sims, query, ctx.sims_file_path, backend=ctx.rag_backend, store=store)
+
+
+async def scenario_apply(ctx: BenchmarkContext, query: str, session) -> None:
+    store = ctx.registry.load(ctx.sims_file_path)
+    existing_id = store.facts()[0]["id"]
+    action = {
+        "action": "both",
+        "updates": [{"fact_id": existing_id, "fact": store.get(existing_id)["fact"]}],
+        "additions": [{"fact_id": "", "fact": f"Benchmark note: {query}", "category": "Travel"}],
+    }
+    if not await asyncio.to_thread(apply_sim_action, action, ctx.sims_file_path, store):
+        raise RuntimeError(f"apply_sim_action could not save {ctx.sims_file_path}")
+
+
+async def scenario_respond(ctx: BenchmarkContext, query: str, session) -> None:
+    timer = StageTimer()
+    await route(query, timer)
+    await answer_respond(query, ctx.sims_file_path, timer)
+
+
+async def scenario_plan(ctx: BenchmarkContext, query: str, session) -> None:
+    timer = StageTimer()
+    await route(query, timer)
+    _, sim_data = await select_plan_context(query, ctx.sims_file_path, timer)
+    await session.new_conversation()
+    await plan(query, sim_data, initial_plan_state(), session=session)
+
+
+async def scenario_pipeline(ctx: BenchmarkContext, query: str, session) -> None:
+    timer = StageTimer()
+    decision = await route(query, timer)
+    if decision.get("action") == "respond":
+        await answer_respond(query, ctx.sims_file_path, timer)
+    else:
+        _, sim_data = await select_plan_context(query, ctx.sims_file_path, timer)
+        await session.new_conversation()
+        await plan(query, sim_data, initial_plan_state(), session=session)
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "rag": scenario_rag,
+    "apply": scenario_apply,
+    "respond": scenario_respond,
+    "plan": scenario_plan,
+    "pipeline": scenario_pipeline,
+}
+
+
+async def run_scenario(name: str, ctx: BenchmarkContext, queries: List[str], num_requests: int,
+                       concurrency: int) -> Dict[str, Any]:
+    """
+    Runs num_requests calls of a scenario with `concurrency` workers and returns throughput and latency.
+    """
+    scenario = SCENARIOS[name]
+    latencies: List[float] = []
+    errors: Dict[str, int] = defaultdict(int)
+    counter = iter(range(num_requests))
+
+    async def _worker():
+        session = ctx.session()
+        try:
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    await scenario(ctx, queries[i % len(queries)], session)
+                    latencies.append(time.perf_counter() - start)
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+        finally:
+            await session.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[_worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": num_requests,
+        "throughput_per_second": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "errors": dict(errors),
+    }
+
+
+def compare_to_baseline(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]]) -> str:
+    """
+    Formats results next to the stored baseline (throughput and p95 change in percent).
+    """
+    lines = [f"{'run':<34} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'Δreq/s':>8} {'Δp95':>8} {'errors':>6}"]
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base and base["throughput_per_second"] and base["p95"]:
+            throughput_delta = f"{(result['throughput_per_second'] / base['throughput_per_second'] - 1) * 100:+.1f}%"
+            p95_delta = f"{(result['p95'] / base['p95'] - 1) * 100:+.1f}%"
+        else:
+            throughput_delta = p95_delta = "n/a"
+        lines.append(f"{key:<34} {result['throughput_per_second']:>8.2f} {result['p50']:>7.3f}s "
+                     f"{result['p95']:>7.3f}s {result['p99']:>7.3f}s {throughput_delta:>8} {p95_delta:>8} "
+                     f"{sum(result['errors'].values()):>6}")
+    return "\n".join(lines)
+
+
+def reset_caches(workdir: str):
+    """
+    Empties the process-wide MCP tool result and embedding caches, so a run
+    does not start warm from the runs before it.
+    """
+    tool_result_cache.clear()
+    release_cached_embeddings()
+    shutil.rmtree(os.path.join(workdir, DEFAULT_CACHE_DIR), ignore_errors=True)
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark against fake Bedrock and MCP backends")
+    parser.add_argument("--scenarios", default="rag,apply,respond,plan,pipeline",
+                        help=f"Comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per run")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8], help="e.g. 1,8,32")
+    parser.add_argument("--profile-sizes", type=_int_list, default=[70, 1000], help="Facts per profile, e.g. 70,1000")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="Multiplier on every simulated latency")
+    parser.add_argument("--latency-config", help="JSON file overriding DEFAULT_LATENCIES entries")
+    parser.add_argument("--planner-steps", type=int, default=3, help="LLM steps per simulated planning turn")
+    parser.add_argument("--rag-backend", default="numpy", choices=["numpy", "chroma"])
+    parser.add_argument("--queries", help="JSONL file of {\"query\": ...} lines (defaults to built-in queries)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the new baseline")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    latency_config = dict(DEFAULT_LATENCIES)
+    if args.latency_config:
+        with open(args.latency_config, 'r') as f:
+            latency_config.update(json.load(f))
+    rng = random.Random(args.seed)
+    latencies = {kind: LatencyModel.from_config(config, args.latency_scale, rng)
+                 for kind, config in latency_config.items()}
+
+    queries = BENCHMARK_QUERIES
+    if args.queries:
+        with open(args.queries, 'r') as f:
+            queries = [json.loads(line).get("query", "") for line in f if line.strip()]
+
+    template_path = os.path.join(REPO_DIR, "sim.json")
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    # Every relative path the pipeline writes (embedding cache, indexes,
+    # router logs, profiles) lands in a scratch directory, so fake vectors
+    # and profiles never mix with real ones.
+    workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    os.environ.update({"ROUTER_CACHE": "off", "ROUTER_FAST_PATH": "off", "RAG_BACKEND": args.rag_backend})
+    set_client_override(FakeBedrockClient(latencies))
+
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for num_facts in args.profile_sizes:
+            for concurrency in args.concurrency:
+                for name in args.scenarios.split(","):
+                    # A fresh profile per run, so apply runs don't grow the next run's profile
+                    sims_file_path = generate_profile(
+                        num_facts, template_path,
+                        os.path.join(workdir, "profiles", f"{name}-{num_facts}-{concurrency}.json"))
+                    reset_caches(workdir)
+                    ctx = BenchmarkContext(sims_file_path, latencies, args.planner_steps, args.rag_backend)
+                    key = f"{name}/facts={num_facts}/c={concurrency}"
+                    print(f"Running {key}...")
+                    results[key] = await run_scenario(name, ctx, queries, args.requests, concurrency)
+    finally:
+        set_client_override(None)
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = json.load(f).get("results", {})
+    print(compare_to_baseline(results, baseline))
+
+    # Where results were read from and written to is not part of the run's setup
+    run_args = {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "output")}
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "args": run_args,
+              "latencies": latency_config, "results": results}
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Saved baseline to {baseline_path}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
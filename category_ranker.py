@@ -0,0 +1,165 @@
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from embedding_cache import get_cached_embeddings
+from numpy_retriever import top_k_indices, _normalize_rows
+from sim_index import collect_fact_entries, content_hash
+
+
+# One ranker per profile path for the whole process
+_rankers: Dict[str, "CategoryRanker"] = {}
+
+# A category's score blends how well the query matches its Description with
+# how well it matches the category's best facts
+DESCRIPTION_WEIGHT = 0.4
+TOP_FACTS_PER_CATEGORY = 2
+
+
+def description_text(category_name: str, category_data: Dict) -> str:
+    """
+    Builds the embedded text for a category's Description.
+    """
+    return f"{category_name}: {category_data.get('Description', '')}"
+
+
+class CategoryRanker:
+    """
+    Ranks profile categories against a query with one matrix-vector product.
+
+    Every category Description and every fact is embedded once (facts use the
+    same text as the RAG index, so their vectors come from the shared
+    embedding cache). A category scores
+    DESCRIPTION_WEIGHT * sim(description) + (1 - DESCRIPTION_WEIGHT) * mean of
+    its TOP_FACTS_PER_CATEGORY best fact similarities.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.categories: List[str] = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        # (n_categories, max facts) row indices into matrix, -1 for padding
+        self.fact_rows = np.zeros((0, 0), dtype=np.int64)
+        self._hashes: Dict[str, str] = {}
+        # build() swaps the four fields together; readers take them together
+        self._lock = threading.Lock()
+
+    def build(self, sims_data: Dict, entries: Optional[Dict[str, Dict[str, Any]]] = None) -> bool:
+        """
+        Embeds the profile's descriptions and facts into the matrix.
+
+        Args:
+            sims_data: The full SIM JSON structure with categories
+            entries: Fact entries (output of sim_index.collect_fact_entries) if already collected
+
+        Returns:
+            True if the matrix was rebuilt, False if the profile was unchanged
+        """
+        entries = entries if entries is not None else collect_fact_entries(sims_data)
+        categories = [name for name, data in sims_data.items() if isinstance(data, dict)]
+        texts = [description_text(name, sims_data[name]) for name in categories]
+        hashes = {f"description:{name}": content_hash(text) for name, text in zip(categories, texts)}
+        hashes.update({key: entry["hash"] for key, entry in entries.items()})
+        with self._lock:
+            if hashes == self._hashes and categories == self.categories:
+                return False
+
+        positions = {name: i for i, name in enumerate(categories)}
+        rows_by_category: List[List[int]] = [[] for _ in categories]
+        for entry in entries.values():
+            if entry["category"] in positions:
+                rows_by_category[positions[entry["category"]]].append(len(texts))
+                texts.append(entry["text"])
+
+        width = max((len(rows) for rows in rows_by_category), default=0)
+        fact_rows = np.full((len(categories), width), -1, dtype=np.int64)
+        for i, rows in enumerate(rows_by_category):
+            fact_rows[i, :len(rows)] = rows
+
+        if texts:
+            vectors = self.embeddings.embed_documents(texts)
+            matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            self.categories = categories
+            self.matrix = np.ascontiguousarray(matrix)
+            self.fact_rows = fact_rows
+            self._hashes = hashes
+        return True
+
+    def _snapshot(self) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        with self._lock:
+            return self.categories, self.matrix, self.fact_rows
+
+    def score(self, query: str) -> np.ndarray:
+        """
+        Returns one score per category (in self.categories order).
+        """
+        return self._score(query)[1]
+
+    def _score(self, query: str) -> Tuple[List[str], np.ndarray]:
+        categories, matrix, fact_rows = self._snapshot()
+        if not categories:
+            return categories, np.zeros(0, dtype=np.float32)
+        query_vector = _normalize_rows(np.asarray(self.embeddings.embed_query(query), dtype=np.float32))
+        similarities = matrix @ query_vector
+
+        description_scores = similarities[:len(categories)]
+        if fact_rows.shape[1] == 0:
+            return categories, description_scores
+
+        fact_scores = np.where(fact_rows >= 0, similarities[fact_rows], -np.inf)
+        top = min(TOP_FACTS_PER_CATEGORY, fact_scores.shape[1])
+        best = -np.partition(-fact_scores, top - 1, axis=1)[:, :top]
+        # Categories with fewer facts than `top` average only the facts they have
+        counts = np.maximum((best > -np.inf).sum(axis=1), 1)
+        best_facts = np.where(best > -np.inf, best, 0.0).sum(axis=1) / counts
+        best_facts = np.where(fact_rows[:, 0] >= 0, best_facts, description_scores)
+        return categories, DESCRIPTION_WEIGHT * description_scores + (1 - DESCRIPTION_WEIGHT) * best_facts
+
+    def rank(self, query: str, k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Returns the top-k (category, score) pairs, best first.
+        """
+        categories, scores = self._score(query)
+        return [(categories[i], float(scores[i])) for i in top_k_indices(scores, k)]
+
+
+def is_ambiguous(ranked: List[Tuple[str, float]], k: int, margin: float) -> bool:
+    """
+    True if the k-th and (k+1)-th categories are within `margin` of each other,
+    i.e. the cut-off between selected and dropped categories is a coin flip.
+    """
+    return len(ranked) > k and ranked[k - 1][1] - ranked[k][1] < margin
+
+
+def get_category_ranker(sims_file_path: str = "sim.json",
+                        aws_region: str = "us-east-1",
+                        embeddings=None) -> CategoryRanker:
+    """
+    Returns the process-wide category ranker for a profile, creating it on first use.
+
+    Args:
+        sims_file_path: Path to the sim.json file the ranker belongs to
+        aws_region: AWS region for Bedrock
+        embeddings: Override for the embedding function
+
+    Returns:
+        The CategoryRanker for this profile
+    """
+    if sims_file_path not in _rankers:
+        _rankers[sims_file_path] = CategoryRanker(embeddings or get_cached_embeddings(aws_region))
+    return _rankers[sims_file_path]
+
+
+def release_category_ranker(sims_file_path: str):
+    """
+    Drops the ranker of a profile, freeing its embedding matrix.
+    """
+    _rankers.pop(sims_file_path, None)
+
+
+def tie_margin() -> float:
+    return float(os.getenv("CATEGORY_TIE_MARGIN", "0.02"))
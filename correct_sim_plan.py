@@ -1,38 +1,101 @@
-import boto3
+from bedrock_clients import get_bedrock_client
 from botocore.exceptions import ClientError
 import json
-from typing import Dict, List, Any
-
-def fetch_relevant_categories(category_names, sims_file_path="sim.json"):
+import os
+from typing import Dict, List, Any, Optional
+from category_ranker import get_category_ranker, is_ambiguous, tie_margin
+from fact_store import FactStore
+from profile_registry import default_registry
+from sim_sqlite import is_sqlite_path, fetch_categories
+
+def fetch_relevant_categories(category_names, sims_file_path="sim.json", store: Optional[FactStore] = None):
     """
     Fetch the actual category data from sim.json based on category names.
 
     Args:
         category_names: List of category names to fetch
         sims_file_path: Path to the sim.json file
+        store: Already loaded FactStore to read from instead of the file
 
     Returns:
         Dictionary containing only the relevant categories and their data
     """
-    with open(sims_file_path, 'r') as f:
-        all_sims = json.load(f)
+    if store is None and is_sqlite_path(sims_file_path):
+        # Indexed per-category read instead of loading the whole profile
+        return fetch_categories(category_names, sims_file_path)
 
-    relevant_data = {}
-    for category in category_names:
-        if category in all_sims:
-            relevant_data[category] = all_sims[category]
+    store = store or default_registry.load(sims_file_path)
+    return store.categories(category_names)
 
-    return relevant_data
 
+def sim_plan(query, sims_file_path: str = "sim.json", store: Optional[FactStore] = None,
+             top_k: int = 5, selector: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Picks the top_k profile categories most relevant to the query.
 
-def sim_plan(query, sims_file_path: str="sim.json"):
-    brt = boto3.client("bedrock-runtime")
+    Args:
+        query: The user's query
+        sims_file_path: Path to the sim.json file
+        store: Already loaded FactStore to read from instead of the file
+        top_k: Number of categories to return
+        selector: "embedding" (local ranker only), "hybrid" (ranker, with the
+            LLM choosing among the near-tied categories at the top_k cut-off)
+            or "llm" (LLM only, with the ranker as fallback if the call fails).
+            Defaults to the CATEGORY_SELECTOR environment variable, then "embedding".
+
+    Returns:
+        {"relevant_categories": [...], "scores": {category: score}, "method": ...}
+    """
+    selector = selector or os.getenv("CATEGORY_SELECTOR", "embedding")
+    store = store or default_registry.load(sims_file_path)
+    sims_data = store.view()
+
+    if selector == "llm":
+        llm_result = select_categories_llm(query, sims_data)
+        if isinstance(llm_result, dict):
+            return llm_result
+        print(f"Warning: LLM category selection failed, using embedding ranking ({llm_result})")
+
+    ranker = get_category_ranker(sims_file_path)
+    ranker.build(sims_data, store.fact_entries())
+    ranked = ranker.rank(query, k=len(ranker.categories))
+    result = {
+        "relevant_categories": [name for name, _ in ranked[:top_k]],
+        "scores": {name: round(score, 4) for name, score in ranked[:top_k]},
+        "method": "embedding",
+    }
+
+    margin = tie_margin()
+    if selector == "hybrid" and is_ambiguous(ranked, top_k, margin):
+        # Categories clearly above the best dropped one keep their place; only
+        # the ones within the tie window around the cut-off go to the LLM
+        winners = [name for name, score in ranked if score > ranked[top_k][1] + margin]
+        contested = [name for name, score in ranked
+                     if name not in winners and score >= ranked[top_k - 1][1] - margin]
+        slots = top_k - len(winners)
+        llm_result = select_categories_llm(query, {name: sims_data[name] for name in contested}, count=slots)
+        if isinstance(llm_result, dict):
+            picked = [name for name in llm_result.get("relevant_categories", []) if name in contested]
+            ordered = picked + [name for name in contested if name not in picked]
+            result["relevant_categories"] = winners + ordered[:slots]
+            result["scores"] = {name: round(dict(ranked)[name], 4) for name in result["relevant_categories"]}
+            result["method"] = "embedding+llm"
+        else:
+            print(f"Warning: LLM tie-break failed, keeping embedding ranking ({llm_result})")
+
+    return result
+
+
+def select_categories_llm(query, sims_data: Dict, count: int = 5):
+    """
+    Asks the LLM to pick the `count` most relevant categories out of the given profile data.
+    """
+    brt = get_bedrock_client()
 
     model_id = "meta.llama3-1-8b-instruct-v1:0"
-    with open(sims_file_path, 'r') as f:
-        sims_data = json.load(f)
-    
-    user_characteristics = sims_data.get('user_characteristics', {})
+
+    # Categories are the top-level keys of the profile
+    user_characteristics = {name: data for name, data in sims_data.items() if isinstance(data, dict)}
     print(f"Fetched {len(user_characteristics)} category/categories")
     
     # Build complete user profile with all facts
@@ -50,7 +113,7 @@ def sim_plan(query, sims_file_path: str="sim.json"):
     system_message = """You are a characteristic extraction AI that analyzes user queries and identifies the most relevant user characteristic CATEGORIES needed to provide personalized responses.
 
 TASK:
-Extract the top 5 most relevant user characteristic CATEGORIES from the available profile data that are needed to answer the user's query accurately and personally.
+Extract the top {count} most relevant user characteristic CATEGORIES from the available profile data that are needed to answer the user's query accurately and personally.
 
 INPUT FORMAT:
 You will receive user profile data structured as a JSON object with categories as keys. Each category contains:
@@ -87,7 +150,7 @@ INSTRUCTIONS:
 2. Review the COMPLETE USER PROFILE DATA below to understand all available facts
 3. Identify which CATEGORIES contain facts most relevant to answering the query
 4. Prioritize categories that directly impact the answer
-5. Return exactly 5 category names in order of relevance (most relevant first)
+5. Return exactly {count} category names in order of relevance (most relevant first)
 6. Output ONLY a valid JSON object, nothing else
 
 AVAILABLE CATEGORIES SUMMARY:
@@ -174,7 +237,7 @@ Expected Output:
 }}
 
 CRITICAL: Your output must be ONLY valid JSON in the exact format shown above with:
-- "relevant_categories": an array of exactly 5 category names (strings)
+- "relevant_categories": an array of exactly {count} category names (strings)
 - "reasoning": a single string explaining the relevance
 
 Now analyze the following:
@@ -188,6 +251,7 @@ Return ONLY the JSON response, no other text."""
         {
             "role": "user",
             "content": [{"text": system_message.format(
+                count=count,
                 available_categories=available_categories_str,
                 user_profile=user_profile_str,
                 user_query=query
@@ -205,6 +269,7 @@ Return ONLY the JSON response, no other text."""
         response_text = response["output"]["message"]["content"][0]["text"]
         # Parse the JSON response before returning
         parsed_response = json.loads(response_text)
+        parsed_response["method"] = "llm"
         return parsed_response
 
     except (ClientError, Exception) as e:
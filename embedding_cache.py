@@ -0,0 +1,353 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_aws import BedrockEmbeddings
+from bedrock_clients import get_bedrock_client
+from sim_storage import file_lock
+
+
+DEFAULT_MODEL_ID = "amazon.titan-embed-text-v2:0"
+DEFAULT_DIMENSIONS = 1024
+DEFAULT_CACHE_DIR = ".embedding_cache"
+
+# One cache per (model, dimensions, region) for the whole process
+_shared_embeddings: Dict[Tuple[str, int, str], "CachedEmbeddings"] = {}
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text before hashing so trivially different strings share an entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def embedding_key(model_id: str, dimensions: int, text: str) -> str:
+    """
+    Returns the content address of an embedding: model id, dimension and normalized text.
+    """
+    payload = f"{model_id}|{dimensions}|{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _fingerprint(key: str) -> int:
+    """
+    64-bit tag of a content key, stored next to its vector (never 0, which marks an empty slot).
+    """
+    return int(key[:16], 16) or 1
+
+
+class EmbeddingStore:
+    """
+    Fixed-capacity on-disk vector store, shareable by several processes.
+
+    Vectors live in a memory-mapped (capacity x dimensions) array. Slot
+    assignments are appended to 'index.log' as one "<key> <slot>" line each,
+    so a new entry costs one short append rather than rewriting the whole
+    index; the log is rewritten only once it holds several times more lines
+    than the store has slots. Each process keeps the index in memory in
+    least-recently-used order and replays lines other processes appended.
+
+    Slots are claimed under an exclusive file lock, and every slot also
+    stores a fingerprint of its key in 'keys.bin'. A reader whose in-memory
+    index is stale (another process reused the slot) sees a fingerprint
+    mismatch and treats the lookup as a miss instead of returning another
+    text's vector.
+    """
+
+    def __init__(self, directory: str, dimensions: int, max_entries: int = 20000, dtype: str = "float16"):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._keys_path = os.path.join(directory, "keys.bin")
+        self._log_path = os.path.join(directory, "index.log")
+        self._lock_path = os.path.join(directory, "index.lock")
+
+        self.index: "OrderedDict[str, int]" = OrderedDict()
+        self._slot_keys: Dict[int, str] = {}
+        self._free_slots: List[int] = []
+        self._log_offset = 0
+        self._log_inode: Optional[int] = None
+        self._log_lines = 0
+        self._open()
+
+    def _layout(self) -> Dict:
+        return {"dimensions": self.dimensions, "dtype": self.dtype.name, "max_entries": self.max_entries}
+
+    def _header(self) -> str:
+        return json.dumps({"layout": self._layout()}) + "\n"
+
+    def _open(self):
+        with file_lock(self._lock_path):
+            header = None
+            if all(os.path.exists(p) for p in (self._vectors_path, self._keys_path, self._log_path)):
+                try:
+                    with open(self._log_path, 'r') as f:
+                        header = json.loads(f.readline())
+                except (json.JSONDecodeError, OSError):
+                    print(f"Warning: Could not read {self._log_path}, starting an empty embedding cache")
+
+            mode = "r+" if header and header.get("layout") == self._layout() else "w+"
+            self.vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode=mode,
+                                     shape=(self.max_entries, self.dimensions))
+            self.keys = np.memmap(self._keys_path, dtype=np.uint64, mode=mode, shape=(self.max_entries,))
+            if mode == "w+":
+                with open(self._log_path, 'w') as f:
+                    f.write(self._header())
+
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+        self._catch_up()
+
+    def _catch_up(self):
+        """
+        Applies index lines appended (by any process) since the last call.
+        """
+        try:
+            stat = os.stat(self._log_path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._log_inode:
+            # First read, or the log was rewritten: rebuild the index from it
+            self.index.clear()
+            self._slot_keys.clear()
+            self._free_slots = list(range(self.max_entries - 1, -1, -1))
+            self._log_inode, self._log_offset, self._log_lines = stat.st_ino, 0, 0
+        if stat.st_size <= self._log_offset:
+            return
+
+        with open(self._log_path, 'rb') as f:
+            f.seek(self._log_offset)
+            chunk = f.read(stat.st_size - self._log_offset)
+        # Only complete lines; a line still being written is picked up next time
+        chunk = chunk[:chunk.rfind(b"\n") + 1]
+        for line in chunk.decode("utf-8").splitlines():
+            if line.startswith("{"):
+                # Layout header
+                continue
+            self._log_lines += 1
+            key, _, slot = line.partition(" ")
+            if slot.isdigit() and int(slot) < self.max_entries:
+                self._assign(key, int(slot))
+        self._log_offset += len(chunk)
+
+    def _assign(self, key: str, slot: int):
+        previous = self._slot_keys.get(slot)
+        if previous is not None and previous != key:
+            self.index.pop(previous, None)
+        old_slot = self.index.get(key)
+        if old_slot is not None and old_slot != slot:
+            self._slot_keys.pop(old_slot, None)
+            self._free_slots.append(old_slot)
+        self._slot_keys[slot] = key
+        self.index[key] = slot
+        self.index.move_to_end(key)
+
+    def _read(self, key: str) -> Optional[np.ndarray]:
+        slot = self.index.get(key)
+        if slot is None:
+            return None
+        expected = _fingerprint(key)
+        if int(self.keys[slot]) != expected:
+            return None
+        vector = np.array(self.vectors[slot], dtype=np.float32)
+        # The slot may have been rewritten by another process while copying
+        if int(self.keys[slot]) != expected:
+            return None
+        self.index.move_to_end(key)
+        return vector
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._read(key)
+            if vector is None:
+                # Another process may have embedded it since the last catch-up
+                self._catch_up()
+                vector = self._read(key)
+            return vector
+
+    def _take_slot(self) -> int:
+        while self._free_slots:
+            slot = self._free_slots.pop()
+            if slot not in self._slot_keys:
+                return slot
+        _, slot = self.index.popitem(last=False)
+        self._slot_keys.pop(slot, None)
+        self.evictions += 1
+        return slot
+
+    def put(self, key: str, vector: List[float]):
+        with self._lock, file_lock(self._lock_path):
+            self._catch_up()
+            slot = self.index.get(key)
+            if slot is None or int(self.keys[slot]) != _fingerprint(key):
+                slot = self._take_slot() if slot is None else slot
+                # Invalidate first so concurrent readers of the old key miss, then fill
+                self.keys[slot] = 0
+                self.vectors[slot] = np.asarray(vector, dtype=self.dtype)
+                self.keys[slot] = _fingerprint(key)
+                line = f"{key} {slot}\n".encode("utf-8")
+                with open(self._log_path, 'ab') as f:
+                    f.write(line)
+                self._log_offset += len(line)
+                self._log_lines += 1
+            self._assign(key, slot)
+            if self._log_lines > 4 * self.max_entries:
+                self._rewrite_log()
+
+    def _rewrite_log(self):
+        """
+        Replaces the log with one line per live entry (caller holds the file lock).
+        """
+        text = self._header() + "".join(f"{key} {slot}\n" for key, slot in self.index.items())
+        tmp_path = self._log_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, self._log_path)
+        stat = os.stat(self._log_path)
+        self._log_inode, self._log_offset, self._log_lines = stat.st_ino, stat.st_size, len(self.index)
+
+    def flush(self):
+        """
+        Writes dirty vector pages to disk; index lines are already appended by put().
+        """
+        with self._lock:
+            self.vectors.flush()
+            self.keys.flush()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an EmbeddingStore.
+
+    Only texts never seen before (for this model and dimension) are sent to
+    the wrapped embeddings; query and document embeddings share entries since
+    Titan embeds both the same way.
+    """
+
+    def __init__(self, embeddings: Embeddings, store: EmbeddingStore, model_id: str = DEFAULT_MODEL_ID):
+        self.embeddings = embeddings
+        self.store = store
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return embedding_key(self.model_id, self.store.dimensions, text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        pending: Dict[str, List[int]] = {}
+
+        for i, text in enumerate(texts):
+            key = self._key(text)
+            cached = self.store.get(key)
+            if cached is not None:
+                self.hits += 1
+                results[i] = cached.tolist()
+            else:
+                # Identical texts within one call are embedded once
+                pending.setdefault(key, []).append(i)
+
+        if pending:
+            self.misses += len(pending)
+            miss_keys = list(pending)
+            vectors = self.embeddings.embed_documents([texts[pending[key][0]] for key in miss_keys])
+            for key, vector in zip(miss_keys, vectors):
+                self.store.put(key, vector)
+                for i in pending[key]:
+                    results[i] = list(vector)
+            self.store.flush()
+
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        cached = self.store.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached.tolist()
+
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self.store.put(key, vector)
+        self.store.flush()
+        return list(vector)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns hit/miss counters for this cache.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.store),
+            "evictions": self.store.evictions,
+        }
+
+
+def get_cached_embeddings(aws_region: str = "us-east-1",
+                          model_id: str = DEFAULT_MODEL_ID,
+                          dimensions: int = DEFAULT_DIMENSIONS,
+                          cache_dir: str = DEFAULT_CACHE_DIR,
+                          max_entries: int = 20000,
+                          dtype: str = "float16") -> CachedEmbeddings:
+    """
+    Returns the process-wide cached Bedrock embeddings for a model and dimension.
+
+    Args:
+        aws_region: AWS region for Bedrock
+        model_id: Bedrock embedding model id
+        dimensions: Output dimensions requested from the model
+        cache_dir: Root directory of the on-disk cache
+        max_entries: Maximum number of cached vectors before LRU eviction
+        dtype: Storage type for vectors ("float16" or "float32")
+
+    Returns:
+        A CachedEmbeddings instance shared by all retrieval paths
+    """
+    key = (model_id, dimensions, aws_region)
+
+    if key not in _shared_embeddings:
+        bedrock = BedrockEmbeddings(
+            client=get_bedrock_client(aws_region),
+            model_id=model_id,
+            region_name=aws_region,
+            model_kwargs={"dimensions": dimensions}
+        )
+        store_dir = os.path.join(cache_dir, f"{model_id.replace(':', '_')}-{dimensions}")
+        store = EmbeddingStore(store_dir, dimensions, max_entries=max_entries, dtype=dtype)
+        _shared_embeddings[key] = CachedEmbeddings(bedrock, store, model_id=model_id)
+
+    return _shared_embeddings[key]
+
+
+def release_cached_embeddings():
+    """
+    Drops every process-wide cached embeddings instance; the on-disk caches are kept.
+    """
+    _shared_embeddings.clear()
+
+
+def get_embedding_cache_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns hit/miss stats of every process-wide cached embeddings instance,
+    keyed by "model/dimensions/region".
+    """
+    return {f"{model_id}/{dimensions}/{region}": embeddings.stats()
+            for (model_id, dimensions, region), embeddings in list(_shared_embeddings.items())}
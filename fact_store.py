@@ -0,0 +1,309 @@
+import re
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sim_index import collect_fact_entries
+from sim_storage import load_sims_from_file, save_sims_to_file
+
+
+# Fallback prefix -> category map for ids whose prefix is not yet in the profile
+DEFAULT_CATEGORY_PREFIXES = {
+    'travel': 'Travel',
+    'health': 'Health',
+    'family': 'Family',
+    'pet': 'Pets',
+    'hobby': 'Hobbies',
+    'work': 'Work',
+    'financial': 'Financial',
+    'education': 'Education',
+    'lifestyle': 'Lifestyle',
+    'social': 'Social',
+    'personality': 'Personality',
+    'values': 'Values',
+    'preferences': 'Preferences'
+}
+
+_FACT_ID_PATTERN = re.compile(r"^(.*)_(\d+)$")
+
+
+class ReadOnlyDict(dict):
+    """
+    A dict that refuses mutation. Still a dict, so json.dumps and isinstance checks work.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Profile snapshots are read-only; change facts through FactStore.apply_batch")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+class ReadOnlyList(list):
+    """
+    A list that refuses mutation.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Profile snapshots are read-only; change facts through FactStore.apply_batch")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+
+
+def freeze(value: Any) -> Any:
+    """
+    Returns a read-only deep copy of a JSON-like structure.
+    """
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return ReadOnlyList(freeze(item) for item in value)
+    return value
+
+
+def split_fact_id(fact_id: str) -> Tuple[str, Optional[int]]:
+    """
+    Splits 'travel_010' into ('travel', 10); ids without a numeric suffix give (id, None).
+    """
+    match = _FACT_ID_PATTERN.match(fact_id or "")
+    if not match:
+        return fact_id, None
+    return match.group(1), int(match.group(2))
+
+
+class FactStore:
+    """
+    In-memory profile with an id -> (category, position) index.
+
+    The profile is parsed once; lookups by fact id are O(1), the highest id
+    number per prefix is tracked so new ids can be allocated locally, and a
+    batch of adds/updates/deletes is applied in a single pass. Readers
+    (flatten_sims_for_llm, fetch_relevant_categories, rag_sim) accept a
+    FactStore in place of re-reading sim.json.
+
+    The store is shared by concurrent requests while a background writer
+    applies updates, so readers get view(): a read-only snapshot rebuilt
+    only when the version (bumped under the lock by every write) changes.
+    """
+
+    def __init__(self, sims_data: Dict, filepath: Optional[str] = None):
+        self.data = sims_data
+        self.filepath = filepath
+        self.version = 0
+        self._lock = threading.RLock()
+        self._view: Optional[Dict] = None
+        self._view_version = -1
+        self._index: Dict[str, Tuple[str, int]] = {}
+        self._max_ids: Dict[str, int] = {}
+        self._id_width: Dict[str, int] = {}
+        self._prefix_categories: Dict[str, str] = {}
+        self._category_prefixes: Dict[str, str] = {}
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._reindex()
+
+    @classmethod
+    def load(cls, filepath: str = "sim.json") -> "FactStore":
+        """
+        Loads a profile file into a new FactStore.
+        """
+        return cls(load_sims_from_file(filepath), filepath)
+
+    def _reindex(self):
+        self._index.clear()
+        for category, category_data in self.data.items():
+            if isinstance(category_data, dict) and isinstance(category_data.get("Facts"), list):
+                for position, fact_obj in enumerate(category_data["Facts"]):
+                    self._index_fact(category, position, fact_obj)
+
+    def _index_fact(self, category: str, position: int, fact_obj: Dict):
+        fact_id = fact_obj.get("id", "")
+        if not fact_id:
+            return
+        # Keep the first occurrence of a repeated id, matching the original linear scan
+        self._index.setdefault(fact_id, (category, position))
+
+        prefix, number = split_fact_id(fact_id)
+        if number is not None:
+            self._prefix_categories.setdefault(prefix, category)
+            self._category_prefixes.setdefault(category, prefix)
+            if number > self._max_ids.get(prefix, 0):
+                self._max_ids[prefix] = number
+            self._id_width[prefix] = max(self._id_width.get(prefix, 3), len(fact_id) - len(prefix) - 1)
+
+    def _changed(self):
+        self.version += 1
+        self._entries = None
+
+    def view(self) -> Dict:
+        """
+        Returns a read-only snapshot of the profile, shared until the next change.
+        """
+        with self._lock:
+            if self._view is None or self._view_version != self.version:
+                self._view = freeze(self.data)
+                self._view_version = self.version
+            return self._view
+
+    def get(self, fact_id: str) -> Optional[Dict]:
+        """
+        Returns the fact object for an id, or None.
+        """
+        location = self._index.get(fact_id)
+        if location is None:
+            return None
+        category, position = location
+        return self.data[category]["Facts"][position]
+
+    def locate(self, fact_id: str) -> Optional[Tuple[str, int]]:
+        """
+        Returns (category, position) of a fact id, or None.
+        """
+        return self._index.get(fact_id)
+
+    def category_for_fact_id(self, fact_id: str) -> str:
+        """
+        Maps a fact id to its category using the prefixes seen in the profile,
+        then the default prefix map, then 'Lifestyle'.
+        """
+        if fact_id in self._index:
+            return self._index[fact_id][0]
+        prefix, _ = split_fact_id(fact_id)
+        prefix = prefix.split('_')[0] if prefix not in self._prefix_categories else prefix
+        return self._prefix_categories.get(prefix) or DEFAULT_CATEGORY_PREFIXES.get(prefix, 'Lifestyle')
+
+    def next_id(self, category: str) -> str:
+        """
+        Allocates the next unused fact id for a category (e.g. 'travel_011').
+        """
+        prefix = self._category_prefixes.get(category)
+        if prefix is None:
+            defaults = {cat: pre for pre, cat in DEFAULT_CATEGORY_PREFIXES.items()}
+            prefix = defaults.get(category, category.lower())
+            self._category_prefixes[category] = prefix
+            self._prefix_categories.setdefault(prefix, category)
+
+        number = self._max_ids.get(prefix, 0) + 1
+        self._max_ids[prefix] = number
+        return f"{prefix}_{number:0{self._id_width.get(prefix, 3)}d}"
+
+    def high_water_marks(self) -> Dict[str, str]:
+        """
+        Returns the highest id per prefix, e.g. {"travel": "travel_010"}.
+        """
+        return {
+            prefix: f"{prefix}_{number:0{self._id_width.get(prefix, 3)}d}"
+            for prefix, number in self._max_ids.items()
+        }
+
+    def facts(self) -> List[Dict]:
+        """
+        Returns all facts from all categories.
+        """
+        all_facts = []
+        for category_data in self.view().values():
+            if isinstance(category_data, dict) and isinstance(category_data.get("Facts"), list):
+                all_facts.extend(category_data["Facts"])
+        return all_facts
+
+    def categories(self, category_names: List[str]) -> Dict:
+        """
+        Returns the data of the named categories that exist in the profile.
+        """
+        view = self.view()
+        return {name: view[name] for name in category_names if name in view}
+
+    def fact_entries(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns retrieval entries (see sim_index.collect_fact_entries), cached until the next change.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = collect_fact_entries(self.view())
+            return self._entries
+
+    def _ensure_category(self, category: str):
+        if category not in self.data:
+            self.data[category] = {
+                "Description": f"User's {category.lower()} information",
+                "Facts": [],
+                "Credentials": {}
+            }
+
+    def apply_batch(self, updates: Optional[List[Dict]] = None, additions: Optional[List[Dict]] = None,
+                    deletions: Optional[List[str]] = None, timestamp: Optional[str] = None) -> Dict[str, List]:
+        """
+        Applies updates, additions and deletions in one pass over the index.
+
+        Args:
+            updates: [{"fact_id", "fact"}] - appends a timestamp to the existing fact
+            additions: [{"fact", optional "fact_id", optional "category"}] - a
+                missing, malformed or already used fact_id gets a freshly
+                allocated id
+            deletions: Fact ids to remove
+            timestamp: Change timestamp (defaults to now, UTC)
+
+        Returns:
+            Dict of "updated", "added" and "deleted" change records plus "missing" ids
+        """
+        with self._lock:
+            timestamp = timestamp or datetime.utcnow().isoformat() + "Z"
+            changes = {"updated": [], "added": [], "deleted": [], "missing": []}
+
+            for update in updates or []:
+                fact_id = update["fact_id"]
+                location = self._index.get(fact_id)
+                if location is None:
+                    changes["missing"].append(fact_id)
+                    continue
+
+                category, position = location
+                existing_timestamps = self.data[category]["Facts"][position].get("timestamps", [])
+                existing_timestamps.append(timestamp)
+                fact_obj = {"id": fact_id, "fact": update["fact"], "timestamps": existing_timestamps}
+                self.data[category]["Facts"][position] = fact_obj
+                changes["updated"].append({"category": category, "fact": fact_obj})
+
+            for addition in additions or []:
+                fact_id = addition.get("fact_id", "")
+                category = addition.get("category") or self.category_for_fact_id(fact_id)
+                _, number = split_fact_id(fact_id)
+                if not fact_id or number is None or fact_id in self._index:
+                    fact_id = self.next_id(category)
+
+                self._ensure_category(category)
+                fact_obj = {"id": fact_id, "fact": addition["fact"], "timestamps": [timestamp]}
+                facts = self.data[category]["Facts"]
+                facts.append(fact_obj)
+                self._index_fact(category, len(facts) - 1, fact_obj)
+                changes["added"].append({"category": category, "fact": fact_obj})
+
+            doomed: Dict[str, set] = {}
+            for fact_id in deletions or []:
+                location = self._index.get(fact_id)
+                if location is None:
+                    changes["missing"].append(fact_id)
+                    continue
+                doomed.setdefault(location[0], set()).add(location[1])
+                changes["deleted"].append({
+                    "category": location[0],
+                    "fact_id": fact_id,
+                    "fact": self.data[location[0]]["Facts"][location[1]],
+                })
+
+            if doomed:
+                for category, positions in doomed.items():
+                    facts = self.data[category]["Facts"]
+                    self.data[category]["Facts"] = [f for i, f in enumerate(facts) if i not in positions]
+                # Positions after a deletion shift, so rebuild the index once
+                self._reindex()
+
+            if changes["updated"] or changes["added"] or changes["deleted"]:
+                self._changed()
+            return changes
+
+    def save(self, filepath: Optional[str] = None):
+        """
+        Writes the profile back to disk.
+        """
+        with self._lock:
+            save_sims_to_file(self.data, filepath or self.filepath or "sim.json")
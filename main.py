@@ -1,51 +1,107 @@
 import asyncio
-from router import route_user_input
-from sim_update import update_user_sims, load_sims_from_file
-from respond import response
-from correct_sim_plan import sim_plan, fetch_relevant_categories
-from mcp_connected import plan
-from rag_sim import get_top3_relevant_sims
+import os
+from bedrock_clients import warm_up, get_client_metrics
+from embedding_cache import get_embedding_cache_stats
+from mcp_connected import plan, initial_plan_state
+from mcp_session import default_session_manager
+from mcp_tool_cache import tool_result_cache
+from router import ROUTER_MODEL_ID
+from router_cache import get_router_cache
+from router_classifier import get_router_classifier
+from profile_registry import default_registry
+from prompt_registry import prompt_registry, get_prompt_metrics
+from plan_context import get_plan_context_metrics
+from tracing import trace, span, export_from_env
+from profile_update_queue import get_update_worker
+from sim_update import get_update_metrics
+from pipeline import (StageTimer, route, speculative_route, stream_respond,
+                      select_plan_context, get_speculation_stats)
 
 
 async def main():
+    if os.getenv("BEDROCK_WARMUP", "false").lower() == "true":
+        # Open Bedrock connections for both regions in use before the first query
+        warm_up([None, os.getenv("AWS_REGION", "us-west-2")], model_id=os.getenv("BEDROCK_WARMUP_MODEL"))
+
+    # Unset means the single-user sim.json profile
+    sims_file_path = default_registry.path_for(os.getenv("PROFILE_USER_ID"))
+
     user_query = input("Enter user query: ")
 
-    output_router=route_user_input(user_query)
-    output_sim_update=output_router.get("sim_update")
-    output_action= output_router.get("action")
-
-    if(output_sim_update=='y'):
-        existing_sims=load_sims_from_file("sim.json")
-        update_user_sims(user_query,existing_sims)
-
-    if(output_action == 'respond'):
-        relevant_sims=get_top3_relevant_sims(user_query,"sim.json")
-        print(response(user_query,relevant_sims))
-    else:
-        correct_sims=sim_plan(user_query,"sim.json")
-        relevant_categories= correct_sims.get("relevant_categories")
-        print(relevant_categories)
-        sim_data=fetch_relevant_categories(relevant_categories,"sim.json")
-        print(sim_data)
-        prev_json= {
-                "task_summary": "",
-                "followup_required": True,
-                "action": "",
-                "followups": [],
-                "answer":""
-        }
-
-        output_json=await plan(user_query,sim_data,prev_json)
-        followup_req=output_json.get("followup_required")
-        while(followup_req):
-            followups = output_json.get("followups", [])
-            for followup in followups:
-                print(followup.get("question"))
-            user_answer=input("Answer followup question:> ")
-            output_json=await plan(user_answer,sim_data,output_json)
-            followup_req=output_json.get("followup_required")
-
-        print(output_json.get("answers"))
+    speculative = os.getenv("SPECULATIVE_ROUTING", "false").lower() == "true"
+
+    # One trace per conversation: router, retrieval, Bedrock calls and MCP tool calls nest under it
+    with trace("request", speculative=speculative):
+        timer = StageTimer()
+        prefetched = None
+        if speculative:
+            output_router, prefetched = await speculative_route(user_query, sims_file_path, timer)
+        else:
+            output_router = await route(user_query, timer)
+        output_sim_update=output_router.get("sim_update")
+        output_action= output_router.get("action")
+
+        # Profile maintenance is queued for the background worker, off the answer path
+        update_worker = get_update_worker()
+        if(output_sim_update=='y'):
+            update_worker.submit(sims_file_path, user_query)
+
+        if(output_action == 'respond'):
+            stream_metrics = {}
+            async for chunk in stream_respond(user_query, sims_file_path, timer, prefetched, stream_metrics):
+                print(chunk, end="", flush=True)
+            print()
+            timer.mark_answer_ready()
+            print(f"Streaming: {stream_metrics}")
+        else:
+            relevant_categories, sim_data = await select_plan_context(user_query, sims_file_path, timer, prefetched)
+            print(relevant_categories)
+            print(sim_data)
+            prev_json = initial_plan_state()
+
+            try:
+                # One MCP server process and agent serve every turn of this conversation
+                default_session_manager.start_idle_reaper()
+                output_json = await timer.run_async("plan", plan(user_query, sim_data, prev_json))
+                timer.mark_answer_ready()
+                followup_req=output_json.get("followup_required")
+                while(followup_req):
+                    followups = output_json.get("followups", [])
+                    for followup in followups:
+                        print(followup.get("question"))
+                    # Read the answer off the event loop so the background update keeps progressing
+                    user_answer = await asyncio.to_thread(input, "Answer followup question:> ")
+                    with span("stage.plan_followup"):
+                        output_json=await plan(user_answer,sim_data,output_json)
+                    followup_req=output_json.get("followup_required")
+
+                print(output_json.get("answers"))
+            finally:
+                # Also on Ctrl-C or an error, so the MCP server process does not outlive us
+                await default_session_manager.close()
+            print(f"MCP tool cache: {tool_result_cache.report()}")
+
+        # Give the worker a moment to finish; anything left stays queued for the next run
+        await asyncio.to_thread(update_worker.stop, float(os.getenv("PROFILE_UPDATE_DRAIN_SECONDS", "30")))
+        print(f"Profile updates: {update_worker.stats} queued={update_worker.queue.counts()}")
+        print(f"Profile update prompts: {get_update_metrics()}")
+
+    print(timer.format_report())
+    print(f"Profiles: {default_registry.stats()}")
+    print(f"Bedrock clients: {get_client_metrics()}")
+    print(f"Embedding cache: {get_embedding_cache_stats()}")
+    print(f"Prompt tokens: {get_prompt_metrics()}")
+    print(f"Plan context: {get_plan_context_metrics()}")
+    export_from_env()
+    if speculative:
+        print(f"Speculation: {get_speculation_stats()}")
+    router_prompt = prompt_registry.get("router").text
+    router_classifier = get_router_classifier(router_prompt)
+    if router_classifier is not None:
+        print(f"Router fast path: {router_classifier.report()}")
+    router_cache = get_router_cache(router_prompt, ROUTER_MODEL_ID)
+    if router_cache is not None:
+        print(f"Router cache: {router_cache.stats()}")
 
 
 if __name__ == "__main__":
@@ -4,80 +4,115 @@ import json
 import re
 import logging
 from dotenv import load_dotenv
-from langchain_aws import ChatBedrock
-from mcp_use import MCPAgent, MCPClient
-from prompt_assitant import prompt_assistant
-import boto3
+from typing import Optional
+from plan_context import build_plan_context
+from prompt_registry import prompt_registry
+from mcp_session import MCPSessionManager, default_session_manager
 
 # Suppress mcp_use logging
 logging.getLogger("mcp_use").setLevel(logging.WARNING)
 logging.getLogger("mcp_use.telemetry.telemetry").setLevel(logging.WARNING)
 
 
-async def plan(user_input, relevant_sims, prev_json):
+def initial_plan_state():
+    """
+    Returns the prev_json a new planning conversation starts from.
+    """
+    return {
+        "task_summary": "",
+        "followup_required": True,
+        "action": "",
+        "followups": [],
+        "answer": ""
+    }
+
+
+def planner_turn_message(user_input, relevant_sims, prev_json, compact=True):
+    """
+    Builds the per-turn message: the state and profile data that used to be
+    appended to the system prompt, followed by the user's message.
+
+    The agent keeps its memory across the turns of a conversation, so
+    prev_json=None means "your previous reply" and empty relevant_sims means
+    nothing beyond what was already sent (see unsent_context). The pruned
+    plan context is sent compactly; compact=False keeps the indented form
+    used when pruning is off (PLAN_CONTEXT=off).
+    """
+    if prev_json is None:
+        state = "unchanged - your previous JSON response in this conversation"
+    else:
+        state = json.dumps(prev_json, indent=2)
+    if relevant_sims:
+        sims = json.dumps(relevant_sims, separators=(",", ":")) if compact else json.dumps(relevant_sims, indent=2)
+    else:
+        sims = "no new facts beyond those already given in this conversation"
+    return f"""Current State (prev_json): {state}
+User Characteristics (relevant_sims): {sims}
+
+user_query: {user_input}"""
+
+
+def unsent_context(relevant_sims, sent) -> dict:
+    """
+    Returns the part of relevant_sims not yet sent in this conversation and
+    records it in `sent` (category -> serialized items already sent).
+    """
+    unsent = {}
+    for category, data in (relevant_sims or {}).items():
+        seen = sent.setdefault(category, set())
+        if isinstance(data, list):
+            items = [item for item in data if json.dumps(item, sort_keys=True) not in seen]
+            if items:
+                unsent[category] = items
+                seen.update(json.dumps(item, sort_keys=True) for item in items)
+        else:
+            serialized = json.dumps(data, sort_keys=True)
+            if serialized not in seen:
+                unsent[category] = data
+                seen.add(serialized)
+    return unsent
+
+
+async def plan(user_input, relevant_sims, prev_json, session: Optional[MCPSessionManager] = None):
    
     # Load environment variables
     load_dotenv()
     
-    # AWS Bedrock setup
-    region = os.getenv("AWS_REGION", "us-west-2")
-    
-    # Create Bedrock Runtime client
-    brt = boto3.client(
-        "bedrock-runtime",
-        region_name=region,
-    )
-    
-    # Use inference profile ARN instead of model ID for Llama 3.3 70B
-    model_id = "us.meta.llama3-3-70b-instruct-v1:0"  # Regional inference profile
-    
-    # Format the system message with prev_json and relevant_sims
-    system_message = f"""{prompt_assistant}
+    # The system message is the static registered prompt only, so it stays
+    # identical across turns and conversations and can be cached as a prefix
+    template = prompt_registry.get("planner")
 
-Current State (prev_json): {json.dumps(prev_json, indent=2)}
-User Characteristics (relevant_sims): {json.dumps(relevant_sims, indent=2)}
-"""
-    
-    config_file = "mcp.json"
+    # Only the facts that matter for this turn, within a token budget
+    prune_context = os.getenv("PLAN_CONTEXT", "on").lower() != "off"
+    if prune_context:
+        task_summary = prev_json.get("task_summary", "") if isinstance(prev_json, dict) else ""
+        # Embeds the facts (a Bedrock call on a cache miss), so keep it off the event loop
+        relevant_sims, context_stats = await asyncio.to_thread(
+            build_plan_context, relevant_sims, f"{task_summary}\n{user_input}".strip())
+        print(
+            f"Plan context: {context_stats['facts_kept']}/{context_stats['facts_in']} facts, "
+            f"~{context_stats['context_tokens']} tokens "
+            f"(saved ~{context_stats['original_tokens'] - context_stats['context_tokens']})"
+        )
 
-    # Suppress stderr from MCP server processes
-    import sys
+    # Reuse the MCP server process and agent across follow-up turns
+    session = session or default_session_manager
+    agent = await session.acquire(template.text)
 
-    # Redirect stderr to devnull while creating client
-    with open(os.devnull, 'w') as devnull:
-        old_stderr = sys.stderr
-        sys.stderr = devnull
-        try:
-            client = MCPClient.from_config_file(config_file)
-        finally:
-            sys.stderr = old_stderr
-    
-    # Create LLM using ChatBedrock
-    llm = ChatBedrock(
-        model_id=model_id,
-        client=brt,
-        region_name=region,
-        model_kwargs={
-            "temperature": 0.7,
-            "max_gen_len": 2048,
-            "top_p": 0.9,
-        }
-    )
-    
-    agent = MCPAgent(
-        llm=llm,
-        client=client,
-        max_steps=30,
-        memory_enabled=True,
-        system_prompt=system_message,             
-    )
+    # The agent remembers earlier turns: its own last reply is the state, and
+    # facts already sent are not repeated, so memory does not grow by a full
+    # copy of both per follow-up
+    memory = session.sent_context
+    state = None if prev_json is not None and prev_json == memory.get("last_response") else prev_json
+    turn_message = planner_turn_message(user_input, unsent_context(relevant_sims, memory.setdefault("facts", {})),
+                                        state, compact=prune_context)
     
     response_json = None
     
     try:
 
         try:
-            response = await agent.run(user_input)
+            response = await agent.run(turn_message)
             
             try:
                 # If response is already a dict
@@ -140,8 +175,13 @@ User Characteristics (relevant_sims): {json.dumps(relevant_sims, indent=2)}
             }
     
     finally:
-        if client and client.sessions:
-            await client.close_all_sessions()
+        session.touch()
         print("✅ Done!")
+
+    if not isinstance(response_json, dict) or response_json.get("action") == "error":
+        # Unknown what reached the agent's memory; send everything next turn
+        memory.clear()
+    else:
+        memory["last_response"] = response_json
     
     return response_json  # RETURN the JSON response
\ No newline at end of file
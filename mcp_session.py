@@ -0,0 +1,191 @@
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Optional
+from langchain_aws import ChatBedrock
+from mcp_use import MCPAgent, MCPClient
+from bedrock_clients import get_bedrock_client
+from mcp_tool_cache import install_tool_cache
+from prompt_registry import PromptUsageCallback
+from tracing import instrument_mcp_client
+
+
+# Use inference profile ARN instead of model ID for Llama 3.3 70B
+PLANNER_MODEL_ID = "us.meta.llama3-3-70b-instruct-v1:0"  # Regional inference profile
+
+
+def create_mcp_client(config_file: str = "mcp.json") -> MCPClient:
+    """
+    Creates an MCP client from a config file with the server's stderr suppressed.
+    """
+    # Redirect stderr to devnull while creating client
+    with open(os.devnull, 'w') as devnull:
+        old_stderr = sys.stderr
+        sys.stderr = devnull
+        try:
+            return MCPClient.from_config_file(config_file)
+        finally:
+            sys.stderr = old_stderr
+
+
+def create_planner_llm(region: str) -> ChatBedrock:
+    """
+    Creates the Llama 3.3 70B chat model used by the planning agent.
+    """
+    return ChatBedrock(
+        model_id=PLANNER_MODEL_ID,
+        client=get_bedrock_client(region),
+        region_name=region,
+        model_kwargs={
+            "temperature": 0.7,
+            "max_gen_len": 2048,
+            "top_p": 0.9,
+        },
+        callbacks=[PromptUsageCallback("planner")],
+    )
+
+
+class MCPSessionManager:
+    """
+    Keeps one MCP server process and planning agent alive across plan() calls.
+
+    The client, its server sessions and the agent are created on first use
+    and reused for every follow-up turn of a planning conversation. They are
+    torn down when idle for longer than idle_timeout seconds or when a health
+    check finds a dead session, and rebuilt on the next acquire().
+    """
+
+    def __init__(self, config_file: str = "mcp.json", region: Optional[str] = None,
+                 idle_timeout: float = 600, max_steps: int = 30,
+                 client_factory: Callable = create_mcp_client,
+                 llm_factory: Callable = create_planner_llm,
+                 agent_factory: Callable = MCPAgent):
+        self.config_file = config_file
+        self.region = region
+        self.idle_timeout = idle_timeout
+        self.max_steps = max_steps
+        self.client_factory = client_factory
+        self.llm_factory = llm_factory
+        self.agent_factory = agent_factory
+
+        self.client = None
+        self.agent = None
+        self.starts = 0
+        self.reuses = 0
+        # What the agent's conversation memory already holds (see mcp_connected.plan);
+        # cleared whenever that memory is
+        self.sent_context: Dict[str, Any] = {}
+        self._system_message = None
+        self._last_used = 0.0
+        self._lock = asyncio.Lock()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _idle_expired(self) -> bool:
+        return self.agent is not None and time.monotonic() - self._last_used > self.idle_timeout
+
+    async def health_check(self) -> bool:
+        """
+        Returns True if every MCP server session is still connected.
+        """
+        if self.client is None or not self.client.sessions:
+            return False
+        for session in self.client.sessions.values():
+            if not getattr(session, "is_connected", True):
+                return False
+        return True
+
+    async def _start(self, system_message: str):
+        self.client = self.client_factory(self.config_file)
+        await self.client.create_all_sessions()
+        if os.getenv("MCP_TOOL_CACHE", "on").lower() != "off":
+            install_tool_cache(self.client)
+        instrument_mcp_client(self.client)
+        self.agent = self.agent_factory(
+            llm=self.llm_factory(self.region or os.getenv("AWS_REGION", "us-west-2")),
+            client=self.client,
+            max_steps=self.max_steps,
+            memory_enabled=True,
+            system_prompt=system_message,
+        )
+        self.sent_context = {}
+        self._system_message = system_message
+        self.starts += 1
+
+    async def _close(self):
+        client, self.client, self.agent = self.client, None, None
+        if client and client.sessions:
+            await client.close_all_sessions()
+
+    async def acquire(self, system_message: str) -> MCPAgent:
+        """
+        Returns a live agent using the given system message, starting one if needed.
+        """
+        async with self._lock:
+            if self.agent is not None and (self._idle_expired() or not await self.health_check()):
+                await self._close()
+
+            if self.agent is None:
+                await self._start(system_message)
+            else:
+                self.reuses += 1
+                if system_message != self._system_message:
+                    self.agent.set_system_message(system_message)
+                    self._system_message = system_message
+
+            self._last_used = time.monotonic()
+            return self.agent
+
+    def touch(self):
+        """
+        Marks the session as used, postponing its idle timeout.
+        """
+        self._last_used = time.monotonic()
+
+    async def new_conversation(self):
+        """
+        Clears the agent's memory so a new planning conversation starts fresh.
+        """
+        async with self._lock:
+            if self.agent is not None:
+                self.agent.clear_conversation_history()
+            self.sent_context = {}
+
+    async def reap_idle(self) -> bool:
+        """
+        Closes the session if it has been idle too long.
+
+        Returns:
+            True if the session was closed
+        """
+        async with self._lock:
+            if self._idle_expired():
+                await self._close()
+                return True
+        return False
+
+    def start_idle_reaper(self, interval: float = 30):
+        """
+        Starts a background task that periodically closes an idle session.
+        """
+        async def _reap_forever():
+            while True:
+                await asyncio.sleep(interval)
+                await self.reap_idle()
+
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(_reap_forever())
+
+    async def close(self):
+        """
+        Stops the reaper and shuts down the MCP server process.
+        """
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        async with self._lock:
+            await self._close()
+
+
+# Session used by plan() when the caller does not pass one
+default_session_manager = MCPSessionManager(idle_timeout=float(os.getenv("MCP_IDLE_TIMEOUT", "600")))
@@ -0,0 +1,162 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+
+# Free-text tool arguments whose case and spacing carry no meaning. Every
+# other string (cursors, listing and place ids, dates) is kept verbatim.
+FREE_TEXT_ARGUMENTS = {"location"}
+
+
+def canonicalize_arguments(arguments: Optional[Dict[str, Any]]) -> str:
+    """
+    Returns a canonical JSON form of tool arguments for use as a cache key.
+
+    Keys are sorted, None/empty values are dropped and the free-text fields
+    in FREE_TEXT_ARGUMENTS are trimmed, whitespace-collapsed and lowercased,
+    so {"location": " Paris "} and {"location": "paris", "pets": None} map
+    to the same key while opaque values such as cursors stay distinct.
+    """
+    def _canonical(value, free_text=False):
+        if isinstance(value, dict):
+            return {k: _canonical(v, k in FREE_TEXT_ARGUMENTS)
+                    for k, v in sorted(value.items()) if v not in (None, "", [], {})}
+        if isinstance(value, list):
+            return [_canonical(v, free_text) for v in value]
+        if isinstance(value, str) and free_text:
+            return " ".join(value.split()).lower()
+        return value
+
+    return json.dumps(_canonical(arguments or {}), sort_keys=True, separators=(",", ":"))
+
+
+class ToolResultCache:
+    """
+    TTL cache for MCP tool results with stale-while-revalidate.
+
+    A result younger than ttl_seconds is returned directly. Between ttl_seconds
+    and ttl_seconds + stale_seconds the stale result is returned immediately
+    and a background refresh is started. Older entries are misses. Error
+    results are never cached.
+    """
+
+    def __init__(self, ttl_seconds: float = 900, stale_seconds: float = 3600, max_entries: int = 2000,
+                 tool_ttls: Optional[Dict[str, float]] = None):
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_entries = max_entries
+        self.tool_ttls = tool_ttls or {}
+        self.entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self.stats_by_tool: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0}
+        )
+        self._refreshing = set()
+        # The event loop only holds weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _ttl(self, tool_name: str) -> float:
+        return self.tool_ttls.get(tool_name, self.ttl_seconds)
+
+    def _store(self, key: Tuple[str, str], result: Any):
+        if getattr(result, "isError", False):
+            return
+        self.entries[key] = (time.monotonic(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def call(self, tool_name: str, arguments: Optional[Dict[str, Any]],
+                   invoke: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns a cached result for (tool_name, arguments), invoking the tool on a miss.
+
+        Args:
+            tool_name: MCP tool name
+            arguments: Tool arguments as sent by the agent
+            invoke: Zero-argument coroutine factory that calls the real tool
+        """
+        key = (tool_name, canonicalize_arguments(arguments))
+        stats = self.stats_by_tool[tool_name]
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            stored_at, result = entry
+            age = time.monotonic() - stored_at
+            ttl = self._ttl(tool_name)
+            if age <= ttl:
+                stats["hits"] += 1
+                self.entries.move_to_end(key)
+                return result
+            if age <= ttl + self.stale_seconds:
+                stats["stale_hits"] += 1
+                if key not in self._refreshing:
+                    self._refreshing.add(key)
+                    task = asyncio.create_task(self._refresh(key, invoke))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return result
+
+        stats["misses"] += 1
+        result = await invoke()
+        self._store(key, result)
+        return result
+
+    async def _refresh(self, key: Tuple[str, str], invoke: Callable[[], Awaitable[Any]]):
+        try:
+            self._store(key, await invoke())
+            self.stats_by_tool[key[0]]["refreshes"] += 1
+        except Exception as e:
+            print(f"Warning: Background refresh of MCP tool '{key[0]}' failed: {e}")
+        finally:
+            self._refreshing.discard(key)
+
+    def clear(self):
+        """
+        Drops every cached result and resets the per-tool counters.
+        """
+        self.entries.clear()
+        self.stats_by_tool.clear()
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns hit/stale/miss counts and hit rate per tool.
+        """
+        report = {}
+        for tool_name, stats in self.stats_by_tool.items():
+            lookups = stats["hits"] + stats["stale_hits"] + stats["misses"]
+            report[tool_name] = dict(stats)
+            report[tool_name]["hit_rate"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return report
+
+
+# Shared across sessions and users in this process
+tool_result_cache = ToolResultCache(
+    ttl_seconds=float(os.getenv("MCP_TOOL_CACHE_TTL", "900")),
+    stale_seconds=float(os.getenv("MCP_TOOL_CACHE_STALE", "3600")),
+)
+
+
+def install_tool_cache(client, cache: Optional[ToolResultCache] = None):
+    """
+    Routes every tool call on the client's sessions through the result cache.
+
+    The connector's call_tool is wrapped in place, so the agent's tools hit
+    the cache without any change to how they are built.
+    """
+    cache = cache or tool_result_cache
+
+    for session in client.sessions.values():
+        connector = session.connector
+        if getattr(connector, "_tool_cache_installed", False):
+            continue
+
+        original_call_tool = connector.call_tool
+
+        async def cached_call_tool(name, arguments=None, *args, _original=original_call_tool, **kwargs):
+            return await cache.call(name, arguments, lambda: _original(name, arguments, *args, **kwargs))
+
+        connector.call_tool = cached_call_tool
+        connector._tool_cache_installed = True
@@ -0,0 +1,160 @@
+import threading
+from typing import Any, Dict, List
+import numpy as np
+from embedding_cache import get_cached_embeddings
+
+
+# One retriever per profile path for the whole process
+_retrievers: Dict[str, "NumpyFactRetriever"] = {}
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Returns the indices of the k highest scores along the last axis, best first.
+
+    argpartition selects the k candidates in O(n); only those k are sorted.
+    """
+    n = scores.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+
+    candidates = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    candidate_scores = np.take_along_axis(scores, candidates, axis=-1)
+    order = np.argsort(-candidate_scores, axis=-1)
+    return np.take_along_axis(candidates, order, axis=-1)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyFactRetriever:
+    """
+    Brute-force cosine retrieval over a contiguous float32 matrix of fact embeddings.
+
+    Rows are L2-normalized once at build time, so scoring a query is a single
+    matrix-vector product. Intended for profiles of up to a few thousand facts,
+    where an exact scan is cheaper than maintaining an ANN index.
+
+    build() embeds into local variables and swaps keys, entries and matrix
+    together under a lock, so a search running concurrently with a rebuild
+    sees either the old or the new profile, never a mix of both.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.keys: List[str] = []
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._hashes: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def build(self, entries: Dict[str, Dict[str, Any]]) -> bool:
+        """
+        Loads fact entries (output of sim_index.collect_fact_entries) into the matrix.
+
+        Returns:
+            True if the matrix was rebuilt, False if the facts were unchanged
+        """
+        hashes = {key: entry["hash"] for key, entry in entries.items()}
+        with self._lock:
+            if hashes == self._hashes and len(self.keys) == len(entries):
+                # Same texts; fact objects (e.g. timestamps) may still have changed
+                self.entries = entries
+                return False
+
+        keys = list(entries)
+        if keys:
+            vectors = self.embeddings.embed_documents([entries[key]["text"] for key in keys])
+            matrix = np.ascontiguousarray(_normalize_rows(np.asarray(vectors, dtype=np.float32)))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            self.keys, self.entries, self.matrix, self._hashes = keys, entries, matrix, hashes
+        return True
+
+    def _snapshot(self):
+        with self._lock:
+            return self.keys, self.entries, self.matrix
+
+    @staticmethod
+    def _records(keys: List[str], entries: Dict[str, Dict[str, Any]], indices: np.ndarray,
+                 scores: np.ndarray) -> List[Dict[str, Any]]:
+        records = []
+        for rank, i in enumerate(indices, start=1):
+            entry = entries[keys[i]]
+            records.append({
+                "rank": rank,
+                "category": entry["category"],
+                "fact_id": entry["fact_id"],
+                "fact": entry["fact"],
+                "similarity_score": float(scores[i])
+            })
+        return records
+
+    def search_vector(self, query_vector, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Returns the top-k facts for an already embedded query.
+        """
+        keys, entries, matrix = self._snapshot()
+        if not keys:
+            return []
+        query = _normalize_rows(np.asarray(query_vector, dtype=np.float32))
+        scores = matrix @ query
+        return self._records(keys, entries, top_k_indices(scores, k), scores)
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        Embeds the query and returns the top-k facts by cosine similarity.
+        """
+        if not self.keys:
+            return []
+        return self.search_vector(self.embeddings.embed_query(query), k=k)
+
+    def search_batch(self, queries: List[str], k: int = 3) -> List[List[Dict[str, Any]]]:
+        """
+        Scores many queries at once with a single matrix multiply.
+
+        Returns:
+            One list of top-k records per query, in input order
+        """
+        if not queries:
+            return []
+        keys, entries, matrix = self._snapshot()
+        if not keys:
+            return [[] for _ in queries]
+
+        query_matrix = _normalize_rows(np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32))
+        scores = query_matrix @ matrix.T
+        indices = top_k_indices(scores, k)
+        return [self._records(keys, entries, indices[row], scores[row]) for row in range(len(queries))]
+
+
+def get_fact_retriever(sims_file_path: str = "sim.json",
+                       aws_region: str = "us-east-1",
+                       embeddings=None) -> NumpyFactRetriever:
+    """
+    Returns the process-wide NumPy retriever for a profile, creating it on first use.
+
+    Args:
+        sims_file_path: Path to the sim.json file the retriever belongs to
+        aws_region: AWS region for Bedrock
+        embeddings: Override for the embedding function
+
+    Returns:
+        The NumpyFactRetriever for this profile
+    """
+    if sims_file_path not in _retrievers:
+        _retrievers[sims_file_path] = NumpyFactRetriever(embeddings or get_cached_embeddings(aws_region))
+    return _retrievers[sims_file_path]
+
+
+def release_fact_retriever(sims_file_path: str):
+    """
+    Drops the retriever of a profile, freeing its embedding matrix.
+    """
+    _retrievers.pop(sims_file_path, None)
@@ -0,0 +1,252 @@
+import asyncio
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+from router import route_user_input
+from profile_registry import default_registry
+from respond import response, response_stream
+from correct_sim_plan import sim_plan, fetch_relevant_categories
+from rag_sim import get_top3_relevant_sims
+from tracing import span, start_span
+
+
+# Accounting for speculative routing, aggregated over the process lifetime
+_speculation_stats = {
+    "requests": 0,
+    "prefixes_used": 0,
+    "wasted_calls": 0,
+    "latency_saved_seconds": 0.0,
+}
+
+
+class StageTimer:
+    """
+    Records start/end offsets of pipeline stages relative to the start of a request.
+
+    Blocking stages are run in worker threads via asyncio.to_thread so that
+    independent stages can overlap on the event loop.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.answer_ready: Optional[float] = None
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.started
+
+    async def run(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Runs a blocking function off the event loop and times it as a stage.
+        """
+        start = self._now()
+        cancelled = False
+        try:
+            with span(f"stage.{name}"):
+                return await asyncio.to_thread(func, *args, **kwargs)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._record(name, start, cancelled)
+
+    async def run_async(self, name: str, coro) -> Any:
+        """
+        Awaits a coroutine and times it as a stage.
+        """
+        start = self._now()
+        cancelled = False
+        try:
+            with span(f"stage.{name}"):
+                return await coro
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._record(name, start, cancelled)
+
+    def _record(self, name: str, start: float, cancelled: bool):
+        stage = {"start": start, "end": self._now()}
+        if cancelled:
+            # e.g. the losing branch of speculative_route; kept for the
+            # timeline but not counted as work done for this request
+            stage["cancelled"] = True
+        self.stages[name] = stage
+
+    def mark_answer_ready(self):
+        """
+        Marks the moment the user-facing answer became available.
+        """
+        self.answer_ready = self._now()
+
+    def report(self) -> Dict[str, Any]:
+        """
+        Returns per-stage durations, the critical-path latency (request start to
+        answer ready) and how much time overlapping stages saved. Cancelled
+        stages are listed by name only and left out of the totals.
+        """
+        completed = {name: s for name, s in self.stages.items() if not s.get("cancelled")}
+        durations = {name: s["end"] - s["start"] for name, s in completed.items()}
+        total = max((s["end"] for s in completed.values()), default=0.0)
+        critical_path = self.answer_ready if self.answer_ready is not None else total
+
+        return {
+            "stages": durations,
+            "cancelled_stages": sorted(name for name in self.stages if name not in completed),
+            "critical_path_seconds": critical_path,
+            "total_seconds": total,
+            "sequential_seconds": sum(durations.values()),
+            "overlap_saved_seconds": max(0.0, sum(durations.values()) - total),
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = [f"Critical path: {report['critical_path_seconds']:.2f}s "
+                 f"(sequential would be {report['sequential_seconds']:.2f}s)"]
+        for name, stage in sorted(self.stages.items(), key=lambda item: item[1]["start"]):
+            lines.append(f"  {name:<18} {stage['start']:6.2f}s -> {stage['end']:6.2f}s "
+                         f"({stage['end'] - stage['start']:.2f}s)" + (" cancelled" if stage.get("cancelled") else ""))
+        return "\n".join(lines)
+
+
+async def route(user_query: str, timer: StageTimer) -> Dict[str, str]:
+    """
+    Stage: classify the query (action + sim_update).
+    """
+    return await timer.run("router", route_user_input, user_query)
+
+
+async def answer_respond(user_query: str, sims_file_path: str, timer: StageTimer,
+                         prefetched: Optional[asyncio.Task] = None) -> str:
+    """
+    Stages: retrieve the top facts, then generate a direct answer.
+
+    If a speculative retrieval task is passed in, its result is used instead
+    of retrieving again.
+    """
+    relevant_sims = await _retrieve(user_query, sims_file_path, timer, prefetched)
+    return await timer.run("respond", response, user_query, relevant_sims)
+
+
+async def stream_respond(user_query: str, sims_file_path: str, timer: StageTimer,
+                         prefetched: Optional[asyncio.Task] = None,
+                         metrics: Optional[Dict[str, float]] = None) -> AsyncIterator[str]:
+    """
+    Same stages as answer_respond, but yields the answer as it is generated.
+    TTFT and throughput of this answer are written into `metrics` if given.
+    """
+    relevant_sims = await _retrieve(user_query, sims_file_path, timer, prefetched)
+
+    start = timer._now()
+    metrics = metrics if metrics is not None else {}
+    # Not made current: a context variable set inside an async generator leaks into the consumer
+    stream_span = start_span("stage.respond", streaming=True)
+    try:
+        async for chunk in response_stream(user_query, relevant_sims, metrics):
+            if "first_token" not in timer.stages:
+                timer.stages["first_token"] = {"start": start, "end": timer._now()}
+                if stream_span is not None:
+                    stream_span.set(ttft_seconds=timer._now() - start)
+            yield chunk
+    finally:
+        timer.stages["respond"] = {"start": start, "end": timer._now()}
+        if stream_span is not None:
+            # The bedrock.ConverseStream span ends when the headers arrive;
+            # the stream's usage and full duration are recorded here
+            stream_span.set(input_tokens=metrics.get("input_tokens"), output_tokens=metrics.get("output_tokens"),
+                            stream_seconds=metrics.get("total_seconds"))
+            stream_span.finish()
+
+
+async def _retrieve(user_query: str, sims_file_path: str, timer: StageTimer,
+                    prefetched: Optional[asyncio.Task]) -> List[Dict[str, Any]]:
+    if prefetched is not None:
+        return await prefetched
+    return await timer.run("rag_retrieval", _retrieve_from_profile, user_query, sims_file_path)
+
+
+def _retrieve_from_profile(user_query: str, sims_file_path: str) -> List[Dict[str, Any]]:
+    return get_top3_relevant_sims(user_query, sims_file_path, store=default_registry.load(sims_file_path))
+
+
+def _select_categories(user_query: str, sims_file_path: str) -> Dict:
+    return sim_plan(user_query, sims_file_path, store=default_registry.load(sims_file_path))
+
+
+def _fetch_categories(category_names: List[str], sims_file_path: str) -> Dict:
+    return fetch_relevant_categories(category_names, sims_file_path, store=default_registry.load(sims_file_path))
+
+
+async def select_plan_context(user_query: str, sims_file_path: str, timer: StageTimer,
+                              prefetched: Optional[asyncio.Task] = None) -> Tuple[List[str], Dict]:
+    """
+    Stages: pick the relevant categories, then fetch their data for the planner.
+
+    If a speculative category-selection task is passed in, its result is used
+    instead of calling sim_plan again.
+    """
+    if prefetched is not None:
+        correct_sims = await prefetched
+    else:
+        correct_sims = await timer.run("sim_plan", _select_categories, user_query, sims_file_path)
+    relevant_categories = correct_sims.get("relevant_categories")
+    sim_data = await timer.run("fetch_categories", _fetch_categories, relevant_categories, sims_file_path)
+    return relevant_categories, sim_data
+
+
+async def speculative_route(user_query: str, sims_file_path: str,
+                            timer: StageTimer) -> Tuple[Dict[str, str], asyncio.Task]:
+    """
+    Routes the query while speculatively starting the cheap prefix of both branches.
+
+    RAG retrieval (respond branch) and category selection (plan branch) start
+    at the same time as the router. Once the router answers, the losing
+    branch is cancelled. Its worker thread cannot be interrupted, so the
+    call still completes and is counted as wasted; its stage is tagged
+    cancelled in the timer and left out of the request's totals.
+
+    Returns:
+        The router decision and the task computing the winning branch's prefix
+    """
+    router_task = asyncio.create_task(route(user_query, timer))
+    rag_task = asyncio.create_task(
+        timer.run("spec_rag_retrieval", _retrieve_from_profile, user_query, sims_file_path))
+    plan_task = asyncio.create_task(timer.run("spec_sim_plan", _select_categories, user_query, sims_file_path))
+
+    try:
+        decision = await router_task
+    except BaseException:
+        rag_task.cancel()
+        plan_task.cancel()
+        raise
+
+    if decision.get("action") == "respond":
+        winner, winner_name, loser = rag_task, "spec_rag_retrieval", plan_task
+    else:
+        winner, winner_name, loser = plan_task, "spec_sim_plan", rag_task
+
+    loser.cancel()
+    _speculation_stats["requests"] += 1
+    _speculation_stats["wasted_calls"] += 1
+
+    def _account(task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            return
+        _speculation_stats["prefixes_used"] += 1
+        # Latency saved is the part of the prefix that overlapped the router call
+        router_end = timer.stages["router"]["end"]
+        stage = timer.stages[winner_name]
+        _speculation_stats["latency_saved_seconds"] += max(0.0, min(stage["end"], router_end) - stage["start"])
+
+    winner.add_done_callback(_account)
+    return decision, winner
+
+
+def get_speculation_stats() -> Dict[str, float]:
+    """
+    Returns wasted calls versus latency saved by speculative routing.
+    """
+    stats = dict(_speculation_stats)
+    requests = stats["requests"]
+    stats["avg_latency_saved_seconds"] = stats["latency_saved_seconds"] / requests if requests else 0.0
+    stats["wasted_calls_per_request"] = stats["wasted_calls"] / requests if requests else 0.0
+    return stats
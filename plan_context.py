@@ -0,0 +1,159 @@
+import json
+import math
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from embedding_cache import get_cached_embeddings
+from numpy_retriever import _normalize_rows
+from sim_index import fact_search_text
+from tokens import estimate_json_tokens, estimate_tokens
+
+
+DEFAULT_TOKEN_BUDGET = 800
+
+# A fact's score is RELEVANCE_WEIGHT * similarity to the task + RECENCY_WEIGHT * recency,
+# where recency halves every RECENCY_HALF_LIFE_DAYS since the fact was last confirmed
+RELEVANCE_WEIGHT = 0.75
+RECENCY_WEIGHT = 0.25
+RECENCY_HALF_LIFE_DAYS = 365
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+_metrics = {
+    "turns": 0,
+    "original_tokens": 0,
+    "context_tokens": 0,
+    "facts_in": 0,
+    "facts_kept": 0,
+}
+_metrics_lock = threading.Lock()
+
+
+def _parse_timestamp(value: str) -> Optional[datetime]:
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _last_updated(fact_obj: Dict) -> Optional[datetime]:
+    parsed = [_parse_timestamp(t) for t in fact_obj.get("timestamps", [])]
+    parsed = [t for t in parsed if t is not None]
+    return max(parsed) if parsed else None
+
+
+def _relevance_scores(task: str, texts: List[str]) -> np.ndarray:
+    """
+    Cosine similarity of each fact text to the task, with word overlap as a
+    fallback when embeddings are unavailable.
+    """
+    try:
+        embeddings = get_cached_embeddings()
+        matrix = _normalize_rows(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+        query = _normalize_rows(np.asarray(embeddings.embed_query(task), dtype=np.float32))
+        return matrix @ query
+    except Exception as e:
+        print(f"Warning: Embedding relevance unavailable, using word overlap: {e}")
+        task_words = set(_WORD.findall(task.lower()))
+        return np.array([
+            len(task_words & set(_WORD.findall(text.lower()))) / (len(task_words) or 1)
+            for text in texts
+        ], dtype=np.float32)
+
+
+def build_plan_context(relevant_sims: Dict, task: str, token_budget: Optional[int] = None,
+                       now: Optional[datetime] = None) -> Tuple[Dict[str, List[Dict[str, str]]], Dict[str, int]]:
+    """
+    Picks the profile facts the planning agent sees on this turn.
+
+    Facts of the given categories are ranked by relevance to the task and by
+    recency, and added best first until the token budget is used up. Each
+    fact keeps only its text and the date it was last confirmed; ids, the
+    full timestamp history and category blobs such as Credentials and
+    Relationships are dropped. Repeated fact texts are kept once.
+
+    Args:
+        relevant_sims: Category data from fetch_relevant_categories
+        task: Text the facts are ranked against (task summary and user message)
+        token_budget: Estimated tokens for the result (default:
+            PLAN_CONTEXT_TOKEN_BUDGET, then DEFAULT_TOKEN_BUDGET)
+        now: Reference time for recency (defaults to now, UTC)
+
+    Returns:
+        ({category: [{"fact", "updated"}]}, stats with original/context token estimates)
+    """
+    token_budget = token_budget or int(os.getenv("PLAN_CONTEXT_TOKEN_BUDGET", str(DEFAULT_TOKEN_BUDGET)))
+    now = now or datetime.now(timezone.utc)
+
+    candidates = {}
+    for category, category_data in (relevant_sims or {}).items():
+        if not isinstance(category_data, dict):
+            continue
+        for fact_obj in category_data.get("Facts", []):
+            text = fact_obj.get("fact", "")
+            if not text:
+                continue
+            updated = _last_updated(fact_obj)
+            key = (category, text)
+            # Duplicated facts: keep the most recently confirmed copy
+            if key not in candidates or (updated and (candidates[key][1] is None or updated > candidates[key][1])):
+                candidates[key] = (fact_obj, updated)
+
+    keys = list(candidates)
+    context: Dict[str, List[Dict[str, str]]] = {}
+    if keys:
+        relevance = _relevance_scores(task, [fact_search_text(category, candidates[(category, text)][0])
+                                             for category, text in keys])
+        recency = np.array([
+            math.pow(0.5, max((now - updated).days, 0) / RECENCY_HALF_LIFE_DAYS) if updated else 0.0
+            for _, updated in candidates.values()
+        ], dtype=np.float32)
+        scores = RELEVANCE_WEIGHT * relevance + RECENCY_WEIGHT * recency
+
+        remaining = token_budget
+        for i in np.argsort(-scores, kind="stable"):
+            category, text = keys[i]
+            updated = candidates[keys[i]][1]
+            entry = {"fact": text, "updated": updated.strftime("%Y-%m-%d") if updated else ""}
+            # Category name and list brackets are paid for once, with its first fact
+            cost = estimate_json_tokens(entry) + (0 if category in context else estimate_tokens(category) + 2)
+            if cost > remaining:
+                continue
+            context.setdefault(category, []).append(entry)
+            remaining -= cost
+
+        # Present categories in the caller's (relevance) order
+        context = {category: context[category] for category in relevant_sims if category in context}
+
+    stats = {
+        "original_tokens": estimate_json_tokens(relevant_sims, indent=2),
+        "context_tokens": estimate_tokens(json.dumps(context, separators=(",", ":"))),
+        "facts_in": sum(len(data.get("Facts", [])) for data in (relevant_sims or {}).values()
+                        if isinstance(data, dict)),
+        "facts_kept": sum(len(facts) for facts in context.values()),
+    }
+    _record(stats)
+    return context, stats
+
+
+def _record(stats: Dict[str, int]):
+    with _metrics_lock:
+        _metrics["turns"] += 1
+        for key, value in stats.items():
+            _metrics[key] += value
+
+
+def get_plan_context_metrics() -> Dict[str, float]:
+    """
+    Returns total and per-turn token savings of the planner context.
+    """
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    saved = metrics["original_tokens"] - metrics["context_tokens"]
+    metrics["tokens_saved"] = saved
+    metrics["avg_tokens_saved_per_turn"] = saved / metrics["turns"] if metrics["turns"] else 0.0
+    return metrics
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from category_ranker import release_category_ranker
+from fact_store import FactStore
+from numpy_retriever import release_fact_retriever
+from sim_index import release_sim_index
+from sim_sqlite import is_sqlite_path
+from sim_storage import journal_path_for
+
+
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def _file_signature(sims_file_path: str) -> Tuple:
+    """
+    Returns (mtime_ns, size) of a profile and its side files, used to detect
+    writes made by other processes.
+    """
+    if is_sqlite_path(sims_file_path):
+        paths = (sims_file_path, sims_file_path + "-wal")
+    else:
+        journal_path = journal_path_for(sims_file_path)
+        paths = (sims_file_path, journal_path, journal_path + ".compacting")
+
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class ProfileRegistry:
+    """
+    Maps user ids to sharded profile files and keeps the hottest profiles in memory.
+
+    Each user's profile lives at '<root>/<shard>/<user_id>.json' (or '.db'
+    with the sqlite backend), where the shard is the first two hex digits of
+    the user id's SHA-1, so no directory grows past a few thousand files.
+    Loaded profiles are FactStores held in a bounded LRU; a profile is
+    re-parsed only when its file (size, mtime) changed on disk, and writes
+    made through the store itself are recorded with mark_written so they do
+    not trigger a re-parse; concurrent loads of the same profile wait for a
+    single parse. Readers should use store.view(). Evicting a profile also
+    drops its derived retrieval indexes, so memory stays bounded by
+    max_profiles rather than by the number of users seen.
+    """
+
+    def __init__(self, root: str = "profiles", max_profiles: int = 256, backend: str = "json",
+                 default_path: str = "sim.json"):
+        self.root = root
+        self.max_profiles = max_profiles
+        self.backend = backend
+        self.default_path = default_path
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.parses = 0
+        self.parse_seconds = 0.0
+        self._profiles: "OrderedDict[str, Tuple[Tuple, FactStore]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per profile path, so concurrent cold loads of a profile parse it once
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    def path_for(self, user_id: Optional[str] = None) -> str:
+        """
+        Returns the profile path of a user; no user id means the single-user default profile.
+        """
+        if not user_id:
+            return self.default_path
+        digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+        name = _UNSAFE_CHARS.sub("_", user_id)
+        if name != user_id:
+            # Keep ids that only differ in unsafe characters apart
+            name = f"{name}-{digest[:8]}"
+        extension = ".db" if self.backend == "sqlite" else ".json"
+        return os.path.join(self.root, digest[:2], name + extension)
+
+    def get(self, user_id: Optional[str] = None) -> FactStore:
+        """
+        Returns the in-memory profile of a user, loading it on first use.
+        """
+        return self.load(self.path_for(user_id))
+
+    def load(self, sims_file_path: str) -> FactStore:
+        """
+        Returns the in-memory profile stored at a path, loading or reloading it as needed.
+        """
+        store = self._hit(sims_file_path, _file_signature(sims_file_path))
+        if store is not None:
+            return store
+
+        with self._load_lock(sims_file_path):
+            # Another thread may have (re)loaded the profile while we waited
+            signature = _file_signature(sims_file_path)
+            store = self._hit(sims_file_path, signature)
+            if store is not None:
+                return store
+
+            # Parse outside the registry lock so a cold user does not stall every other request
+            os.makedirs(os.path.dirname(sims_file_path) or ".", exist_ok=True)
+            start = time.perf_counter()
+            store = FactStore.load(sims_file_path)
+            elapsed = time.perf_counter() - start
+
+            with self._lock:
+                self.parses += 1
+                self.parse_seconds += elapsed
+                if sims_file_path in self._profiles:
+                    self.reloads += 1
+                else:
+                    self.misses += 1
+                self._profiles[sims_file_path] = (signature, store)
+                self._profiles.move_to_end(sims_file_path)
+                while len(self._profiles) > self.max_profiles:
+                    evicted_path, _ = self._profiles.popitem(last=False)
+                    self._load_locks.pop(evicted_path, None)
+                    self.evictions += 1
+                    release_fact_retriever(evicted_path)
+                    release_sim_index(evicted_path)
+                    release_category_ranker(evicted_path)
+        return store
+
+    def _hit(self, sims_file_path: str, signature: Tuple) -> Optional[FactStore]:
+        """
+        Returns the cached profile if it is still current, counting the hit.
+        """
+        with self._lock:
+            cached = self._profiles.get(sims_file_path)
+            if cached is None or cached[0] != signature:
+                return None
+            self._profiles.move_to_end(sims_file_path)
+            self.hits += 1
+            return cached[1]
+
+    def _load_lock(self, sims_file_path: str) -> threading.Lock:
+        with self._lock:
+            if sims_file_path not in self._load_locks:
+                self._load_locks[sims_file_path] = threading.Lock()
+            return self._load_locks[sims_file_path]
+
+    def mark_written(self, sims_file_path: str):
+        """
+        Records that this process just wrote a profile it holds in memory, so
+        the write is not mistaken for an external change and re-parsed.
+        """
+        with self._lock:
+            cached = self._profiles.get(sims_file_path)
+            if cached is not None:
+                self._profiles[sims_file_path] = (_file_signature(sims_file_path), cached[1])
+
+    def invalidate(self, sims_file_path: str):
+        """
+        Drops a profile from memory; the next access reloads it.
+        """
+        with self._lock:
+            self._profiles.pop(sims_file_path, None)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns hit/miss/reload/eviction counts and parse cost for the hot-profile cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses + self.reloads
+            return {
+                "parses": self.parses,
+                "parse_seconds": round(self.parse_seconds, 4),
+                "avg_parse_ms": round(self.parse_seconds / self.parses * 1000, 2) if self.parses else 0.0,
+                "profiles": len(self._profiles),
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# One registry per process; run one process per core and shard users across them
+default_registry = ProfileRegistry(
+    root=os.getenv("PROFILE_ROOT", "profiles"),
+    max_profiles=int(os.getenv("PROFILE_CACHE_SIZE", "256")),
+    backend=os.getenv("PROFILE_BACKEND", "json"),
+)
@@ -0,0 +1,268 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from profile_registry import ProfileRegistry, default_registry
+from sim_update import update_user_sims, apply_sim_action
+from tracing import trace
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile_updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sims_file_path TEXT NOT NULL,
+    user_query TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS profile_updates_pending ON profile_updates(status, sims_file_path, id);
+"""
+
+
+def coalesce_queries(queries: List[str]) -> str:
+    """
+    Combines several pending messages of one user into a single update request.
+    """
+    if len(queries) == 1:
+        return queries[0]
+    lines = "\n".join(f"{i}. {query}" for i, query in enumerate(queries, start=1))
+    return f"The user sent these messages, oldest first. Consider all of them together:\n{lines}"
+
+
+class ProfileUpdateQueue:
+    """
+    Durable FIFO of pending profile updates, stored in a local SQLite database.
+
+    An enqueued update survives a crash or restart: rows are only deleted once
+    the update has been applied. Claimed rows record which queue instance
+    claimed them and when; a 'processing' row whose lease (lease_seconds) has
+    run out is assumed to belong to a dead worker and is claimable again, so
+    several processes can share one queue without re-running each other's
+    in-flight updates.
+    """
+
+    def __init__(self, db_path: str = "profile_updates.db", max_attempts: int = 3,
+                 lease_seconds: float = 300.0):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(profile_updates)")}
+            # Queues created before leases existed
+            for column, column_type in (("claimed_by", "TEXT"), ("claimed_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE profile_updates ADD COLUMN {column} {column_type}")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _release_expired(self, conn):
+        conn.execute(
+            "UPDATE profile_updates SET status = 'pending', claimed_by = NULL "
+            "WHERE status = 'processing' AND (claimed_at IS NULL OR claimed_at < ?)",
+            (time.time() - self.lease_seconds,),
+        )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def enqueue(self, sims_file_path: str, user_query: str) -> int:
+        """
+        Adds an update for a profile and returns its queue id.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO profile_updates (sims_file_path, user_query, enqueued_at) VALUES (?, ?, ?)",
+                (sims_file_path, user_query, time.time()),
+            )
+            return cursor.lastrowid
+
+    def claim_batch(self, max_queries: int = 8) -> Optional[Tuple[str, List[int], List[str]]]:
+        """
+        Claims the oldest pending update together with the other pending
+        updates of the same profile.
+
+        Returns:
+            (sims_file_path, ids, queries) or None if the queue is empty
+        """
+        with self._connect() as conn:
+            self._release_expired(conn)
+            row = conn.execute(
+                "SELECT sims_file_path FROM profile_updates WHERE status = 'pending' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                "SELECT id, user_query FROM profile_updates WHERE status = 'pending' AND sims_file_path = ? "
+                "ORDER BY id LIMIT ?",
+                (row[0], max_queries),
+            ).fetchall()
+            ids = [r[0] for r in rows]
+            conn.executemany(
+                "UPDATE profile_updates SET status = 'processing', attempts = attempts + 1, "
+                "claimed_by = ?, claimed_at = ? WHERE id = ?",
+                [(self.owner, time.time(), i) for i in ids],
+            )
+            return row[0], ids, [r[1] for r in rows]
+
+    def complete(self, ids: List[int]):
+        """
+        Removes applied updates from the queue.
+        """
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM profile_updates WHERE id = ?", [(i,) for i in ids])
+
+    def fail(self, ids: List[int], error: str):
+        """
+        Returns failed updates to the queue, or parks them as 'failed' after max_attempts.
+        """
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE profile_updates SET last_error = ?, claimed_by = NULL, "
+                "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END WHERE id = ?",
+                [(error, self.max_attempts, i) for i in ids],
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns the number of queued updates per status.
+        """
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM profile_updates GROUP BY status").fetchall())
+
+
+class ProfileUpdateWorker:
+    """
+    Background thread that drains the update queue.
+
+    Each batch is the pending updates of one profile, sent to update_user_sims
+    as one coalesced request and applied with apply_sim_action against the
+    profile held by the registry, so the hot in-memory copy stays current.
+    """
+
+    def __init__(self, queue: ProfileUpdateQueue, registry: Optional[ProfileRegistry] = None,
+                 poll_interval: float = 1.0, max_batch: int = 8):
+        self.queue = queue
+        self.registry = registry or default_registry
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch
+        self.stats = {"batches": 0, "updates": 0, "coalesced": 0, "failures": 0}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._idle = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, sims_file_path: str, user_query: str) -> int:
+        """
+        Enqueues an update and wakes the worker.
+        """
+        update_id = self.queue.enqueue(sims_file_path, user_query)
+        self._idle.clear()
+        self._wake.set()
+        return update_id
+
+    def process_one(self) -> bool:
+        """
+        Processes one coalesced batch.
+
+        Returns:
+            False if there was nothing to do
+        """
+        claimed = self.queue.claim_batch(self.max_batch)
+        if claimed is None:
+            return False
+
+        sims_file_path, ids, queries = claimed
+        try:
+            with trace("profile_update", profile=sims_file_path, coalesced=len(ids)):
+                store = self.registry.load(sims_file_path)
+                result = update_user_sims(coalesce_queries(queries), store, sims_file_path=sims_file_path)
+                if result.get("error"):
+                    raise RuntimeError(result["error"])
+                if not apply_sim_action(result, filepath=sims_file_path, store=store):
+                    # The in-memory copy may hold changes that never reached disk
+                    self.registry.invalidate(sims_file_path)
+                    raise RuntimeError(f"Could not save {sims_file_path}")
+                self.registry.mark_written(sims_file_path)
+        except Exception as e:
+            self.stats["failures"] += 1
+            print(f"Warning: Profile update for {sims_file_path} failed: {e}")
+            self.queue.fail(ids, str(e))
+            return True
+
+        self.queue.complete(ids)
+        self.stats["batches"] += 1
+        self.stats["updates"] += len(ids)
+        self.stats["coalesced"] += len(ids) - 1
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                if self.process_one():
+                    continue
+            except Exception as e:
+                print(f"Warning: Profile update worker error: {e}")
+            self._idle.set()
+            self._wake.wait(self.poll_interval)
+
+    def start(self):
+        """
+        Starts the worker thread if it is not running.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profile-update-worker", daemon=True)
+            self._thread.start()
+
+    def stop(self, drain_timeout: float = 0.0):
+        """
+        Stops the worker, first waiting up to drain_timeout seconds for the
+        queue to empty. Anything left stays queued for the next start.
+        """
+        if drain_timeout > 0:
+            self._idle.wait(drain_timeout)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+_worker: Optional[ProfileUpdateWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_update_worker() -> ProfileUpdateWorker:
+    """
+    Returns the process-wide update worker, started on first use.
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            queue = ProfileUpdateQueue(os.getenv("PROFILE_UPDATE_QUEUE", "profile_updates.db"))
+            _worker = ProfileUpdateWorker(queue)
+            _worker.start()
+        return _worker
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from prompt_assitant import prompt_assistant
+from tokens import estimate_tokens
+
+
+# Bedrock prompt caching (cachePoint blocks) is only offered for these model families
+PROMPT_CACHING_MODEL_PREFIXES = ("anthropic.", "amazon.nova")
+
+
+def supports_prompt_caching(model_id: str) -> bool:
+    """
+    Returns True if Bedrock supports cachePoint blocks for the model (or its inference profile).
+    """
+    # Inference profiles prefix the model id with a region group, e.g. "us.anthropic..."
+    base_id = model_id.split(".", 1)[1] if model_id.split(".", 1)[0] in ("us", "eu", "apac") else model_id
+    return base_id.startswith(PROMPT_CACHING_MODEL_PREFIXES)
+
+
+class PromptTemplate:
+    """
+    One registered version of a prompt.
+
+    The text is the static, cacheable part of the prompt; anything that
+    changes per call (state, profile facts, the user's message) is sent after
+    it so the prefix stays byte-identical across calls.
+    """
+
+    def __init__(self, name: str, version: str, text: str, description: str = ""):
+        self.name = name
+        self.version = version
+        self.text = text
+        self.description = description
+        self.token_count = estimate_tokens(text)
+        self.sha256 = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "version": self.version,
+            "description": self.description,
+            "token_count": self.token_count,
+            "chars": len(self.text),
+            "sha256": self.sha256[:12],
+        }
+
+
+class PromptRegistry:
+    """
+    Versioned prompt templates with precomputed token counts.
+
+    The active version of a prompt is the one named by the environment
+    variable <NAME>_PROMPT_VERSION, otherwise the most recently registered.
+    """
+
+    def __init__(self):
+        self._templates: Dict[str, Dict[str, PromptTemplate]] = defaultdict(dict)
+
+    def register(self, name: str, version: str, text: str, description: str = "") -> PromptTemplate:
+        """
+        Registers a prompt version; re-registering identical text is a no-op.
+        """
+        existing = self._templates[name].get(version)
+        if existing is not None:
+            if existing.text != text:
+                raise ValueError(f"Prompt {name}@{version} is already registered with different text")
+            return existing
+        template = PromptTemplate(name, version, text, description)
+        self._templates[name][version] = template
+        return template
+
+    def get(self, name: str, version: Optional[str] = None) -> PromptTemplate:
+        """
+        Returns a specific version of a prompt, or the active one.
+        """
+        versions = self._templates.get(name)
+        if not versions:
+            raise KeyError(f"No prompt registered under '{name}'")
+        version = version or os.getenv(f"{name.upper()}_PROMPT_VERSION")
+        if version is None:
+            return list(versions.values())[-1]
+        if version not in versions:
+            raise KeyError(f"Prompt '{name}' has no version '{version}' (have {list(versions)})")
+        return versions[version]
+
+    def versions(self, name: str) -> List[str]:
+        return list(self._templates.get(name, {}))
+
+    def describe(self) -> List[Dict[str, Any]]:
+        """
+        Returns name, version and token count of every registered prompt.
+        """
+        return [t.describe() for versions in self._templates.values() for t in versions.values()]
+
+
+def cacheable_content(prefix: str, suffix: str, model_id: str, separator: str = "\n\n") -> List[Dict]:
+    """
+    Builds converse content blocks for a static prefix followed by per-call text.
+
+    When the model supports prompt caching the prefix becomes its own block
+    followed by a cachePoint; otherwise a single text block is sent exactly as
+    before, since splitting it would change nothing but the request shape.
+    """
+    if supports_prompt_caching(model_id):
+        return [{"text": prefix}, {"cachePoint": {"type": "default"}}, {"text": suffix}]
+    return [{"text": f"{prefix}{separator}{suffix}"}]
+
+
+# Per prompt version: observed input tokens split into cached and uncached
+_usage: Dict[str, Dict[str, int]] = defaultdict(lambda: {
+    "calls": 0,
+    "input_tokens": 0,
+    "cache_read_tokens": 0,
+    "cache_write_tokens": 0,
+    "prefix_tokens": 0,
+})
+_usage_lock = threading.Lock()
+
+
+def record_prompt_usage(template: PromptTemplate, usage: Optional[Dict[str, Any]] = None,
+                        estimated_input_tokens: Optional[int] = None):
+    """
+    Records the input-token usage of one model call made with a template.
+
+    Args:
+        template: The prompt template used as the static prefix
+        usage: The "usage" dict of a converse response (inputTokens,
+            cacheReadInputTokens, cacheWriteInputTokens)
+        estimated_input_tokens: Used when the provider reports no usage
+    """
+    usage = usage or {}
+    with _usage_lock:
+        stats = _usage[template.key]
+        stats["calls"] += 1
+        stats["cache_read_tokens"] += usage.get("cacheReadInputTokens", 0) or 0
+        stats["cache_write_tokens"] += usage.get("cacheWriteInputTokens", 0) or 0
+        stats["input_tokens"] += (usage.get("inputTokens") or estimated_input_tokens or 0) \
+            + (usage.get("cacheReadInputTokens", 0) or 0) + (usage.get("cacheWriteInputTokens", 0) or 0)
+        stats["prefix_tokens"] += template.token_count
+
+
+def get_prompt_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    Returns cached versus uncached input tokens per prompt version.
+    """
+    metrics = {}
+    with _usage_lock:
+        for key, stats in _usage.items():
+            uncached = stats["input_tokens"] - stats["cache_read_tokens"]
+            metrics[key] = dict(stats)
+            metrics[key]["uncached_input_tokens"] = uncached
+            metrics[key]["cached_fraction"] = (
+                stats["cache_read_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0.0)
+    return metrics
+
+
+class PromptUsageCallback(BaseCallbackHandler):
+    """
+    LangChain callback that records token usage of every LLM call an agent
+    makes with a registered prompt as its system message.
+    """
+
+    def __init__(self, prompt_name: str):
+        self.prompt_name = prompt_name
+
+    def on_llm_end(self, response, **kwargs):
+        template = prompt_registry.get(self.prompt_name)
+        for generations in getattr(response, "generations", []):
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                details = usage.get("input_token_details") or {}
+                cache_read = details.get("cache_read", 0) or 0
+                cache_write = details.get("cache_creation", 0) or 0
+                record_prompt_usage(template, {
+                    "inputTokens": max(0, (usage.get("input_tokens") or 0) - cache_read - cache_write),
+                    "cacheReadInputTokens": cache_read,
+                    "cacheWriteInputTokens": cache_write,
+                })
+
+
+prompt_registry = PromptRegistry()
+
+prompt_registry.register(
+    "planner", "1", prompt_assistant,
+    description="Trip planning agent instructions and examples (prompt_assitant.py)",
+)
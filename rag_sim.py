@@ -1,107 +1,84 @@
-import json
-from typing import List, Dict, Any
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-from langchain_aws import BedrockEmbeddings
+import os
+from typing import List, Dict, Any, Optional
+from sim_index import get_sim_index
+from fact_store import FactStore
+from profile_registry import default_registry
+from numpy_retriever import get_fact_retriever
 
 
-def get_top3_relevant_sims(user_query: str, sims_file_path: str = "sim.json", aws_region: str = "us-east-1") -> List[Dict[str, Any]]:
+def get_top3_relevant_sims(user_query: str, sims_file_path: str = "sim.json", aws_region: str = "us-east-1",
+                           backend: Optional[str] = None, store: Optional[FactStore] = None) -> List[Dict[str, Any]]:
     """
     Fetch sims from sim.json, run RAG, and output top 3 similar sims.
+
+    Facts are kept in a persistent on-disk index keyed by fact id; only facts
+    added or changed since the last call are embedded, so a query costs one
+    query embedding plus a lookup.
     
     Args:
         user_query: The user's search query
         sims_file_path: Path to the sim.json file
         aws_region: AWS region for Bedrock
+        backend: "chroma" (persistent index, score is a distance) or "numpy"
+            (in-memory brute force, score is cosine similarity). Defaults to
+            the RAG_BACKEND environment variable, then "chroma".
+        store: Already loaded FactStore to read from instead of the file
     
     Returns:
         List of top 3 most relevant complete sim objects with similarity scores
     """
+    backend = backend or os.getenv("RAG_BACKEND", "chroma")
     
-    print(f"Fetching sims from {sims_file_path}...")
-    with open(sims_file_path, 'r') as f:
-        sims_data = json.load(f)
-
-    # Handle the hierarchical structure: categories -> facts
-    documents = []
-    fact_index = 0
-
-    for category_name, category_data in sims_data.items():
-        if isinstance(category_data, dict) and "Facts" in category_data:
-            facts = category_data.get("Facts", [])
-
-            for fact_obj in facts:
-                fact_id = fact_obj.get("id", "")
-                fact_text = fact_obj.get("fact", "")
-
-                # Create searchable text combining category and fact
-                text = f"{category_name}: {fact_text}"
-
-                documents.append(Document(
-                    page_content=text,
-                    metadata={
-                        "fact_index": fact_index,
-                        "category": category_name,
-                        "fact_id": fact_id,
-                        "original_fact_json": json.dumps(fact_obj)
-                    }
-                ))
-                fact_index += 1
-
-    print(f"Fetched {len(documents)} facts from {len(sims_data)} categories")
+    # The shared snapshot is parsed once per change of the file, not per query
+    store = store or default_registry.load(sims_file_path)
+    sims_data = store.view()
+    entries = store.fact_entries()
+
+    print(f"Fetched {len(entries)} facts from {len(sims_data)} categories")
+
+    if backend == "numpy":
+        retriever = get_fact_retriever(sims_file_path, aws_region)
+        retriever.build(entries)
+        print(f"Running RAG with query: '{user_query}'")
+        return retriever.search(user_query, k=3)
+
+    index = get_sim_index(sims_file_path, aws_region)
+    sync_stats = index.sync(entries)
+    print(
+        f"Index sync: {sync_stats['added']} added, {sync_stats['updated']} updated, "
+        f"{sync_stats['deleted']} deleted, {sync_stats['unchanged']} unchanged"
+    )
 
     # Handle empty documents case
-    if not documents:
+    if not entries:
         print("Warning: No facts found in sim.json")
         return []
     
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=500,
-        chunk_overlap=50
-    )
-    splits = text_splitter.split_documents(documents)
-    
-    
-    embeddings = BedrockEmbeddings(
-        model_id="amazon.titan-embed-text-v2:0",
-        region_name=aws_region
-    )
-    
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        collection_name="sims_rag"
-    )
-    
     print(f"Running RAG with query: '{user_query}'")
-    results = vectorstore.similarity_search_with_score(user_query, k=3)
+    results = index.search(user_query, k=3)
 
     top3_facts = []
     seen_fact_ids = set()
 
     for doc, score in results:
-        # Safely access metadata with .get() to handle splits
-        fact_id = doc.metadata.get('fact_id', '')
+        # Older index entries have no entry_key; their fact id is the entry key
+        key = doc.metadata.get('entry_key') or doc.metadata.get('fact_id', '')
 
-        if not fact_id:
-            # Skip if metadata is missing
+        if not key or key not in entries:
+            # Skip if metadata is missing or the fact is gone from the profile
             continue
 
         # Avoid duplicates
-        if fact_id in seen_fact_ids:
+        if key in seen_fact_ids:
             continue
 
-        seen_fact_ids.add(fact_id)
-
-        original_fact_json = doc.metadata.get('original_fact_json', '{}')
-        original_fact = json.loads(original_fact_json)
+        seen_fact_ids.add(key)
 
         top3_facts.append({
             "rank": len(top3_facts) + 1,
-            "category": doc.metadata.get('category', 'Unknown'),
-            "fact_id": fact_id,
-            "fact": original_fact,
+            "category": entries[key]["category"],
+            "fact_id": entries[key]["fact_id"],
+            "fact": entries[key]["fact"],
             "similarity_score": float(score)
         })
 
@@ -1,13 +1,17 @@
-import boto3
+import asyncio
+import contextvars
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional
+from bedrock_clients import get_bedrock_client
 from botocore.exceptions import ClientError
 
-def response(query, sim):
-    brt = boto3.client("bedrock-runtime")
-
-
-    model_id = "meta.llama3-1-8b-instruct-v1:0"
+# Time-to-first-token and throughput of recent streamed responses
+_stream_metrics: List[Dict[str, float]] = []
+_stream_metrics_lock = threading.Lock()
 
 
+def _build_conversation(query, sim):
     system_message = """You are a personal AI assistant. Use the user's profile information to provide relevant, personalized answers.
     (Use USer Profile only if u feel the answer requires it)
 
@@ -18,7 +22,7 @@ def response(query, sim):
 
     Answer , incorporating relevant details from their profile IF YOU FEEL THE ANSWER REQUIRES IT. DO ONLY WHAT YOU ARE ASKED FOR """
     
-    conversation = [
+    return [
         {
             "role": "user",
             "content": [{"text": system_message.format(
@@ -29,6 +33,16 @@ def response(query, sim):
     ]
 
 
+def response(query, sim):
+    brt = get_bedrock_client()
+
+
+    model_id = "meta.llama3-1-8b-instruct-v1:0"
+
+
+    conversation = _build_conversation(query, sim)
+
+
     try:
         response = brt.converse(
             modelId=model_id,
@@ -43,4 +57,117 @@ def response(query, sim):
 
     except (ClientError, Exception) as e:
         return(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
-        
\ No newline at end of file
+
+
+async def response_stream(query, sim, metrics: Optional[Dict[str, float]] = None) -> AsyncIterator[str]:
+    """
+    Streams the answer as text chunks using the Bedrock converse_stream API.
+
+    The blocking event stream is read in a worker thread and handed to the
+    event loop through a queue. If the consumer stops early (cancelled or
+    closed), the event stream is closed so the worker stops reading.
+    Time-to-first-token and tokens/sec of the request are written into
+    `metrics` and kept in the recent history (see get_stream_metrics).
+
+    Args:
+        query: The user's question
+        sim: Relevant profile facts
+        metrics: Dict to fill with this request's ttft_seconds, input_tokens,
+            output_tokens, total_seconds and tokens_per_second
+
+    Yields:
+        Text chunks as they arrive
+    """
+    brt = get_bedrock_client()
+    model_id = "meta.llama3-1-8b-instruct-v1:0"
+    conversation = _build_conversation(query, sim)
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+    metrics = metrics if metrics is not None else {}
+    metrics.update({"ttft_seconds": None, "input_tokens": 0, "output_tokens": 0, "total_seconds": 0.0,
+                    "tokens_per_second": 0.0})
+    start = time.perf_counter()
+    stopped = threading.Event()
+    open_stream = {}
+
+    def _read_stream():
+        try:
+            stream = brt.converse_stream(
+                modelId=model_id,
+                messages=conversation,
+                inferenceConfig={"maxTokens": 512, "temperature": 0.5, "topP": 0.9},
+            )
+            open_stream["events"] = stream["stream"]
+            if stopped.is_set():
+                return
+            for event in stream["stream"]:
+                if stopped.is_set():
+                    break
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"].get("text", "")
+                    if text:
+                        if metrics["ttft_seconds"] is None:
+                            metrics["ttft_seconds"] = time.perf_counter() - start
+                        loop.call_soon_threadsafe(queue.put_nowait, text)
+                elif "metadata" in event:
+                    usage = event["metadata"].get("usage", {})
+                    metrics["input_tokens"] = usage.get("inputTokens", 0)
+                    metrics["output_tokens"] = usage.get("outputTokens", 0)
+        except (ClientError, Exception) as e:
+            if not stopped.is_set():
+                loop.call_soon_threadsafe(queue.put_nowait, f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
+        finally:
+            if stopped.is_set():
+                _close_events(open_stream.get("events"))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    # Run in a copy of this context so the Bedrock call's span nests under the current one
+    reader = loop.run_in_executor(None, contextvars.copy_context().run, _read_stream)
+
+    finished = False
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is done:
+                break
+            yield chunk
+        await reader
+        finished = True
+    finally:
+        if not finished:
+            # Consumer went away: stop the worker and drop the HTTP connection
+            # instead of reading the rest of the answer nobody will see
+            stopped.set()
+            _close_events(open_stream.get("events"))
+
+    metrics["total_seconds"] = time.perf_counter() - start
+    if metrics["ttft_seconds"] is not None:
+        generation_seconds = metrics["total_seconds"] - metrics["ttft_seconds"]
+        if generation_seconds > 0:
+            metrics["tokens_per_second"] = metrics["output_tokens"] / generation_seconds
+    with _stream_metrics_lock:
+        _stream_metrics.append(dict(metrics))
+        del _stream_metrics[:-100]
+
+
+def _close_events(events):
+    if events is None or not hasattr(events, "close"):
+        return
+    try:
+        events.close()
+    except Exception as e:
+        print(f"Warning: Could not close Bedrock event stream: {e}")
+
+
+def get_stream_metrics() -> List[Dict[str, float]]:
+    """
+    Returns TTFT/throughput records for the most recent streamed responses (newest last).
+
+    Under concurrency the newest record may belong to another request; pass
+    a metrics dict to response_stream for the numbers of one call.
+    """
+    with _stream_metrics_lock:
+        return list(_stream_metrics)
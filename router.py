@@ -1,26 +1,18 @@
-import boto3
+from bedrock_clients import get_bedrock_client
 from botocore.exceptions import ClientError
 import json
-from typing import Dict
+import time
+from typing import Dict, Optional
+from router_classifier import get_router_classifier
+from router_cache import get_router_cache
+from prompt_registry import PromptTemplate, prompt_registry, cacheable_content, record_prompt_usage
 
-def route_user_input(user_input: str) -> Dict[str, str]:
-    """
-    Routes user input to determine action type and similarity check needs.
-    
-    Returns:
-        Dict with keys:
-        - 'action': 'plan' or 'respond'
-        - 'sim_update': 'y' or 'n'
-    """
-    
-    # Create an Amazon Bedrock Runtime client
-    brt = boto3.client("bedrock-runtime")
-    
-    # Set the model ID for Mistral
-    model_id = "mistral.mistral-large-2402-v1:0"
-    
-    # Create the routing prompt with two classification tasks
-    system_message  = """SYSTEM:
+
+# Mistral model used for routing
+ROUTER_MODEL_ID = "mistral.mistral-large-2402-v1:0"
+
+# The routing prompt with two classification tasks
+ROUTER_PROMPT = """SYSTEM:
 You are a highly reliable assistant specialized in travel query classification and routing.
 Follow all instructions exactly and produce structured, correct, and concise outputs.
 
@@ -107,11 +99,70 @@ Reasoning: Planning query + reveals time constraint and beach preference.
 
 
 """
+
+prompt_registry.register("router", "1", ROUTER_PROMPT, description="Action and sim_update classification for Mistral")
+
+
+def route_user_input(user_input: str) -> Dict[str, str]:
+    """
+    Routes user input to determine action type and similarity check needs.
+    
+    Returns:
+        Dict with keys:
+        - 'action': 'plan' or 'respond'
+        - 'sim_update': 'y' or 'n'
+    """
+    # Cache fingerprint, fast-path examples and the LLM call all use the active version
+    template = prompt_registry.get("router")
+    cache = get_router_cache(template.text, ROUTER_MODEL_ID)
+    if cache is not None:
+        cached = cache.get(user_input)
+        if cached is not None:
+            return cached
+
+    classifier = get_router_classifier(template.text)
+
+    if classifier is not None and classifier.mode == "on":
+        decision, confidence = classifier.predict(user_input)
+        if confidence >= classifier.threshold:
+            classifier.record_fast_path()
+            if cache is not None:
+                cache.put(user_input, decision)
+            return decision
+
+    start = time.perf_counter()
+    decision = _route_with_llm(user_input, template)
+    if decision is None:
+        return {"action": "respond", "sim_update": "n"}  # Default values on error
+
+    if classifier is not None:
+        classifier.record_llm_decision(user_input, decision, time.perf_counter() - start)
+    if cache is not None:
+        cache.put(user_input, decision)
+
+    return decision
+
+
+def _route_with_llm(user_input: str, template: Optional[PromptTemplate] = None) -> Optional[Dict[str, str]]:
+    """
+    Classifies the query with the Mistral router prompt (the active registry version by default).
+
+    Returns:
+        The validated decision, or None if the model call or parsing failed
+    """
+    
+    # Create an Amazon Bedrock Runtime client
+    brt = get_bedrock_client()
+    
+    # Set the model ID for Mistral
+    model_id = ROUTER_MODEL_ID
+    
+    template = template or prompt_registry.get("router")
     
     conversation = [
         {
             "role": "user",
-            "content": [{"text": f"{system_message}\n\nUser message: {user_input}"}],
+            "content": cacheable_content(template.text, f"User message: {user_input}", model_id),
         }
     ]
     
@@ -123,6 +174,8 @@ Reasoning: Planning query + reveals time constraint and beach preference.
             inferenceConfig={"maxTokens": 100, "temperature": 0.1, "topP": 0.9},
         )
         
+        record_prompt_usage(template, response.get("usage"))
+
         # Extract the response text
         response_text = response["output"]["message"]["content"][0]["text"]
         
@@ -148,8 +201,8 @@ Reasoning: Planning query + reveals time constraint and beach preference.
         
     except json.JSONDecodeError:
         print(f"ERROR: Could not parse JSON from response: {response_text}")
-        return {"action": "respond", "sim_update": "n"}  # Default values on error
+        return None
         
     except (ClientError, Exception) as e:
         print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
-        return {"action": "respond", "sim_update": "n"}  # Default values on error
\ No newline at end of file
+        return None
\ No newline at end of file
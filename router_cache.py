@@ -0,0 +1,195 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+
+# Process-wide decision cache, created on first use
+_cache: Optional["RouterDecisionCache"] = None
+_cache_lock = threading.Lock()
+
+
+def normalize_query(text: str) -> str:
+    """
+    Normalizes a user query so near-identical phrasings share a cache entry.
+
+    'Best time to visit Japan?' and 'best time to visit  japan' both become
+    'best time to visit japan'. Currency symbols and digits are kept because
+    they change the routing decision.
+    """
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w\s$€£]", " ", text)
+    return " ".join(text.split())
+
+
+def router_fingerprint(prompt: str, model_id: str) -> str:
+    """
+    Identifies the router configuration; cached decisions are only valid for one fingerprint.
+    """
+    return hashlib.sha256(f"{model_id}\n{prompt}".encode("utf-8")).hexdigest()
+
+
+class RouterDecisionCache:
+    """
+    LRU cache of router decisions with a per-entry TTL.
+
+    Entries are keyed by the normalized query text. When persist_path is set
+    the cache is saved (at most every save_interval seconds and at exit) and
+    reloaded on start, unless the router fingerprint has changed.
+    """
+
+    def __init__(self, fingerprint: str, max_entries: int = 10000, ttl_seconds: float = 86400,
+                 persist_path: Optional[str] = None, save_interval: float = 5.0):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.save_interval = save_interval
+        self.hits = 0
+        self.misses = 0
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._invalidation_hooks: List[Callable[[str, str], None]] = []
+        self._last_save = 0.0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if persist_path:
+            self._load()
+            atexit.register(self.save)
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, 'r') as f:
+                saved = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            print(f"Warning: Could not read router cache {self.persist_path}, starting empty")
+            return
+
+        if saved.get("fingerprint") != self.fingerprint:
+            print("Router prompt or model changed, discarding persisted router cache")
+            return
+
+        now = time.time()
+        for key, decision, expires_at in saved.get("entries", []):
+            if expires_at > now:
+                self.entries[key] = {"decision": decision, "expires_at": expires_at}
+
+    def get(self, text: str) -> Optional[Dict[str, str]]:
+        key = normalize_query(text)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["expires_at"] <= time.time():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry["decision"])
+
+    def put(self, text: str, decision: Dict[str, str]):
+        key = normalize_query(text)
+        with self._lock:
+            self.entries[key] = {"decision": dict(decision), "expires_at": time.time() + self.ttl_seconds}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self._dirty = True
+
+        if self.persist_path and time.time() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self):
+        """
+        Writes the cache to persist_path atomically.
+        """
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = {
+                "fingerprint": self.fingerprint,
+                "entries": [[key, e["decision"], e["expires_at"]] for key, e in self.entries.items()],
+            }
+            self._dirty = False
+            self._last_save = time.time()
+
+        tmp_path = self.persist_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.persist_path)
+
+    def on_invalidate(self, hook: Callable[[str, str], None]):
+        """
+        Registers a callback run with (old_fingerprint, new_fingerprint) on invalidation.
+        """
+        self._invalidation_hooks.append(hook)
+
+    def check_fingerprint(self, fingerprint: str) -> bool:
+        """
+        Clears the cache if the router prompt or model changed.
+
+        Returns:
+            True if the cache was invalidated
+        """
+        if fingerprint == self.fingerprint:
+            return False
+
+        old = self.fingerprint
+        with self._lock:
+            self.entries.clear()
+            self.fingerprint = fingerprint
+            self._dirty = True
+        for hook in self._invalidation_hooks:
+            hook(old, fingerprint)
+        self.save()
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.entries),
+        }
+
+
+def get_router_cache(prompt: str, model_id: str) -> Optional[RouterDecisionCache]:
+    """
+    Returns the process-wide router decision cache, or None when ROUTER_CACHE=off.
+
+    The cache is checked against the current prompt/model fingerprint on every
+    call, so editing either invalidates it.
+
+    Environment:
+        ROUTER_CACHE: "on" (default) or "off"
+        ROUTER_CACHE_TTL: entry lifetime in seconds (default 86400)
+        ROUTER_CACHE_SIZE: maximum number of entries (default 10000)
+        ROUTER_CACHE_PATH: optional JSON file to persist the cache across restarts
+    """
+    global _cache
+
+    if os.getenv("ROUTER_CACHE", "on").lower() == "off":
+        return None
+
+    fingerprint = router_fingerprint(prompt, model_id)
+    with _cache_lock:
+        if _cache is None:
+            _cache = RouterDecisionCache(
+                fingerprint,
+                max_entries=int(os.getenv("ROUTER_CACHE_SIZE", "10000")),
+                ttl_seconds=float(os.getenv("ROUTER_CACHE_TTL", "86400")),
+                persist_path=os.getenv("ROUTER_CACHE_PATH"),
+            )
+    _cache.check_fingerprint(fingerprint)
+    return _cache
@@ -0,0 +1,240 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+
+DEFAULT_LOG_PATH = "router_decisions.jsonl"
+
+# Process-wide classifier, created on first use when the fast path is enabled
+_classifier: Optional["RouterClassifier"] = None
+_classifier_lock = threading.Lock()
+
+
+def prompt_hash(prompt: str) -> str:
+    """
+    Short hash of the router prompt, recorded with logged decisions.
+    """
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def parse_prompt_examples(prompt: str) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    Extracts the few-shot (user message, decision) pairs from the router prompt.
+    """
+    examples = []
+    for text, output in re.findall(r'User: "(.+?)"\s*\nOutput: (\{.*?\})', prompt):
+        try:
+            examples.append((text, json.loads(output)))
+        except json.JSONDecodeError:
+            continue
+    return examples
+
+
+def extract_features(text: str) -> List[str]:
+    """
+    Lexical features: lowercase words, word bigrams and a few shape markers.
+    """
+    lowered = text.lower()
+    words = re.findall(r"[a-z']+", lowered)
+    features = words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+    if re.search(r"[$€£]\s*\d|\d+\s*(dollars|usd|eur)", lowered):
+        features.append("__money__")
+    if re.search(r"\d", lowered):
+        features.append("__number__")
+    if lowered.rstrip().endswith("?"):
+        features.append("__question__")
+    return features
+
+
+class NaiveBayesLabel:
+    """
+    Multinomial naive Bayes over lexical features for one binary routing label.
+    """
+
+    def __init__(self, classes: Tuple[str, str]):
+        self.classes = classes
+        self.doc_counts = Counter()
+        self.feature_counts: Dict[str, Counter] = defaultdict(Counter)
+        self.totals = Counter()
+        self.vocabulary = set()
+
+    def train(self, features: List[str], label: str):
+        self.doc_counts[label] += 1
+        for feature in features:
+            self.feature_counts[label][feature] += 1
+            self.totals[label] += 1
+            self.vocabulary.add(feature)
+
+    def predict(self, features: List[str]) -> Tuple[str, float]:
+        """
+        Returns the most likely class and its posterior probability.
+        """
+        n_docs = sum(self.doc_counts.values())
+        vocab_size = len(self.vocabulary) or 1
+        log_scores = {}
+
+        for label in self.classes:
+            score = math.log((self.doc_counts[label] + 1) / (n_docs + len(self.classes)))
+            for feature in features:
+                score += math.log(
+                    (self.feature_counts[label][feature] + 1) / (self.totals[label] + vocab_size)
+                )
+            log_scores[label] = score
+
+        best = max(log_scores, key=log_scores.get)
+        norm = sum(math.exp(s - log_scores[best]) for s in log_scores.values())
+        return best, 1.0 / norm
+
+
+class RouterClassifier:
+    """
+    Local fast-path router that answers without the LLM when it is confident.
+
+    Trained on the router prompt's few-shot examples plus every decision the
+    LLM router has made (logged to a JSONL file), so it improves as traffic
+    is served. Modes:
+        - "shadow": always call the LLM, but log decisions and measure agreement
+        - "on": skip the LLM when both labels clear the confidence threshold
+    """
+
+    def __init__(self, prompt: str, mode: str = "shadow", threshold: float = 0.9,
+                 min_examples: int = 50, log_path: str = DEFAULT_LOG_PATH):
+        self.prompt_hash = prompt_hash(prompt)
+        self.mode = mode
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.log_path = log_path
+        self.action_model = NaiveBayesLabel(("plan", "respond"))
+        self.update_model = NaiveBayesLabel(("y", "n"))
+        self.examples_seen = 0
+        self._lock = threading.Lock()
+
+        self.fast_path_hits = 0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.comparisons = 0
+        self.agreements = 0
+
+        for text, decision in parse_prompt_examples(prompt):
+            self._train(text, decision)
+        for text, decision in self._load_log():
+            self._train(text, decision)
+
+    def _load_log(self) -> List[Tuple[str, Dict[str, str]]]:
+        if not os.path.exists(self.log_path):
+            return []
+
+        logged = []
+        with open(self.log_path, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    # Decisions made under another prompt version are not training data for this one
+                    if record.get("prompt", self.prompt_hash) != self.prompt_hash:
+                        continue
+                    logged.append((record["text"], {"action": record["action"], "sim_update": record["sim_update"]}))
+                except (json.JSONDecodeError, KeyError):
+                    continue
+        return logged
+
+    def _train(self, text: str, decision: Dict[str, str]):
+        if decision.get("action") not in ("plan", "respond") or decision.get("sim_update") not in ("y", "n"):
+            return
+        features = extract_features(text)
+        self.action_model.train(features, decision["action"])
+        self.update_model.train(features, decision["sim_update"])
+        self.examples_seen += 1
+
+    def predict(self, text: str) -> Tuple[Dict[str, str], float]:
+        """
+        Predicts both routing labels.
+
+        Returns:
+            The decision and its confidence (the lower of the two label
+            posteriors; 0.0 until enough examples have been seen)
+        """
+        features = extract_features(text)
+        with self._lock:
+            action, action_p = self.action_model.predict(features)
+            sim_update, update_p = self.update_model.predict(features)
+            confidence = min(action_p, update_p) if self.examples_seen >= self.min_examples else 0.0
+        return {"action": action, "sim_update": sim_update}, confidence
+
+    def record_fast_path(self):
+        with self._lock:
+            self.fast_path_hits += 1
+
+    def record_llm_decision(self, text: str, decision: Dict[str, str], latency: float):
+        """
+        Logs an LLM routing decision, scores local agreement and learns from it.
+        """
+        predicted, confidence = self.predict(text)
+
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += latency
+            self.comparisons += 1
+            if predicted == decision:
+                self.agreements += 1
+            self._train(text, decision)
+
+            with open(self.log_path, 'a') as f:
+                f.write(json.dumps({
+                    "text": text,
+                    "action": decision["action"],
+                    "sim_update": decision["sim_update"],
+                    "latency": round(latency, 4),
+                    "local_prediction": predicted,
+                    "local_confidence": round(confidence, 4),
+                    "prompt": self.prompt_hash,
+                }) + "\n")
+
+    def report(self) -> Dict[str, float]:
+        """
+        Returns agreement rate with the LLM router and estimated latency saved.
+        """
+        avg_llm_latency = self.llm_seconds / self.llm_calls if self.llm_calls else 0.0
+        routed = self.fast_path_hits + self.llm_calls
+        return {
+            "mode": self.mode,
+            "examples_seen": self.examples_seen,
+            "fast_path_hits": self.fast_path_hits,
+            "fast_path_rate": self.fast_path_hits / routed if routed else 0.0,
+            "llm_calls": self.llm_calls,
+            "agreement_rate": self.agreements / self.comparisons if self.comparisons else 0.0,
+            "avg_llm_latency_seconds": avg_llm_latency,
+            "latency_saved_seconds": self.fast_path_hits * avg_llm_latency,
+        }
+
+
+def get_router_classifier(prompt: str) -> Optional[RouterClassifier]:
+    """
+    Returns the process-wide fast-path classifier, or None when ROUTER_FAST_PATH is off.
+
+    Environment:
+        ROUTER_FAST_PATH: "off" (default), "shadow" or "on"
+        ROUTER_CONFIDENCE_THRESHOLD: minimum confidence to skip the LLM (default 0.9)
+        ROUTER_DECISION_LOG: JSONL file of logged LLM decisions
+    """
+    global _classifier
+
+    mode = os.getenv("ROUTER_FAST_PATH", "off").lower()
+    if mode not in ("shadow", "on"):
+        return None
+
+    with _classifier_lock:
+        # A different router prompt version brings different examples: retrain
+        if _classifier is None or _classifier.prompt_hash != prompt_hash(prompt):
+            _classifier = RouterClassifier(
+                prompt,
+                mode=mode,
+                threshold=float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.9")),
+                log_path=os.getenv("ROUTER_DECISION_LOG", DEFAULT_LOG_PATH),
+            )
+    return _classifier
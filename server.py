@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+from dotenv import load_dotenv
+from bedrock_clients import get_client_metrics
+from embedding_cache import get_embedding_cache_stats
+from mcp_connected import plan, initial_plan_state
+from mcp_session import MCPSessionManager
+from pipeline import StageTimer, route, answer_respond, select_plan_context
+from profile_registry import default_registry
+from profile_update_queue import get_update_worker
+from sim_update import get_update_metrics
+from tracing import trace, export_from_env
+
+
+MAX_BODY_BYTES = 1024 * 1024
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Conversation:
+    """
+    Server-side state of one planning conversation.
+
+    Replaces the prev_json loop of main.py: the latest plan output, the
+    profile categories chosen on the first turn and a dedicated MCP session
+    (the agent keeps the conversation in its memory) live here between
+    follow-up requests. The lock allows one turn at a time per conversation.
+    """
+
+    def __init__(self, user_id: Optional[str], sims_file_path: str):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.sims_file_path = sims_file_path
+        self.sim_data: Dict = {}
+        self.state: Dict[str, Any] = initial_plan_state()
+        self.mcp = MCPSessionManager()
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Holds live conversations, bounded by max_conversations and expired after
+    idle_timeout seconds without a turn.
+    """
+
+    def __init__(self, max_conversations: int = 64, idle_timeout: float = 900):
+        self.max_conversations = max_conversations
+        self.idle_timeout = idle_timeout
+        self.conversations: Dict[str, Conversation] = {}
+
+    def create(self, user_id: Optional[str], sims_file_path: str) -> Conversation:
+        if len(self.conversations) >= self.max_conversations:
+            raise HTTPError(503, "Too many open conversations")
+        conversation = Conversation(user_id, sims_file_path)
+        self.conversations[conversation.id] = conversation
+        return conversation
+
+    def get(self, conversation_id: str) -> Conversation:
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            raise HTTPError(404, f"Unknown session '{conversation_id}'")
+        return conversation
+
+    async def close(self, conversation_id: str):
+        conversation = self.conversations.pop(conversation_id, None)
+        if conversation is not None:
+            await conversation.mcp.close()
+
+    async def reap_idle(self) -> int:
+        """
+        Closes conversations idle for longer than idle_timeout.
+        """
+        now = time.monotonic()
+        expired = [c.id for c in self.conversations.values()
+                   if not c.lock.locked() and now - c.last_used > self.idle_timeout]
+        for conversation_id in expired:
+            await self.close(conversation_id)
+        return len(expired)
+
+    async def close_all(self):
+        for conversation_id in list(self.conversations):
+            await self.close(conversation_id)
+
+
+class PipelineServer:
+    """
+    Minimal asyncio HTTP/1.1 server in front of the router -> respond/plan pipeline.
+
+    Endpoints (JSON in, JSON out):
+        POST /query     {"query", "user_id"?}  routes, then answers or starts a plan
+        POST /respond   {"query", "user_id"?}  direct answer, no routing
+        POST /plan      {"query", "user_id"?}  starts a planning conversation
+        POST /followup  {"session_id", "answer"}  next turn of a conversation
+        DELETE /sessions/<session_id>          ends a conversation
+        GET /health
+
+    At most max_connections connections are served at once; extra
+    connections get a 503 right away so a load balancer can retry elsewhere.
+    On SIGINT/SIGTERM the listener closes, in-flight requests get
+    shutdown_grace seconds to finish, then conversations and the profile
+    update worker are shut down.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, max_connections: int = 128,
+                 max_conversations: int = 64, idle_timeout: float = 900, keep_alive_timeout: float = 30,
+                 shutdown_grace: float = 30):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.keep_alive_timeout = keep_alive_timeout
+        self.shutdown_grace = shutdown_grace
+        self.conversations = ConversationStore(max_conversations, idle_timeout)
+        self.active_connections = 0
+        self.requests_served = 0
+        self._in_flight: set = set()
+        self._writers: set = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._shutdown = asyncio.Event()
+
+    # HTTP plumbing
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        request_line = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+        if not request_line:
+            return None
+        try:
+            method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.keep_alive_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), path, headers, body
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int, payload: Dict, keep_alive: bool):
+        body = json.dumps(payload).encode("utf-8")
+        head = (f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if self.active_connections >= self.max_connections or self._shutdown.is_set():
+            await self._write_response(writer, 503, {"error": "Server busy"}, keep_alive=False)
+            writer.close()
+            return
+
+        self.active_connections += 1
+        self._writers.add(writer)
+        try:
+            while not self._shutdown.is_set():
+                try:
+                    request = await self._read_request(reader)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except HTTPError as e:
+                    await self._write_response(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close"
+                task = asyncio.current_task()
+                self._in_flight.add(task)
+                try:
+                    with trace(f"http {method} {path.split('?')[0]}"):
+                        status, payload = await self._dispatch(method, path, body)
+                finally:
+                    self._in_flight.discard(task)
+                self.requests_served += 1
+                await self._write_response(writer, status, payload, keep_alive and not self._shutdown.is_set())
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.active_connections -= 1
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        try:
+            if method == "GET" and path == "/health":
+                return 200, self.health()
+            if method == "DELETE" and path.startswith("/sessions/"):
+                await self.conversations.close(path[len("/sessions/"):])
+                return 200, {"closed": True}
+
+            handlers = {"/query": self.handle_query, "/respond": self.handle_respond,
+                        "/plan": self.handle_plan, "/followup": self.handle_followup}
+            if path not in handlers:
+                raise HTTPError(404, f"No endpoint {path}")
+            if method != "POST":
+                raise HTTPError(405, f"{path} only accepts POST")
+
+            try:
+                data = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                raise HTTPError(400, "Body must be JSON")
+            if not isinstance(data, dict):
+                raise HTTPError(400, "Body must be a JSON object")
+            return 200, await handlers[path](data)
+
+        except HTTPError as e:
+            return e.status, {"error": e.message}
+        except Exception as e:
+            print(f"❌ Error handling {method} {path}: {e}")
+            return 500, {"error": str(e)}
+
+    # Endpoints
+
+    @staticmethod
+    def _query(data: Dict, field: str = "query") -> str:
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise HTTPError(400, f"'{field}' is required")
+        return value
+
+    async def handle_query(self, data: Dict) -> Dict:
+        query = self._query(data)
+        sims_file_path = default_registry.path_for(data.get("user_id"))
+        timer = StageTimer()
+        decision = await route(query, timer)
+        if decision.get("sim_update") == 'y':
+            # Enqueueing is a SQLite insert and commit; keep it off the event loop
+            await asyncio.to_thread(get_update_worker().submit, sims_file_path, query)
+
+        if decision.get("action") == 'respond':
+            result = await self._respond(query, sims_file_path, timer)
+        else:
+            result = await self._start_plan(query, data.get("user_id"), sims_file_path, timer)
+        result["router"] = decision
+        return result
+
+    async def handle_respond(self, data: Dict) -> Dict:
+        query = self._query(data)
+        return await self._respond(query, default_registry.path_for(data.get("user_id")), StageTimer())
+
+    async def handle_plan(self, data: Dict) -> Dict:
+        query = self._query(data)
+        sims_file_path = default_registry.path_for(data.get("user_id"))
+        return await self._start_plan(query, data.get("user_id"), sims_file_path, StageTimer())
+
+    async def handle_followup(self, data: Dict) -> Dict:
+        answer = self._query(data, "answer")
+        conversation = self.conversations.get(str(data.get("session_id", "")))
+        if conversation.lock.locked():
+            raise HTTPError(409, "A turn is already running for this session")
+
+        async with conversation.lock:
+            timer = StageTimer()
+            return await self._plan_turn(conversation, answer, timer)
+
+    async def _respond(self, query: str, sims_file_path: str, timer: StageTimer) -> Dict:
+        answer = await answer_respond(query, sims_file_path, timer)
+        timer.mark_answer_ready()
+        return {"action": "respond", "answer": answer, "timing": timer.report()}
+
+    async def _start_plan(self, query: str, user_id: Optional[str], sims_file_path: str,
+                          timer: StageTimer) -> Dict:
+        conversation = self.conversations.create(user_id, sims_file_path)
+        async with conversation.lock:
+            try:
+                relevant_categories, conversation.sim_data = await select_plan_context(query, sims_file_path, timer)
+                result = await self._plan_turn(conversation, query, timer)
+            except Exception:
+                await self.conversations.close(conversation.id)
+                raise
+        result["relevant_categories"] = relevant_categories
+        return result
+
+    async def _plan_turn(self, conversation: Conversation, user_input: str, timer: StageTimer) -> Dict:
+        output_json = await timer.run_async(
+            "plan", plan(user_input, conversation.sim_data, conversation.state, session=conversation.mcp))
+        timer.mark_answer_ready()
+        conversation.state = output_json
+        conversation.last_used = time.monotonic()
+
+        followup_required = bool(output_json.get("followup_required"))
+        if not followup_required:
+            # Conversation finished; free its MCP server process right away
+            await self.conversations.close(conversation.id)
+        return {
+            "action": "plan",
+            "session_id": conversation.id if followup_required else None,
+            "followup_required": followup_required,
+            "followups": output_json.get("followups", []),
+            "plan": output_json,
+            "timing": timer.report(),
+        }
+
+    def health(self) -> Dict:
+        return {
+            "status": "draining" if self._shutdown.is_set() else "ok",
+            "active_connections": self.active_connections,
+            "open_sessions": len(self.conversations.conversations),
+            "requests_served": self.requests_served,
+            "profiles": default_registry.stats(),
+            "profile_update_prompts": get_update_metrics(),
+            "bedrock_clients": get_client_metrics(),
+            "embedding_cache": get_embedding_cache_stats(),
+        }
+
+    # Lifecycle
+
+    async def _reap_forever(self, interval: float = 60):
+        while True:
+            await asyncio.sleep(interval)
+            await self.conversations.reap_idle()
+
+    async def _export_traces_forever(self, interval: float):
+        # Spans are otherwise only written at shutdown, and the tracer drops
+        # new ones once its in-memory buffer is full
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(export_from_env)
+
+    def request_shutdown(self):
+        self._shutdown.set()
+
+    async def serve(self):
+        """
+        Serves until SIGINT/SIGTERM, then shuts down gracefully.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_shutdown)
+            except NotImplementedError:
+                pass
+
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_BODY_BYTES)
+        reaper = asyncio.create_task(self._reap_forever())
+        trace_exporter = asyncio.create_task(
+            self._export_traces_forever(float(os.getenv("TRACE_EXPORT_INTERVAL", "60"))))
+        update_worker = get_update_worker()
+        print(f"✓ Serving on http://{self.host}:{self.port}")
+
+        try:
+            await self._shutdown.wait()
+        finally:
+            print("Shutting down: draining in-flight requests...")
+            self._server.close()
+            if self._in_flight:
+                await asyncio.wait(set(self._in_flight), timeout=self.shutdown_grace)
+            # Idle keep-alive connections would otherwise hold wait_closed() open
+            for writer in list(self._writers):
+                writer.close()
+            reaper.cancel()
+            trace_exporter.cancel()
+            await self.conversations.close_all()
+            await asyncio.to_thread(update_worker.stop, self.shutdown_grace)
+            await self._server.wait_closed()
+            export_from_env()
+            print(f"✓ Server stopped after {self.requests_served} requests")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="HTTP server for the respond/plan pipeline")
+    parser.add_argument("--host", default=os.getenv("SERVER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("SERVER_PORT", "8080")))
+    parser.add_argument("--max-connections", type=int, default=int(os.getenv("SERVER_MAX_CONNECTIONS", "128")))
+    parser.add_argument("--max-sessions", type=int, default=int(os.getenv("SERVER_MAX_SESSIONS", "64")))
+    parser.add_argument("--session-idle-timeout", type=float,
+                        default=float(os.getenv("SERVER_SESSION_IDLE_TIMEOUT", "900")))
+    args = parser.parse_args()
+
+    load_dotenv()
+    server = PipelineServer(args.host, args.port, max_connections=args.max_connections,
+                            max_conversations=args.max_sessions, idle_timeout=args.session_idle_timeout)
+    await server.serve()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+import hashlib
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import chromadb
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from embedding_cache import get_cached_embeddings
+
+
+# One open index per (persist_directory, collection_name) for the whole process
+_open_indexes: Dict[Tuple[str, str], "PersistentSimIndex"] = {}
+
+
+def fact_search_text(category_name: str, fact_obj: Dict) -> str:
+    """
+    Builds the searchable text for a fact (the string that gets embedded).
+    """
+    return f"{category_name}: {fact_obj.get('fact', '')}"
+
+
+def content_hash(text: str) -> str:
+    """
+    Returns a stable hash of the embedded text, used to detect changed facts.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def collect_fact_entries(sims_data: Dict) -> Dict[str, Dict[str, Any]]:
+    """
+    Walks the category -> facts hierarchy and returns one entry per fact.
+
+    Entries are keyed by fact id. Profiles can contain the same id more than
+    once, so repeated ids get a '#2', '#3', ... suffix to keep every fact
+    retrievable; the entry's "fact_id" is always the original id.
+
+    Args:
+        sims_data: The full SIM JSON structure with categories
+
+    Returns:
+        Dict mapping entry key to {"fact_id", "category", "text", "hash", "fact"}
+    """
+    entries = {}
+    occurrences = {}
+
+    for category_name, category_data in sims_data.items():
+        if isinstance(category_data, dict) and "Facts" in category_data:
+            for fact_obj in category_data.get("Facts", []):
+                fact_id = fact_obj.get("id", "")
+                if not fact_id:
+                    continue
+
+                occurrences[fact_id] = occurrences.get(fact_id, 0) + 1
+                key = fact_id if occurrences[fact_id] == 1 else f"{fact_id}#{occurrences[fact_id]}"
+
+                text = fact_search_text(category_name, fact_obj)
+                entries[key] = {
+                    "fact_id": fact_id,
+                    "category": category_name,
+                    "text": text,
+                    "hash": content_hash(text),
+                    "fact": fact_obj,
+                }
+
+    return entries
+
+
+def default_index_directory(sims_file_path: str) -> str:
+    """
+    Returns the on-disk index location for a profile, e.g. 'sim.json' -> '.sim.json.chroma'.
+    """
+    directory, filename = os.path.split(os.path.abspath(sims_file_path))
+    return os.path.join(directory, f".{filename}.chroma")
+
+
+class PersistentSimIndex:
+    """
+    Persistent Chroma collection of profile facts, keyed by entry key (fact id).
+
+    Each stored vector carries the content hash of the text it was embedded
+    from, so sync() only embeds facts that were added or changed since the
+    last run and deletes the ones that disappeared from the profile.
+    """
+
+    def __init__(self, persist_directory: str, embeddings, collection_name: str = "sims_rag"):
+        self.persist_directory = persist_directory
+        self.collection_name = collection_name
+        # Own the client, so the index can be closed without reaching into the vectorstore
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.vectorstore = Chroma(
+            client=self.client,
+            collection_name=collection_name,
+            embedding_function=embeddings,
+        )
+
+    def indexed_hashes(self) -> Dict[str, str]:
+        """
+        Returns {entry_key: content_hash} for everything currently stored.
+
+        Vectors written before entries carried an entry_key get an empty hash,
+        so sync() treats them as changed and re-embeds them with the key.
+        """
+        stored = self.vectorstore.get(include=["metadatas"])
+        return {
+            key: (metadata or {}).get("content_hash", "") if (metadata or {}).get("entry_key") else ""
+            for key, metadata in zip(stored.get("ids", []), stored.get("metadatas", []))
+        }
+
+    def sync(self, entries: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Brings the index in line with the given fact entries.
+
+        Args:
+            entries: Output of collect_fact_entries()
+
+        Returns:
+            Counts of added, updated, deleted and unchanged facts
+        """
+        indexed = self.indexed_hashes()
+
+        added = [key for key in entries if key not in indexed]
+        updated = [
+            key for key in entries
+            if key in indexed and indexed[key] != entries[key]["hash"]
+        ]
+        deleted = [key for key in indexed if key not in entries]
+
+        stale_ids = updated + deleted
+        if stale_ids:
+            self.vectorstore.delete(ids=stale_ids)
+
+        to_embed = added + updated
+        if to_embed:
+            documents = [
+                Document(
+                    page_content=entries[key]["text"],
+                    metadata={
+                        "category": entries[key]["category"],
+                        "fact_id": entries[key]["fact_id"],
+                        "entry_key": key,
+                        "content_hash": entries[key]["hash"],
+                    },
+                )
+                for key in to_embed
+            ]
+            self.vectorstore.add_documents(documents, ids=to_embed)
+
+        return {
+            "added": len(added),
+            "updated": len(updated),
+            "deleted": len(deleted),
+            "unchanged": len(entries) - len(to_embed),
+        }
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[Document, float]]:
+        """
+        Embeds the query once and returns the k nearest facts with their distances.
+        """
+        return self.vectorstore.similarity_search_with_score(query, k=k)
+
+    def close(self):
+        """
+        Closes the Chroma client behind this index, releasing its SQLite
+        connections and in-memory segments.
+
+        chromadb keeps one shared System per persist directory for the whole
+        process, so dropping the vectorstore alone does not free it. Clients
+        without close() (chromadb before 1.0) are only dereferenced.
+        """
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            close()
+        self.vectorstore = None
+        self.client = None
+
+
+def get_sim_index(sims_file_path: str = "sim.json",
+                  aws_region: str = "us-east-1",
+                  persist_directory: Optional[str] = None,
+                  embeddings=None) -> PersistentSimIndex:
+    """
+    Returns the process-wide index for a profile, opening it on first use.
+
+    Args:
+        sims_file_path: Path to the sim.json file the index belongs to
+        aws_region: AWS region for Bedrock
+        persist_directory: Override for the on-disk index location
+        embeddings: Override for the embedding function
+
+    Returns:
+        The PersistentSimIndex for this profile
+    """
+    persist_directory = persist_directory or default_index_directory(sims_file_path)
+    key = (persist_directory, "sims_rag")
+
+    if key not in _open_indexes:
+        if embeddings is None:
+            embeddings = get_cached_embeddings(aws_region)
+        _open_indexes[key] = PersistentSimIndex(persist_directory, embeddings)
+
+    return _open_indexes[key]
+
+
+def release_sim_index(sims_file_path: str):
+    """
+    Closes the in-process handle of a profile's default index; the on-disk index is kept.
+    """
+    index = _open_indexes.pop((default_index_directory(sims_file_path), "sims_rag"), None)
+    if index is not None:
+        try:
+            index.close()
+        except Exception as e:
+            print(f"Warning: Could not close RAG index of {sims_file_path}: {e}")
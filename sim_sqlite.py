@@ -0,0 +1,294 @@
+import argparse
+import json
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+
+_DEFAULT_FACT_KEYS = ["id", "fact", "timestamps"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS categories (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    key_order TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS category_attributes (
+    category TEXT NOT NULL REFERENCES categories(name) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (category, name)
+);
+CREATE TABLE IF NOT EXISTS facts (
+    rowid INTEGER PRIMARY KEY,
+    fact_id TEXT NOT NULL,
+    category TEXT NOT NULL REFERENCES categories(name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    fact TEXT NOT NULL,
+    extra TEXT,
+    key_order TEXT
+);
+CREATE INDEX IF NOT EXISTS facts_by_category ON facts(category, position);
+CREATE INDEX IF NOT EXISTS facts_by_id ON facts(fact_id);
+CREATE TABLE IF NOT EXISTS fact_timestamps (
+    fact_rowid INTEGER NOT NULL REFERENCES facts(rowid) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timestamps_by_fact ON fact_timestamps(fact_rowid, position);
+"""
+
+
+def is_sqlite_path(filepath: str) -> bool:
+    """
+    Returns True if a profile path refers to a SQLite database.
+    """
+    return filepath.lower().endswith(SQLITE_EXTENSIONS)
+
+
+@contextmanager
+def _connect(db_path: str):
+    """
+    Opens a WAL-mode connection and commits (or rolls back) on exit.
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.executescript(SCHEMA)
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _insert_fact(conn, category: str, position: int, fact_obj: Dict):
+    extra = {k: v for k, v in fact_obj.items() if k not in _DEFAULT_FACT_KEYS}
+    key_order = list(fact_obj.keys())
+    cursor = conn.execute(
+        "INSERT INTO facts (fact_id, category, position, fact, extra, key_order) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            fact_obj.get("id", ""),
+            category,
+            position,
+            fact_obj.get("fact", ""),
+            json.dumps(extra) if extra else None,
+            json.dumps(key_order) if key_order != _DEFAULT_FACT_KEYS else None,
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO fact_timestamps (fact_rowid, position, timestamp) VALUES (?, ?, ?)",
+        [(cursor.lastrowid, i, ts) for i, ts in enumerate(fact_obj.get("timestamps", []))],
+    )
+
+
+def _ensure_category(conn, category: str):
+    exists = conn.execute("SELECT 1 FROM categories WHERE name = ?", (category,)).fetchone()
+    if exists:
+        return
+    position = conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM categories").fetchone()[0]
+    conn.execute(
+        "INSERT INTO categories (name, position, key_order) VALUES (?, ?, ?)",
+        (category, position, json.dumps(["Description", "Facts", "Credentials"])),
+    )
+    conn.executemany(
+        "INSERT INTO category_attributes (category, name, value) VALUES (?, ?, ?)",
+        [(category, "Description", json.dumps(f"User's {category.lower()} information")),
+         (category, "Credentials", json.dumps({}))],
+    )
+
+
+def save_sims(sims_data: Dict, db_path: str):
+    """
+    Replaces the whole profile in the database in one transaction.
+    """
+    with _connect(db_path) as conn:
+        conn.execute("DELETE FROM categories")
+        for position, (category, category_data) in enumerate(sims_data.items()):
+            if not isinstance(category_data, dict):
+                category_data = {"__value__": category_data}
+            conn.execute(
+                "INSERT INTO categories (name, position, key_order) VALUES (?, ?, ?)",
+                (category, position, json.dumps(list(category_data.keys()))),
+            )
+            for name, value in category_data.items():
+                if name == "Facts" and isinstance(value, list):
+                    for fact_position, fact_obj in enumerate(value):
+                        _insert_fact(conn, category, fact_position, fact_obj)
+                else:
+                    conn.execute(
+                        "INSERT INTO category_attributes (category, name, value) VALUES (?, ?, ?)",
+                        (category, name, json.dumps(value)),
+                    )
+
+
+def _load_facts(conn, categories: Optional[List[str]] = None) -> Dict[str, List[Dict]]:
+    query = "SELECT rowid, category, fact_id, fact, extra, key_order FROM facts"
+    params: tuple = ()
+    if categories is not None:
+        query += f" WHERE category IN ({','.join('?' * len(categories))})"
+        params = tuple(categories)
+    query += " ORDER BY category, position"
+
+    rows = conn.execute(query, params).fetchall()
+    timestamps: Dict[int, List[str]] = {}
+    if rows:
+        ts_query = "SELECT fact_rowid, timestamp FROM fact_timestamps"
+        if categories is not None:
+            ts_query += (" WHERE fact_rowid IN (SELECT rowid FROM facts WHERE category IN "
+                         f"({','.join('?' * len(categories))}))")
+        for fact_rowid, timestamp in conn.execute(ts_query + " ORDER BY fact_rowid, position", params):
+            timestamps.setdefault(fact_rowid, []).append(timestamp)
+
+    facts: Dict[str, List[Dict]] = {}
+    for rowid, category, fact_id, fact, extra, key_order in rows:
+        values = {"id": fact_id, "fact": fact, "timestamps": timestamps.get(rowid, [])}
+        if extra:
+            values.update(json.loads(extra))
+        order = json.loads(key_order) if key_order else _DEFAULT_FACT_KEYS
+        facts.setdefault(category, []).append({key: values[key] for key in order if key in values})
+    return facts
+
+
+def _load(conn, categories: Optional[List[str]] = None) -> Dict:
+    query = "SELECT name, key_order FROM categories"
+    params: tuple = ()
+    if categories is not None:
+        query += f" WHERE name IN ({','.join('?' * len(categories))})"
+        params = tuple(categories)
+    category_rows = conn.execute(query + " ORDER BY position", params).fetchall()
+
+    attributes: Dict[str, Dict] = {}
+    attr_query = "SELECT category, name, value FROM category_attributes"
+    if categories is not None:
+        attr_query += f" WHERE category IN ({','.join('?' * len(categories))})"
+    for category, name, value in conn.execute(attr_query, params):
+        attributes.setdefault(category, {})[name] = json.loads(value)
+
+    facts = _load_facts(conn, categories)
+
+    sims_data = {}
+    for name, key_order in category_rows:
+        values = attributes.get(name, {})
+        values["Facts"] = facts.get(name, [])
+        keys = json.loads(key_order)
+        if keys == ["__value__"]:
+            sims_data[name] = values["__value__"]
+        else:
+            sims_data[name] = {key: values[key] for key in keys if key in values}
+    return sims_data
+
+
+def load_sims(db_path: str) -> Dict:
+    """
+    Loads the full profile in the same layout as sim.json.
+    """
+    with _connect(db_path) as conn:
+        return _load(conn)
+
+
+def fetch_categories(category_names: List[str], db_path: str) -> Dict:
+    """
+    Loads only the named categories using the category indexes.
+    """
+    if not category_names:
+        return {}
+    with _connect(db_path) as conn:
+        data = _load(conn, list(category_names))
+    return {name: data[name] for name in category_names if name in data}
+
+
+def get_fact(fact_id: str, db_path: str) -> Optional[Dict]:
+    """
+    Looks up a single fact by id.
+    """
+    with _connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT category FROM facts WHERE fact_id = ? ORDER BY rowid LIMIT 1", (fact_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        for fact_obj in _load_facts(conn, [row[0]]).get(row[0], []):
+            if fact_obj.get("id") == fact_id:
+                return fact_obj
+    return None
+
+
+def apply_changes(records: List[Dict], db_path: str):
+    """
+    Applies fact-level change records (see sim_storage.journal_records_from_changes)
+    in a single transaction.
+    """
+    with _connect(db_path) as conn:
+        for record in records:
+            category = record["category"]
+            _ensure_category(conn, category)
+
+            if record["op"] == "delete":
+                conn.execute(
+                    "DELETE FROM facts WHERE rowid = (SELECT rowid FROM facts WHERE fact_id = ? AND category = ? "
+                    "ORDER BY position LIMIT 1)",
+                    (record["fact_id"], category),
+                )
+                continue
+
+            fact_obj = record["fact"]
+            row = conn.execute(
+                "SELECT rowid, position FROM facts WHERE fact_id = ? AND category = ? ORDER BY position LIMIT 1",
+                (fact_obj["id"], category),
+            ).fetchone()
+
+            if row is not None:
+                conn.execute("DELETE FROM facts WHERE rowid = ?", (row[0],))
+                _insert_fact(conn, category, row[1], fact_obj)
+            elif record["op"] == "add":
+                position = conn.execute(
+                    "SELECT COALESCE(MAX(position) + 1, 0) FROM facts WHERE category = ?", (category,)
+                ).fetchone()[0]
+                _insert_fact(conn, category, position, fact_obj)
+
+
+def import_json(json_path: str, db_path: str):
+    """
+    Migrates a sim.json profile into a SQLite database.
+    """
+    with open(json_path, 'r') as f:
+        sims_data = json.load(f)
+    save_sims(sims_data, db_path)
+    total_facts = sum(len(c.get("Facts", [])) for c in sims_data.values() if isinstance(c, dict))
+    print(f"✓ Imported {total_facts} facts across {len(sims_data)} categories into {db_path}")
+
+
+def export_json(db_path: str, json_path: str):
+    """
+    Exports a SQLite profile back to the sim.json layout.
+    """
+    sims_data = load_sims(db_path)
+    with open(json_path, 'w') as f:
+        json.dump(sims_data, f, indent=2)
+    print(f"✓ Exported {len(sims_data)} categories to {json_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate profiles between sim.json and SQLite")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subcommands.add_parser("import", help="sim.json -> SQLite")
+    import_parser.add_argument("json_path")
+    import_parser.add_argument("db_path")
+
+    export_parser = subcommands.add_parser("export", help="SQLite -> sim.json")
+    export_parser.add_argument("db_path")
+    export_parser.add_argument("json_path")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        import_json(args.json_path, args.db_path)
+    else:
+        export_json(args.db_path, args.json_path)
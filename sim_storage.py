@@ -0,0 +1,420 @@
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from sim_sqlite import is_sqlite_path, load_sims, save_sims
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+
+# Writers of the same profile within this process take turns
+_path_locks: Dict[str, threading.Lock] = {}
+_path_locks_lock = threading.Lock()
+
+
+def _path_lock(filepath: str) -> threading.Lock:
+    key = os.path.abspath(filepath)
+    with _path_locks_lock:
+        if key not in _path_locks:
+            _path_locks[key] = threading.Lock()
+        return _path_locks[key]
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """
+    Holds an exclusive advisory lock on lock_path, across threads and processes.
+    """
+    with _path_lock(lock_path):
+        if fcntl is None:
+            yield
+            return
+        with open(lock_path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def journal_path_for(filepath: str) -> str:
+    """
+    Returns the write-ahead journal that belongs to a profile snapshot.
+    """
+    return filepath + ".journal"
+
+
+def _read_snapshot(filepath: str) -> Dict:
+    try:
+        with open(filepath, 'r') as f:
+            data = json.load(f)
+
+            if isinstance(data, dict):
+                return data
+            else:
+                print(f"Warning: Unexpected format in {filepath}")
+                return {}
+
+    except FileNotFoundError:
+        print(f"Warning: {filepath} not found. Creating new structure.")
+        return {}
+    except json.JSONDecodeError:
+        print(f"Error: Could not parse {filepath}. Please check file format.")
+        return {}
+
+
+def _read_snapshot_strict(filepath: str) -> Dict:
+    """
+    Reads a snapshot for compaction: a missing file is an empty profile, but
+    an unreadable or malformed one raises instead of reading as empty, so
+    the journal is never folded into (and written over) a blank profile.
+    """
+    try:
+        with open(filepath, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f"Unexpected format in {filepath}")
+    return data
+
+
+def load_sims_from_file(filepath: str = "sim.json") -> Dict:
+    """
+    Load existing sims from a JSON file.
+
+    If the profile has a write-ahead journal, its change records are replayed
+    on top of the snapshot.
+
+    Paths ending in .db/.sqlite/.sqlite3 are read from the SQLite store.
+
+    Args:
+        filepath: Path to the sim.json file
+
+    Returns:
+        Dictionary with the full SIM structure
+    """
+    if is_sqlite_path(filepath):
+        try:
+            return load_sims(filepath)
+        except sqlite3.Error as e:
+            print(f"Error: Could not read {filepath}: {e}")
+            return {}
+
+    data = _read_snapshot(filepath)
+
+    journal_path = journal_path_for(filepath)
+    for path in (journal_path + ".compacting", journal_path):
+        if os.path.exists(path):
+            replay_journal_records(data, read_journal(path))
+
+    return data
+
+
+def _write_atomically(filepath: str, text: str):
+    """
+    Writes a file via a temp file, fsync and rename so readers never see a partial write.
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    with _path_lock(filepath):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def save_sims_to_file(sims_data: Dict, filepath: str = "sim.json"):
+    """
+    Save sims to a JSON file.
+
+    The file is replaced atomically, so a crash mid-write leaves the previous
+    version intact.
+
+    SQLite paths are written in a single transaction instead.
+
+    Args:
+        sims_data: Full SIM dictionary to save
+        filepath: Path to the sim.json file
+
+    Raises:
+        OSError or sqlite3.Error if the profile could not be written
+    """
+    try:
+        if is_sqlite_path(filepath):
+            save_sims(sims_data, filepath)
+        else:
+            _write_atomically(filepath, json.dumps(sims_data, indent=2))
+    except Exception as e:
+        print(f"Error saving to {filepath}: {e}")
+        raise
+
+    # Count total facts
+    total_facts = sum(
+        len(cat_data.get("Facts", []))
+        for cat_data in sims_data.values()
+        if isinstance(cat_data, dict)
+    )
+    print(f"✓ Saved {total_facts} facts across {len(sims_data)} categories to {filepath}")
+
+
+def journal_records_from_changes(changes: Dict[str, List]) -> List[Dict]:
+    """
+    Converts the change summary of FactStore.apply_batch into journal records.
+    """
+    records = []
+    for change in changes.get("updated", []):
+        records.append({"op": "update", "category": change["category"], "fact": change["fact"]})
+    for change in changes.get("added", []):
+        records.append({"op": "add", "category": change["category"], "fact": change["fact"]})
+    for change in changes.get("deleted", []):
+        records.append({"op": "delete", "category": change["category"], "fact_id": change["fact_id"],
+                        "fact": change.get("fact")})
+    return records
+
+
+def read_journal(journal_path: str) -> List[Dict]:
+    """
+    Reads journal records, ignoring a torn final line left by a crash.
+    """
+    records = []
+    with open(journal_path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+def replay_journal_records(sims_data: Dict, records: List[Dict]) -> Dict:
+    """
+    Applies fact-level journal records to a SIM structure in place.
+
+    Replay is idempotent (an add of an id already present replaces it, and a
+    delete only removes a fact identical to the deleted one - same id, text
+    and timestamps), so records replayed twice after an interrupted
+    compaction do no harm even though profiles can repeat an id.
+    """
+    for record in records:
+        category = record["category"]
+        if category not in sims_data:
+            sims_data[category] = {
+                "Description": f"User's {category.lower()} information",
+                "Facts": [],
+                "Credentials": {}
+            }
+        facts = sims_data[category].setdefault("Facts", [])
+
+        if record["op"] in ("add", "update"):
+            fact_id = record["fact"]["id"]
+            for i, fact_obj in enumerate(facts):
+                if fact_obj.get("id") == fact_id:
+                    facts[i] = record["fact"]
+                    break
+            else:
+                if record["op"] == "add":
+                    facts.append(record["fact"])
+        elif record["op"] == "delete":
+            for i, fact_obj in enumerate(facts):
+                # Records written before deletes carried the fact match on id alone
+                if fact_obj.get("id") == record["fact_id"] and record.get("fact") in (None, fact_obj):
+                    del facts[i]
+                    break
+
+    return sims_data
+
+
+class SimJournal:
+    """
+    Append-only write-ahead journal for a profile snapshot.
+
+    Changes are appended as compact one-line JSON records to '<profile>.journal'
+    and fsynced in groups: once group_size records are pending or
+    group_interval seconds have passed since the last sync. compact() folds
+    the journal back into the snapshot with an atomic rename; the journal is
+    first renamed to '.journal.compacting' so concurrent appends go to a fresh
+    file, and load_sims_from_file replays both if a crash interrupts compaction.
+
+    Several processes may journal the same profile: appends and the rename
+    happen under an exclusive file lock ('<journal>.lock'), and a writer whose
+    open journal was renamed away by another process's compaction reopens
+    the fresh journal before appending.
+    """
+
+    def __init__(self, filepath: str = "sim.json", group_size: int = 32, group_interval: float = 0.5,
+                 compact_threshold: int = 1000):
+        self.filepath = filepath
+        self.journal_path = journal_path_for(filepath)
+        self.lock_path = self.journal_path + ".lock"
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.compact_threshold = compact_threshold
+        self.records_since_compaction = self._count_records()
+        self.fsyncs = 0
+        self.compactions = 0
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self._file = None
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _count_records(self) -> int:
+        if not os.path.exists(self.journal_path):
+            return 0
+        with open(self.journal_path, 'r') as f:
+            return sum(1 for _ in f)
+
+    def _open(self):
+        if self._file is not None and self._rotated():
+            self._sync_locked()
+            self._file.close()
+            self._file = None
+            self.records_since_compaction = self._count_records()
+        if self._file is None:
+            self._file = open(self.journal_path, 'a')
+        return self._file
+
+    def _rotated(self) -> bool:
+        """
+        True if the open journal is no longer the file at journal_path.
+        """
+        try:
+            return os.stat(self.journal_path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _sync_locked(self):
+        if self._file is not None and self._pending:
+            os.fsync(self._file.fileno())
+            self.fsyncs += 1
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def append(self, records: List[Dict]):
+        """
+        Appends change records; they are durable after the next group fsync.
+        """
+        if not records:
+            return
+        with self._lock, file_lock(self.lock_path):
+            f = self._open()
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            # Visible to readers right away; durable after the group fsync
+            f.flush()
+            self._pending += len(records)
+            self.records_since_compaction += len(records)
+            if self._pending >= self.group_size or time.monotonic() - self._last_sync >= self.group_interval:
+                self._sync_locked()
+
+    def sync(self):
+        """
+        Forces pending records to disk.
+        """
+        with self._lock:
+            self._sync_locked()
+
+    def load(self) -> Dict:
+        """
+        Returns the profile: snapshot plus replayed journal.
+        """
+        self.sync()
+        return load_sims_from_file(self.filepath)
+
+    def compact(self) -> bool:
+        """
+        Folds the journal into the snapshot.
+
+        Returns:
+            True if there was anything to compact
+
+        Raises:
+            ValueError: If the snapshot exists but cannot be parsed; the
+                journal is left in place
+        """
+        compacting_path = self.journal_path + ".compacting"
+        with self._compact_lock, file_lock(self.journal_path + ".compact-lock"):
+            with self._lock, file_lock(self.lock_path):
+                self._sync_locked()
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                if not os.path.exists(self.journal_path) and not os.path.exists(compacting_path):
+                    return False
+                if os.path.exists(self.journal_path) and not os.path.exists(compacting_path):
+                    os.replace(self.journal_path, compacting_path)
+                self.records_since_compaction = self._count_records()
+
+            # Appends can continue into a fresh journal while the snapshot is
+            # rewritten. A corrupt snapshot raises here and the journal is kept.
+            data = _read_snapshot_strict(self.filepath)
+            replay_journal_records(data, read_journal(compacting_path))
+            _write_atomically(self.filepath, json.dumps(data, indent=2))
+            os.remove(compacting_path)
+            self.compactions += 1
+            return True
+
+    def start_background_compaction(self):
+        """
+        Starts a daemon thread that fsyncs pending records every group_interval
+        and compacts once compact_threshold records have accumulated.
+        """
+        def _run():
+            while not self._stop.wait(self.group_interval):
+                self.sync()
+                if self.records_since_compaction >= self.compact_threshold:
+                    try:
+                        self.compact()
+                    except Exception as e:
+                        print(f"Error compacting {self.journal_path}: {e}")
+
+        if self._compactor is None or not self._compactor.is_alive():
+            self._stop.clear()
+            self._compactor = threading.Thread(target=_run, name="sim-journal-compactor", daemon=True)
+            self._compactor.start()
+
+    def close(self):
+        """
+        Stops background compaction and syncs the journal.
+        """
+        self._stop.set()
+        with self._lock:
+            self._sync_locked()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+# Journals are shared per profile path within the process
+_journals: Dict[str, SimJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_journal(filepath: str = "sim.json") -> SimJournal:
+    """
+    Returns the process-wide journal for a profile, starting its background compaction.
+    """
+    with _journals_lock:
+        if filepath not in _journals:
+            journal = SimJournal(filepath)
+            journal.start_background_compaction()
+            atexit.register(journal.close)
+            _journals[filepath] = journal
+        return _journals[filepath]
@@ -1,20 +1,33 @@
-import boto3
+from bedrock_clients import get_bedrock_client
 from botocore.exceptions import ClientError
 import json
-from typing import Dict, List, Optional
-from datetime import datetime
+import os
+import time
+from typing import Dict, List, Optional, Union
+from numpy_retriever import get_fact_retriever
+from fact_store import FactStore
+from profile_registry import default_registry
+from sim_storage import get_journal, journal_records_from_changes
+from sim_sqlite import is_sqlite_path, apply_changes
+from tokens import estimate_tokens, estimate_json_tokens
 
+# Prompt size and latency of update_user_sims, per mode ("full" / "scoped")
+_update_metrics: Dict[str, Dict[str, float]] = {}
 
-def flatten_sims_for_llm(sims_data: Dict) -> List[Dict]:
+
+def flatten_sims_for_llm(sims_data: Union[Dict, FactStore]) -> List[Dict]:
     """
     Flattens the hierarchical SIM structure into a list of facts for LLM processing.
     
     Args:
-        sims_data: The full SIM JSON structure with categories
+        sims_data: The full SIM JSON structure with categories, or a FactStore
     
     Returns:
         List of all facts from all categories
     """
+    if isinstance(sims_data, FactStore):
+        return sims_data.facts()
+
     all_facts = []
     
     for category, category_data in sims_data.items():
@@ -26,13 +39,85 @@ def flatten_sims_for_llm(sims_data: Dict) -> List[Dict]:
     return all_facts
 
 
-def update_user_sims(user_query: str, existing_sims: List[Dict]) -> Dict:
+def id_high_water_marks(sims_data: Union[Dict, FactStore]) -> Dict[str, str]:
+    """
+    Returns the highest existing fact id per id prefix, e.g. {"travel": "travel_010"}.
+    """
+    store = sims_data if isinstance(sims_data, FactStore) else FactStore(sims_data)
+    return store.high_water_marks()
+
+
+def scoped_sims_context(user_query: str, sims_data: Dict, token_budget: int,
+                        sims_file_path: str = "sim.json", max_candidates: int = 20) -> str:
+    """
+    Builds the EXISTING SIMS block from only the facts closest to the query.
+
+    Candidates are taken in similarity order until token_budget is reached,
+    followed by the per-prefix id high-water marks the model needs to number
+    new facts.
+    """
+    store = sims_data if isinstance(sims_data, FactStore) else FactStore(sims_data)
+    retriever = get_fact_retriever(sims_file_path)
+    retriever.build(store.fact_entries())
+
+    marks = store.high_water_marks()
+    marks_text = json.dumps(marks, indent=2)
+    remaining = token_budget - estimate_tokens(marks_text)
+
+    candidates = []
+    for record in retriever.search(user_query, k=max_candidates):
+        candidate = {"category": record["category"], **record["fact"]}
+        cost = estimate_json_tokens(candidate, indent=2)
+        if cost > remaining:
+            break
+        candidates.append(candidate)
+        remaining -= cost
+
+    return (
+        "(Only the existing facts most related to the query are shown.)\n"
+        f"{json.dumps(candidates, indent=2)}\n\n"
+        "HIGHEST EXISTING FACT ID PER PREFIX (new fact_ids must continue from these):\n"
+        f"{marks_text}"
+    )
+
+
+def _record_update_metrics(mode: str, prompt_tokens: int, latency: float):
+    metrics = _update_metrics.setdefault(mode, {"calls": 0, "prompt_tokens": 0, "latency_seconds": 0.0})
+    metrics["calls"] += 1
+    metrics["prompt_tokens"] += prompt_tokens
+    metrics["latency_seconds"] += latency
+
+
+def get_update_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    Returns average prompt tokens and latency of update_user_sims per mode.
+    """
+    report = {}
+    for mode, metrics in _update_metrics.items():
+        calls = metrics["calls"]
+        report[mode] = {
+            "calls": calls,
+            "avg_prompt_tokens": metrics["prompt_tokens"] / calls if calls else 0.0,
+            "avg_latency_seconds": metrics["latency_seconds"] / calls if calls else 0.0,
+        }
+    return report
+
+
+def update_user_sims(user_query: str, existing_sims: List[Dict], mode: Optional[str] = None,
+                     token_budget: Optional[int] = None, sims_file_path: str = "sim.json") -> Dict:
     """
     Analyzes user query with all existing sims and returns what action to take (add/update/both/nothing).
     
     Args:
         user_query: The user's input message
         existing_sims: List of existing fact dictionaries from all categories
+            (or the full SIM dict / an already loaded FactStore)
+        mode: "full" sends the whole profile; "scoped" sends only the facts
+            retrieved as closest to the query plus id high-water marks.
+            Defaults to the SIM_UPDATE_MODE environment variable, then "full".
+        token_budget: Token budget for the scoped profile context
+            (default SIM_UPDATE_TOKEN_BUDGET, then 1500)
+        sims_file_path: Profile path, used to reuse that profile's retriever
     
     Returns:
         Dict with one of these formats:
@@ -40,16 +125,28 @@ def update_user_sims(user_query: str, existing_sims: List[Dict]) -> Dict:
         - {"action": "update", "updates": [{"fact_id": "...", "fact": "..."}]}
         - {"action": "both", "updates": [...], "additions": [...]}
         - {"action": "nothing"}
+        A failed model call or unparseable reply returns {"action": "nothing",
+        "error": "..."}, so callers that must not lose the update can retry.
     """
     
     # Create an Amazon Bedrock Runtime client
-    brt = boto3.client("bedrock-runtime")
+    brt = get_bedrock_client()
     
     # Set the model ID for Mistral
     model_id = "mistral.mistral-large-2402-v1:0"
     
+    mode = mode or os.getenv("SIM_UPDATE_MODE", "full")
+    if mode == "scoped" and not isinstance(existing_sims, (dict, FactStore)):
+        mode = "full"
+    if mode != "scoped" and isinstance(existing_sims, FactStore):
+        existing_sims = existing_sims.view()
+
     # Format existing sims for the prompt
-    existing_sims_text = json.dumps(existing_sims, indent=2) if existing_sims else "[]"
+    if mode == "scoped" and existing_sims:
+        token_budget = token_budget or int(os.getenv("SIM_UPDATE_TOKEN_BUDGET", "1500"))
+        existing_sims_text = scoped_sims_context(user_query, existing_sims, token_budget, sims_file_path)
+    else:
+        existing_sims_text = json.dumps(existing_sims, indent=2) if existing_sims else "[]"
     
     # Create the sim update prompt - NOTE: All JSON examples use {{ }} to escape braces
     system_message = """SYSTEM:
@@ -182,11 +279,17 @@ Return ONLY the JSON response, no other text."""
     
     try:
         # Send the message to Mistral
+        start = time.perf_counter()
         response = brt.converse(
             modelId=model_id,
             messages=conversation,
             inferenceConfig={"maxTokens": 1000, "temperature": 0.2, "topP": 0.9},
         )
+        _record_update_metrics(
+            mode,
+            response.get("usage", {}).get("inputTokens") or estimate_tokens(conversation[0]["content"][0]["text"]),
+            time.perf_counter() - start,
+        )
         
         # Extract the response text
         response_text = response["output"]["message"]["content"][0]["text"]
@@ -206,168 +309,82 @@ Return ONLY the JSON response, no other text."""
     except json.JSONDecodeError as e:
         print(f"ERROR: Could not parse JSON from response: {response_text}")
         print(f"JSON Error: {e}")
-        return {"action": "nothing"}
+        return {"action": "nothing", "error": f"Unparseable response: {e}"}
         
     except (ClientError, Exception) as e:
         print(f"ERROR: Can't invoke '{model_id}'. Reason: {e}")
-        return {"action": "nothing"}
+        return {"action": "nothing", "error": f"Can't invoke '{model_id}': {e}"}
 
 
-def get_category_from_fact_id(fact_id: str) -> str:
+def get_category_from_fact_id(fact_id: str, store: Optional[FactStore] = None) -> str:
     """
     Extracts category name from fact_id (e.g., 'travel_001' -> 'Travel')
+
+    With a FactStore, prefixes already used in the profile take precedence
+    over the default prefix map.
     """
-    prefix = fact_id.split('_')[0]
-    category_map = {
-        'travel': 'Travel',
-        'health': 'Health',
-        'family': 'Family',
-        'pet': 'Pets',
-        'hobby': 'Hobbies',
-        'work': 'Work',
-        'financial': 'Financial',
-        'education': 'Education',
-        'lifestyle': 'Lifestyle',
-        'social': 'Social',
-        'personality': 'Personality',
-        'values': 'Values',
-        'preferences': 'Preferences'
-    }
-    return category_map.get(prefix, 'Lifestyle')  # Default to Lifestyle if unknown
-
-
-def apply_sim_action(action_result: Dict, filepath: str = "sim.json") -> bool:
+    return (store or FactStore({})).category_for_fact_id(fact_id)
+
+
+def apply_sim_action(action_result: Dict, filepath: str = "sim.json", store: Optional[FactStore] = None,
+                     journaled: Optional[bool] = None) -> bool:
     """
     Applies the action returned by update_user_sims to the sim.json file.
+
+    All updates, additions and deletions are applied in one pass through a
+    FactStore. Additions whose fact_id is missing or already taken get the
+    next free id for their category.
     
     Args:
         action_result: The dict returned by update_user_sims
         filepath: Path to the sim.json file
+        store: Already loaded FactStore for this profile (loaded from filepath if omitted)
+        journaled: Append fact-level change records to the profile's journal
+            instead of rewriting sim.json (default: SIM_STORAGE=journal).
+            SQLite profiles always apply the changes as one transaction.
         
     Returns:
         True if successful, False otherwise
     """
     action = action_result.get("action", "nothing")
     
-    if action == "nothing":
+    if action == "nothing" and not action_result.get("deletions"):
         print("No changes to apply.")
         return True
     
     # Load current sims
-    sims_data = load_sims_from_file(filepath)
-    current_timestamp = datetime.utcnow().isoformat() + "Z"
-    
-    # Handle UPDATES
-    if action in ["update", "both"]:
-        updates = action_result.get("updates", [])
-        for update in updates:
-            fact_id = update["fact_id"]
-            new_fact = update["fact"]
-            
-            # Find and update the fact
-            updated = False
-            for category, category_data in sims_data.items():
-                if isinstance(category_data, dict) and "Facts" in category_data:
-                    for i, fact_obj in enumerate(category_data["Facts"]):
-                        if fact_obj.get("id") == fact_id:
-                            # Append new timestamp to existing timestamps
-                            existing_timestamps = fact_obj.get("timestamps", [])
-                            existing_timestamps.append(current_timestamp)
-                            
-                            # Update the fact
-                            sims_data[category]["Facts"][i] = {
-                                "id": fact_id,
-                                "fact": new_fact,
-                                "timestamps": existing_timestamps
-                            }
-                            updated = True
-                            print(f"✓ Updated fact: {fact_id}")
-                            break
-                if updated:
-                    break
-            
-            if not updated:
-                print(f"Warning: Could not find fact with id '{fact_id}'")
-    
-    # Handle ADDITIONS
-    if action in ["add", "both"]:
-        additions = action_result.get("additions", [])
-        for addition in additions:
-            fact_id = addition["fact_id"]
-            new_fact = addition["fact"]
-            
-            # Determine which category this belongs to
-            category = get_category_from_fact_id(fact_id)
-            
-            # Ensure category exists
-            if category not in sims_data:
-                sims_data[category] = {
-                    "Description": f"User's {category.lower()} information",
-                    "Facts": [],
-                    "Credentials": {}
-                }
-            
-            # Add the new fact
-            new_fact_obj = {
-                "id": fact_id,
-                "fact": new_fact,
-                "timestamps": [current_timestamp]
-            }
-            
-            sims_data[category]["Facts"].append(new_fact_obj)
-            print(f"✓ Added new fact: {fact_id} to category {category}")
-    
-    # Save the updated data
-    save_sims_to_file(sims_data, filepath)
-    return True
+    store = store or default_registry.load(filepath)
 
+    changes = store.apply_batch(
+        updates=action_result.get("updates", []) if action in ["update", "both"] else [],
+        additions=action_result.get("additions", []) if action in ["add", "both"] else [],
+        deletions=action_result.get("deletions", []),
+    )
 
-def load_sims_from_file(filepath: str = "sim.json") -> Dict:
-    """
-    Load existing sims from a JSON file.
+    for change in changes["updated"]:
+        print(f"✓ Updated fact: {change['fact']['id']}")
+    for change in changes["added"]:
+        print(f"✓ Added new fact: {change['fact']['id']} to category {change['category']}")
+    for change in changes["deleted"]:
+        print(f"✓ Deleted fact: {change['fact_id']}")
+    for fact_id in changes["missing"]:
+        print(f"Warning: Could not find fact with id '{fact_id}'")
     
-    Args:
-        filepath: Path to the sim.json file
-        
-    Returns:
-        Dictionary with the full SIM structure
-    """
-    try:
-        with open(filepath, 'r') as f:
-            data = json.load(f)
-            
-            if isinstance(data, dict):
-                return data
-            else:
-                print(f"Warning: Unexpected format in {filepath}")
-                return {}
-                
-    except FileNotFoundError:
-        print(f"Warning: {filepath} not found. Creating new structure.")
-        return {}
-    except json.JSONDecodeError:
-        print(f"Error: Could not parse {filepath}. Please check file format.")
-        return {}
-
-
-def save_sims_to_file(sims_data: Dict, filepath: str = "sim.json"):
-    """
-    Save sims to a JSON file.
+    if journaled is None:
+        journaled = os.getenv("SIM_STORAGE", "json") == "journal"
 
-    Args:
-        sims_data: Full SIM dictionary to save
-        filepath: Path to the sim.json file
-    """
+    # Save the updated data
     try:
-        with open(filepath, 'w') as f:
-            json.dump(sims_data, f, indent=2)
-
-        # Count total facts
-        total_facts = sum(
-            len(cat_data.get("Facts", []))
-            for cat_data in sims_data.values()
-            if isinstance(cat_data, dict)
-        )
-        print(f"✓ Saved {total_facts} facts across {len(sims_data)} categories to {filepath}")
+        if is_sqlite_path(filepath):
+            # Row-level changes in one transaction instead of rewriting the profile
+            apply_changes(journal_records_from_changes(changes), filepath)
+        elif journaled:
+            get_journal(filepath).append(journal_records_from_changes(changes))
+        else:
+            store.save(filepath)
     except Exception as e:
-        print(f"Error saving to {filepath}: {e}")
\ No newline at end of file
+        print(f"Error saving changes to {filepath}: {e}")
+        return False
+    # The in-memory snapshot already holds the change; don't re-parse our own write
+    default_registry.mark_written(filepath)
+    return True
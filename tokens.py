@@ -0,0 +1,22 @@
+import json
+from typing import Any
+
+
+# Rough characters-per-token ratio for English prose and JSON with the Llama/Mistral tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the token count of a string without calling a tokenizer.
+    """
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def estimate_json_tokens(value: Any, indent: int = None) -> int:
+    """
+    Estimates the token count of a value once serialized to JSON.
+    """
+    return estimate_tokens(json.dumps(value, indent=indent))
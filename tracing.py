@@ -0,0 +1,370 @@
+import argparse
+import contextvars
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values (0.0 for an empty list).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Span:
+    """
+    One timed operation. Spans nest through a context variable, so a span
+    opened inside another (in the same task, or in a thread started with
+    asyncio.to_thread) becomes its child.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_time = time.time()
+        self.duration: Optional[float] = None
+        self.error: Optional[str] = None
+        self.thread = threading.current_thread().name
+        self._start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        tracer.record(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "thread": self.thread,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class Tracer:
+    """
+    Collects finished spans in memory (bounded) and exports them.
+    """
+
+    def __init__(self, enabled: bool = True, max_spans: int = 50000):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self.spans: List[Dict[str, Any]] = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def record(self, span: Span):
+        with self._lock:
+            if len(self.spans) >= self.max_spans:
+                self.dropped += 1
+                return
+            self.spans.append(span.to_dict())
+
+    def drain(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def export_jsonl(self, path: str):
+        """
+        Appends finished spans to a JSON lines file and clears them from memory.
+        """
+        spans = self.drain()
+        with open(path, 'a') as f:
+            for span in spans:
+                f.write(json.dumps(span, default=str) + "\n")
+        print(f"✓ Wrote {len(spans)} spans to {path}")
+
+    def export_chrome(self, path: str):
+        """
+        Writes finished spans as a Chrome trace (chrome://tracing, Perfetto) and clears them.
+
+        Events already in the file from an earlier export are kept, so
+        periodic exports build up one trace.
+        """
+        spans = self.drain()
+        trace_json = chrome_trace(spans)
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    trace_json["traceEvents"] = json.load(f).get("traceEvents", []) + trace_json["traceEvents"]
+            except (OSError, ValueError) as e:
+                print(f"Warning: Overwriting unreadable trace file {path}: {e}")
+        with open(path, 'w') as f:
+            json.dump(trace_json, f)
+        print(f"✓ Wrote {len(spans)} spans to {path}")
+
+
+tracer = Tracer(enabled=os.getenv("TRACING", "on").lower() != "off")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, **attributes) -> Optional[Span]:
+    """
+    Starts a span under the current one without making it current; the
+    caller must call finish(). Used where start and end are separate callbacks.
+    """
+    if not tracer.enabled:
+        return None
+    return Span(name, _current_span.get(), attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Times the enclosed block as a child of the current span.
+    """
+    if not tracer.enabled:
+        yield None
+        return
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.finish(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Starts a new trace: a root span with a fresh trace id, whatever span is current.
+    """
+    if not tracer.enabled:
+        yield None
+        return
+    root = Span(name, None, attributes)
+    token = _current_span.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.finish(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        root.finish()
+
+
+# Bedrock instrumentation via botocore events. before-parameter-build and after-call
+# for one request share the same `context` dict, which carries the span.
+
+def _before_call(params, model, context, **kwargs):
+    started = start_span(f"bedrock.{model.name}", operation=model.name, model_id=params.get("modelId"))
+    if started is not None:
+        context["trace_span"] = started
+
+
+def _after_call(http_response, parsed, model, context, **kwargs):
+    started = context.pop("trace_span", None)
+    if started is None:
+        return
+    usage = parsed.get("usage") or {}
+    headers = getattr(http_response, "headers", {}) or {}
+    started.set(
+        input_tokens=usage.get("inputTokens", _int_header(headers, "x-amzn-bedrock-input-token-count")),
+        output_tokens=usage.get("outputTokens", _int_header(headers, "x-amzn-bedrock-output-token-count")),
+        cache_read_tokens=usage.get("cacheReadInputTokens"),
+        retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+        status_code=getattr(http_response, "status_code", None),
+    )
+    if getattr(model, "has_event_stream_output", False):
+        # Fires once the headers arrive; the stream's tokens and duration are
+        # set on the consumer's span (stage.respond) when it ends
+        started.set(streaming=True)
+    error = parsed.get("Error")
+    if error:
+        started.error = f"{error.get('Code')}: {error.get('Message', '')}"
+    started.finish()
+
+
+def _after_call_error(context, exception, **kwargs):
+    started = context.pop("trace_span", None)
+    if started is not None:
+        started.finish(exception)
+
+
+def _int_header(headers, name: str) -> Optional[int]:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def instrument_bedrock_client(client):
+    """
+    Records a span with tokens and retries for every call made by a boto3 bedrock-runtime client.
+    """
+    events = client.meta.events
+    events.register("before-parameter-build.bedrock-runtime", _before_call)
+    events.register("after-call.bedrock-runtime", _after_call)
+    events.register("after-call-error.bedrock-runtime", _after_call_error)
+
+
+def instrument_mcp_client(client):
+    """
+    Wraps every MCP tool call of the client's sessions in a span.
+    """
+    for session in client.sessions.values():
+        connector = session.connector
+        if getattr(connector, "_tracing_installed", False):
+            continue
+
+        original_call_tool = connector.call_tool
+
+        async def traced_call_tool(name, arguments=None, *args, _original=original_call_tool, **kwargs):
+            with span("mcp.tool", tool=name) as tool_span:
+                result = await _original(name, arguments, *args, **kwargs)
+                if tool_span is not None:
+                    tool_span.set(is_error=bool(getattr(result, "isError", False)))
+                return result
+
+        connector.call_tool = traced_call_tool
+        connector._tracing_installed = True
+
+
+def export_from_env():
+    """
+    Exports collected spans to TRACE_EXPORT (if set) in TRACE_FORMAT (jsonl or chrome).
+    """
+    path = os.getenv("TRACE_EXPORT")
+    if not path:
+        return
+    if os.getenv("TRACE_FORMAT", "jsonl") == "chrome":
+        tracer.export_chrome(path)
+    else:
+        tracer.export_jsonl(path)
+
+
+# Offline tools over exported spans
+
+def read_spans(path: str) -> List[Dict[str, Any]]:
+    spans = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+
+def chrome_trace(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Converts spans to Chrome trace events; each trace gets its own row group.
+
+    Row ids are derived from the trace id and thread name rather than
+    numbered per call, so spans of one trace exported in separate batches
+    still land in the same group.
+    """
+    events = []
+    for s in spans:
+        pid = int(s["trace_id"][:7], 16)
+        tid = zlib.crc32(s.get("thread", "").encode("utf-8")) & 0x7FFFFFFF
+        args = dict(s.get("attributes") or {})
+        if s.get("error"):
+            args["error"] = s["error"]
+        events.append({
+            "name": s["name"],
+            "cat": s["name"].split(".")[0],
+            "ph": "X",
+            "ts": s["start_time"] * 1e6,
+            "dur": (s.get("duration") or 0.0) * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summarize(spans: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Aggregates latency percentiles, tokens, retries and errors per span name.
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for s in spans:
+        groups[s["name"]].append(s)
+
+    summary = {}
+    for name, group in groups.items():
+        durations = [s.get("duration") or 0.0 for s in group]
+        attributes = [s.get("attributes") or {} for s in group]
+        summary[name] = {
+            "count": len(group),
+            "p50": percentile(durations, 50),
+            "p95": percentile(durations, 95),
+            "total_seconds": sum(durations),
+            "input_tokens": sum(a.get("input_tokens") or 0 for a in attributes),
+            "output_tokens": sum(a.get("output_tokens") or 0 for a in attributes),
+            "retries": sum(a.get("retries") or 0 for a in attributes),
+            "errors": sum(1 for s in group if s.get("error")),
+        }
+    return summary
+
+
+def format_summary(summary: Dict[str, Dict[str, float]]) -> str:
+    lines = [f"{'span':<34} {'n':>6} {'p50':>8} {'p95':>8} {'in_tok':>9} {'out_tok':>8} {'retries':>7} {'errors':>6}"]
+    for name, s in sorted(summary.items(), key=lambda item: -item[1]["total_seconds"]):
+        lines.append(f"{name:<34} {s['count']:>6} {s['p50']:>7.3f}s {s['p95']:>7.3f}s "
+                     f"{s['input_tokens']:>9} {s['output_tokens']:>8} {s['retries']:>7} {s['errors']:>6}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect exported pipeline traces")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    summary_parser = subcommands.add_parser("summary", help="p50/p95 latency, tokens and retries per span name")
+    summary_parser.add_argument("trace_path", help="JSON lines file written with TRACE_FORMAT=jsonl")
+
+    chrome_parser = subcommands.add_parser("chrome", help="Convert JSON lines spans to a Chrome trace")
+    chrome_parser.add_argument("trace_path")
+    chrome_parser.add_argument("output_path")
+
+    args = parser.parse_args()
+    spans = read_spans(args.trace_path)
+    if args.command == "summary":
+        if not spans:
+            sys.exit(f"No spans in {args.trace_path}")
+        print(format_summary(summarize(spans)))
+    else:
+        with open(args.output_path, 'w') as f:
+            json.dump(chrome_trace(spans), f)
+        print(f"✓ Wrote {len(spans)} spans to {args.output_path}")